@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LMS.settings')
+# Same routes, with filter_books and request_book as async views
+os.environ.setdefault('LMS_ROOT_URLCONF', 'LMS.asgi_urls')
 
 application = get_asgi_application()
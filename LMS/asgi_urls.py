@@ -0,0 +1,22 @@
+"""
+URLconf used under ASGI (see asgi.py): the same routes as LMS.urls, with the
+browse APIs served by their async views.
+
+The async views only pay off on an event loop; under WSGI each call would be
+wrapped in async_to_sync, so LMS.urls keeps the sync ones.
+"""
+from django.urls import path
+
+from . import views
+from .urls import urlpatterns as sync_urlpatterns
+
+ASYNC_VIEWS = {
+    'filter_books': views.afilter_books,
+    'request_book': views.arequest_book,
+}
+
+urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS[pattern.name], name=pattern.name)
+    if getattr(pattern, 'name', None) in ASYNC_VIEWS else pattern
+    for pattern in sync_urlpatterns
+]
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -58,7 +59,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'LMS.urls'
+# asgi.py switches this to LMS.asgi_urls, which serves the browse APIs asynchronously
+ROOT_URLCONF = os.environ.get('LMS_ROOT_URLCONF', 'LMS.urls')
 
 TEMPLATES = [
     {
@@ -81,14 +83,68 @@ WSGI_APPLICATION = 'LMS.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+#
+# LMS_DB_PROFILE=tuned (the default) sets SQLite up for many concurrent users:
+#   - with LMS_SQLITE_WAL=1, WAL, so readers never wait for the writer, and
+#     synchronous=NORMAL, safe with WAL and much cheaper per commit;
+#   - a larger page cache and memory-mapped reads;
+#   - BEGIN IMMEDIATE for every atomic() block, so a write transaction takes
+#     the lock up front and waits for it (busy timeout) instead of failing to
+#     upgrade a read lock with "database is locked";
+#   - persistent connections instead of reopening the file per request.
+# LMS_DB_PROFILE=stock keeps Django's defaults, e.g. for comparison with
+# `manage.py bench_sqlite`. Individual knobs can be overridden below.
+#
+# WAL is opt-in because it is stored in the database file itself: turning it
+# on for every connection would convert the db.sqlite3 checked into git the
+# first time any manage.py command opened it. Set LMS_SQLITE_WAL=1 where the
+# site is served, against its own database (LMS_DB_NAME).
+
+DB_PROFILE = os.environ.get('LMS_DB_PROFILE', 'tuned')
+SQLITE_WAL = os.environ.get('LMS_SQLITE_WAL', '0') == '1'
+
+SQLITE_PRAGMAS = {
+    'cache_size': int(os.environ.get('LMS_SQLITE_CACHE_KIB', 64 * 1024)) * -1, # negative = KiB
+    'mmap_size': int(os.environ.get('LMS_SQLITE_MMAP_BYTES', 256 * 2**20)),
+    'temp_store': 'MEMORY',
+}
+if SQLITE_WAL:
+    # NORMAL is only crash-safe with WAL; the rollback journal keeps the default FULL
+    SQLITE_PRAGMAS.update({'journal_mode': 'WAL', 'synchronous': 'NORMAL'})
 
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('LMS_DB_NAME', BASE_DIR / 'db.sqlite3'),
+        # A file rather than the default in-memory database, so tests that run
+        # several threads get real SQLite locking instead of shared-cache errors
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+if DB_PROFILE == 'tuned':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.environ.get('LMS_DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Seconds a writer waits for the lock before giving up
+            'timeout': int(os.environ.get('LMS_SQLITE_BUSY_TIMEOUT', 20)),
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+        },
+    })
+
+
+# Circulation
+# Late fine per day overdue (see `manage.py sweep_overdue`)
+FINE_PER_DAY = os.environ.get('LMS_FINE_PER_DAY', '1.00')
+
+# Co-borrowing matrices kept between `manage.py build_recommendations` runs,
+# so each run only adds the issues made since the last one
+RECOMMENDATIONS_STATE = os.environ.get(
+    'LMS_RECOMMENDATIONS_STATE', str(BASE_DIR / 'django_cache' / 'coborrowing.npz')
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -135,12 +191,42 @@ STATICFILES_DIRS = [
     BASE_DIR, "static"
 ]
 
+# Cache
+# Two tiers: a small in-process LRU (bounded in bytes, short TTL) in front of a
+# shared cache that every worker sees. Pick the shared tier with environment
+# variables, e.g.
+#   LMS_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+#   LMS_CACHE_LOCATION=unix:///run/redis/redis.sock
+# or
+#   LMS_CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache
+#   LMS_CACHE_LOCATION=unix:/run/memcached/memcached.sock
+# By default it is a SQLite file under django_cache/.
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': 'D:/DCS/Project/LMS/django_cache',  # For Windows. Use a simple path.
-        # OR for Mac/Linux: '/var/tmp/django_cache',
-    }
+        'BACKEND': 'library_db.cache_backends.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'MAX_BYTES': int(os.environ.get('LMS_CACHE_LOCAL_MAX_BYTES', 32 * 2**20)),
+            'LOCAL_TIMEOUT': int(os.environ.get('LMS_CACHE_LOCAL_TIMEOUT', 5)),
+            # Counters every process must see at once skip the local tier
+            'LOCAL_BYPASS': [
+                'catalogue_generation',
+                'book_search_index_version',
+                'book_search_index_change:',
+                'book_search_index_snapshot_version',
+                # Written from whichever worker served the last view
+                'recently_viewed:',
+            ],
+        },
+    },
+    'shared': {
+        'BACKEND': os.environ.get('LMS_CACHE_BACKEND', 'library_db.cache_backends.SQLiteCache'),
+        'LOCATION': os.environ.get('LMS_CACHE_LOCATION', str(BASE_DIR / 'django_cache' / 'cache.sqlite3')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('LMS_CACHE_MAX_ENTRIES', 100000)),
+        },
+    },
 }
 
 AUTH_USER_MODEL = 'library_db.CustomUser'
\ No newline at end of file
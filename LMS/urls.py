@@ -54,7 +54,13 @@ urlpatterns = [
 
     #APIs
     path('api/filter-books/', views.filter_books, name='filter_books'),
+    path('api/books/', views.browse_books_page, name='browse_books_page'),
     path('api/request-book/<int:book_id>/', views.request_book, name='request_book'),
+    path('api/admin/requests/', views.admin_requests_page, name='admin_requests_page'),
+    path('api/admin/active-issues/', views.admin_active_issues_page, name='admin_active_issues_page'),
+    path('api/admin/requests/approve/', views.bulk_approve_requests, name='bulk_approve_requests'),
+    path('api/admin/requests/reject/', views.bulk_reject_requests, name='bulk_reject_requests'),
+    path('api/admin/issues/return/', views.bulk_return_issues, name='bulk_return_issues'),
     path('admin/requests/', views.view_pending_requests, name='view_pending_requests'),
     path('admin/requests/approve/<int:request_id>/', views.approve_request, name='approve_request'),
     path('admin/requests/reject/<int:request_id>/', views.reject_request, name='reject_request'),
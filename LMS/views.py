@@ -1,3 +1,5 @@
+import json
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from library_db.models import Book, Genre, Language , Request, IssueRecord, WaitingList
 from django.contrib.auth.decorators import login_required, user_passes_test
@@ -9,11 +11,17 @@ from django.contrib.auth import logout, get_user_model
 from django.contrib.auth import authenticate, login as auth_login
 from django.core.paginator import Paginator
 from django.core.cache import cache
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.db import IntegrityError
 from django.template.loader import render_to_string
-from datetime import date, timedelta
-from django.db.models import Count
-import pickle
+from django.db.models.functions import Coalesce
+from library_db import activity, inventory, issue_search, recommendations, stats
+from library_db.catalogue import FRAGMENT_TIMEOUT, afragment_key, fragment_key
+from library_db.feed import clean_isbn
+from library_db.pagination import CountedPaginator, cursor_after, keyset_page, page_links
+from library_db.search import SearchResults, search_index
 User = get_user_model()
 
 
@@ -22,118 +30,145 @@ def home(request):
 
 @staff_member_required
 def admin_dashboard(request):
-    total_books = Book.objects.count()
-    total_users = User.objects.count()
-    pending_list = Request.objects.filter(status='pending').select_related('user', 'book')
+    # Counts come from the maintained counters (one small query), not COUNT(*) per table
+    counters = stats.snapshot()
+    # Only the latest few requests are shown; the Requests page has the rest
+    pending_list = Request.objects.filter(status='pending').select_related('user', 'book').order_by('-request_date')[:10]
 
     context = {
-        'total_books': total_books,
-        'total_users': total_users,
+        'total_books': counters['books'],
+        'total_users': counters['users'],
+        'pending_count': counters['pending_requests'],
         'pending_requests': pending_list,
     }
     return render(request, 'admin/dashboard.html', context)
 
 @staff_member_required
 def admin_books(request):
-    all_books_list = Book.objects.all().order_by('title')
-    
-    paginator = Paginator(all_books_list, 8) 
+    books_page_obj, next_cursor = _catalogue_page(request)
 
-    page_number = request.GET.get('page')
-    
-    books_page_obj = paginator.get_page(page_number)
-    
     context = {
         'books_page': books_page_obj,
+        'page_links': page_links(books_page_obj, last=not next_cursor),
+        'next_cursor': next_cursor,
         'all_genres': Genre.objects.all().order_by('genre_name'),
         'all_languages': Language.objects.all().order_by('language_name'),
         'user_type': 'admin',
     }
     return render(request, 'admin/books.html', context)
 
+BROWSE_PAGE_SIZE = 8
 
-class LRUCache:
-    def __init__(self, session, key='recently_viewed', capacity=8):
-        self.session = session
-        self.key = key
-        self.capacity = capacity
-        # We retrieve the 'queue' from the session (acting as our Linked List)
-        # If it doesn't exist, we initialize an empty list.
-        self.queue = self.session.get(self.key, [])
+def _catalogue_page(request):
+    # The total is the maintained book counter, so numbered pages never COUNT(*) the catalogue
+    paginator = CountedPaginator(
+        Book.objects.for_catalogue().order_by('title', 'book_id'), BROWSE_PAGE_SIZE, stats.snapshot()['books']
+    )
+    page_obj = paginator.get_page(request.GET.get('page'))
 
-    def add(self, book_id):
-        # Step 1: Search and Remove (O(N) for lists)
-        if book_id in self.queue:
-            self.queue.remove(book_id)
-        
-        # Step 2: Add to Head
-        self.queue.insert(0, book_id)
-        
-        # Step 3: Check Capacity and Truncate Tail
-        if len(self.queue) > self.capacity:
-            self.queue.pop() # Removes the last element (Tail)
-            
-        # Save the updated structure back to the session "memory"
-        self.save()
+    # Scrolling on from this page goes by cursor on (title, book_id) instead of OFFSET
+    next_cursor = cursor_after(page_obj[-1], 'title') if page_obj.has_next() else None
+    return page_obj, next_cursor
+
+@login_required
+def browse_books_page(request):
+    # Infinite scroll over the unfiltered catalogue: seeks past the last card shown, never recounts
+    try:
+        books, next_cursor = keyset_page(
+            Book.objects.for_catalogue(), 'title', request.GET.get('cursor'), BROWSE_PAGE_SIZE, descending=False
+        )
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor.'}, status=400)
+
+    user_type = 'admin' if request.user.is_staff else 'user'
+    books_html = render_to_string('partials/book_cards.html', {'books': books, 'user_type': user_type})
+    return JsonResponse({'books_html': books_html, 'next_cursor': next_cursor})
+
+def _id_list(value):
+    return [int(x) for x in value.split(',') if x.strip().isdigit()]
+
+def _parse_filter_params(request):
+    """The browse filters in the query string, shared by filter_books and afilter_books."""
+    # Comma-separated ID strings become lists
+    page_number = request.GET.get('page', '1')
+    return {
+        'search': ' '.join(request.GET.get('search', '').lower().split()),
+        'genre_in': _id_list(request.GET.get('genre_in', '')),
+        'genre_ex': _id_list(request.GET.get('genre_ex', '')),
+        'lang_in': _id_list(request.GET.get('lang_in', '')),
+        'lang_ex': _id_list(request.GET.get('lang_ex', '')),
+        'page': int(page_number) if page_number.isdigit() else 1,
+    }
 
-    def get_ids(self):
-        """Returns the list of IDs in order (Most recent first)"""
-        return self.queue
+def _book_grid_signature(params, user_type):
+    # Most traffic is the same few filters on page 1, so the rendered grid is
+    # cached under these. fragment_key adds the catalogue generation, which moves
+    # whenever a book is edited, issued or returned, so stale copy counts are never shown.
+    return (
+        'book_grid', params['search'], sorted(set(params['genre_in'])), sorted(set(params['genre_ex'])),
+        sorted(set(params['lang_in'])), sorted(set(params['lang_ex'])), params['page'], user_type,
+    )
+
+def _facets(params):
+    return params['genre_in'], params['genre_ex'], params['lang_in'], params['lang_ex']
+
+def _book_grid_payload(page_obj, facet_counts, user_type):
+    books_html = render_to_string('partials/book_grid_content.html', {
+        'books_page': page_obj, 'page_links': page_links(page_obj), 'user_type': user_type,
+    })
+    return {'books_html': books_html, 'facet_counts': facet_counts}
 
-    def save(self):
-        """Persists the data structure to the user session"""
-        self.session[self.key] = self.queue
-        self.session.modified = True
-    
 def filter_books(request):
-    queryset = Book.objects.all().order_by('title')
-    
-    search_query = request.GET.get('search', '').lower().strip()
-    
-    # Get comma-separated strings and convert to lists
-    genre_in = [x for x in request.GET.get('genre_in', '').split(',') if x]
-    genre_ex = [x for x in request.GET.get('genre_ex', '').split(',') if x]
-    
-    lang_in = [x for x in request.GET.get('lang_in', '').split(',') if x]
-    lang_ex = [x for x in request.GET.get('lang_ex', '').split(',') if x]
-    
-    if search_query:
-        pickled_trie = cache.get('book_trie_index')
-        if pickled_trie:
-            trie = pickle.loads(pickled_trie)
-            matching_ids = trie.search_prefix(search_query)
-            if matching_ids:
-                queryset = queryset.filter(pk__in=matching_ids)
-            else:
-                queryset = queryset.none() 
-        else:
-            queryset = queryset.filter(title__icontains=search_query)
-
-    # 1. Include Logic (OR logic within the same category, e.g., Fiction OR Sci-Fi)
-    if genre_in:
-        queryset = queryset.filter(genre__pk__in=genre_in)
-    if lang_in:
-        queryset = queryset.filter(language__pk__in=lang_in)
-
-    # 2. Exclude Logic (Exclude books with ANY of these tags)
-    if genre_ex:
-        queryset = queryset.exclude(genre__pk__in=genre_ex)
-    if lang_ex:
-        queryset = queryset.exclude(language__pk__in=lang_ex)
-
-    print("query set : -",queryset)
-    page_number = request.GET.get('page', 1)
-    paginator = Paginator(queryset, 8)
-    page_obj = paginator.get_page(page_number)
-    books_html = render_to_string('partials/book_grid_content.html', {'books_page': page_obj})
-    return JsonResponse({'books_html': books_html})
+    params = _parse_filter_params(request)
+    user_type = 'admin' if request.user.is_staff else 'user'
+
+    cache_key = fragment_key(*_book_grid_signature(params, user_type))
+    payload = cache.get(cache_key)
+    if payload is not None:
+        return JsonResponse(payload)
+
+    # Ranked full-text match over title, author, ISBN and description, then the
+    # genre/language include-exclude filters on per-facet bitmaps, in the same pass
+    # that counts how many results carry each genre and language. The index lives
+    # in memory and catches up with the catalogue once per call.
+    matching_ids, facet_counts = search_index.search_and_filter(params['search'], *_facets(params))
+
+    # The total comes from the index and only the current page's rows are fetched
+    page_obj = Paginator(SearchResults(matching_ids), BROWSE_PAGE_SIZE).get_page(params['page'])
+
+    payload = _book_grid_payload(page_obj, facet_counts, user_type)
+    cache.set(cache_key, payload, FRAGMENT_TIMEOUT)
+    return JsonResponse(payload)
+
+async def afilter_books(request):
+    """filter_books for ASGI (see LMS/asgi_urls.py): same grid, without blocking the event loop."""
+    params = _parse_filter_params(request)
+    user = await request.auser()
+    user_type = 'admin' if user.is_staff else 'user'
+
+    cache_key = await afragment_key(*_book_grid_signature(params, user_type))
+    payload = await cache.aget(cache_key)
+    if payload is not None:
+        return JsonResponse(payload)
+
+    # Search and facet filters as in filter_books, off the event loop
+    matching_ids, facet_counts = await search_index.asearch_and_filter(params['search'], *_facets(params))
+
+    page_obj = Paginator(matching_ids, BROWSE_PAGE_SIZE).get_page(params['page'])
+    books = await Book.objects.for_catalogue().ain_bulk(page_obj.object_list)
+    page_obj.object_list = [books[book_id] for book_id in page_obj.object_list if book_id in books]
+
+    payload = _book_grid_payload(page_obj, facet_counts, user_type)
+    await cache.aset(cache_key, payload, FRAGMENT_TIMEOUT)
+    return JsonResponse(payload)
 
 @staff_member_required
 def admin_add_book(request):
     if request.method == 'POST':
         title = request.POST.get('title')
         author = request.POST.get('author')
-        isbn = request.POST.get('isbn')
+        # Stored as imports store it, so a later import of the same book matches it
+        isbn = clean_isbn(request.POST.get('isbn'))
         total_copies = request.POST.get('total_copies')
         description = request.POST.get('description')
         
@@ -169,7 +204,7 @@ def admin_edit_book(request, book_id):
     if request.method == 'POST':
         title = request.POST.get('title')
         author = request.POST.get('author')
-        isbn = request.POST.get('isbn')
+        isbn = clean_isbn(request.POST.get('isbn'))
         total_copies = request.POST.get('total_copies')
         description = request.POST.get('description')
         language_name = request.POST.get('language')
@@ -225,14 +260,29 @@ def admin_delete_book(request, book_id):
 
 @staff_member_required
 def admin_issue_receive(request):
-    active_issues = IssueRecord.objects.filter(status='issued').select_related('book', 'user').order_by('book__title')
+    # Overdue loans are still out and can be returned here too.
+    # Only the newest page is rendered; the rest load on demand from admin_active_issues_page.
+    active_issues, next_cursor = keyset_page(_active_issues(), 'issue_date')
 
     context = {
-        # ... your existing context variables ...
-        'active_issues': active_issues, 
+        'active_issues': active_issues,
+        'next_cursor': next_cursor,
     }
     return render(request, 'admin/issue_receive.html', context)
 
+def _active_issues():
+    return IssueRecord.objects.filter(status__in=IssueRecord.ACTIVE_STATUSES).select_related('book', 'user')
+
+@staff_member_required
+def admin_active_issues_page(request):
+    try:
+        active_issues, next_cursor = keyset_page(_active_issues(), 'issue_date', request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor.'}, status=400)
+
+    html = render_to_string('partials/active_issue_options.html', {'active_issues': active_issues})
+    return JsonResponse({'html': html, 'next_cursor': next_cursor})
+
 @staff_member_required
 def return_book_handler(request):
     if request.method == "POST":
@@ -240,57 +290,62 @@ def return_book_handler(request):
         condition = request.POST.get('condition')
         
         # 1. Get the specific Issue Record directly
-        issue_record = get_object_or_404(IssueRecord, pk=issue_id)
-        
-        # 2. Update Status
-        issue_record.status = 'returned'
-        issue_record.return_date = date.today()
+        issue_record = get_object_or_404(IssueRecord.objects.select_related('book', 'user'), pk=issue_id)
         # You can save the condition somewhere if your model has a field for it
         # issue_record.return_condition = condition 
-        
-        # 3. Calculate Fine (Simple Example)
-        if issue_record.return_date > issue_record.due_date:
-            delta = issue_record.return_date - issue_record.due_date
-            fine_amount = delta.days * 1.00
-        
-        issue_record.save()
-        
-        # 4. Update Book Availability
-        book = issue_record.book
-        book.available_copies += 1
-        book.save()
-        
-        messages.success(request, f"Book '{book.title}' returned successfully from {issue_record.user.username}.")
+
+        # 2. Mark it returned and put the copy back on the shelf in one transaction
+        # (the next person on the book's waiting list, if any, is issued the copy in the same transaction)
+        outcome = inventory.return_issue(issue_record.pk)
+        if outcome is None:
+            messages.info(request, f"Book '{issue_record.book.title}' was already returned.")
+            return redirect('admin_issue_receive')
+
+        # 3. Tell the desk the fine recorded with the return, so the two never disagree
+        fine_amount, next_issue = outcome
+        messages.success(request, f"Book '{issue_record.book.title}' returned successfully from {issue_record.user.username}.")
+        if fine_amount:
+            messages.warning(request, f"Late return: fine due {fine_amount}.")
+        if next_issue:
+            messages.info(request, f"Issued to {next_issue.user.username}, next on the waiting list.")
         return redirect('admin_issue_receive')
     
+HISTORY_PAGE_SIZE = 10
+
 @staff_member_required
 def issue_history(request):
     # 1. Base Query
-    query = request.GET.get('search', '')
+    query = request.GET.get('search', '').strip()
     status_filter = request.GET.get('status', '')
-    
-    records = IssueRecord.objects.select_related('user', 'book').all().order_by('-issue_date')
-
-    # 2. Search Logic (Student Name or Book Title)
-    if query:
-        records = records.filter(
-            Q(user__username__icontains=query) |
-            Q(user__first_name__icontains=query) |
-            Q(book__title__icontains=query) |
-            Q(book__isbn__icontains=query)
-        )
+    cursor = request.GET.get('cursor')
 
-    # 3. Status Filter (Issued, Returned, Overdue, etc.)
-    if status_filter:
-        records = records.filter(status=status_filter)
-
-    # 4. Pagination (Show 10 rows per page)
-    paginator = Paginator(records, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    try:
+        # 2. Search Logic (Student Name or Book Title), answered by the trigram index over the issue log
+        if query and issue_search.available():
+            records, next_cursor = issue_search.search_page(query, status_filter, cursor, HISTORY_PAGE_SIZE)
+        else:
+            records = IssueRecord.objects.select_related('user', 'book')
+            if query:
+                records = records.filter(
+                    Q(user__username__icontains=query) |
+                    Q(user__first_name__icontains=query) |
+                    Q(book__title__icontains=query) |
+                    Q(book__isbn__icontains=query)
+                )
+
+            # 3. Status Filter (Issued, Returned, Overdue, etc.)
+            if status_filter:
+                records = records.filter(status=status_filter)
+
+            # 4. Pagination: keyset pages, newest first, so old pages cost the same as new ones
+            records, next_cursor = keyset_page(records, 'issue_date', cursor, HISTORY_PAGE_SIZE)
+    except ValueError:
+        return redirect(f"{reverse('issue_history')}?{urlencode({'search': query, 'status': status_filter})}")
 
     context = {
-        'records': page_obj,
+        'records': records,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor,
         'search_query': query,
         'status_filter': status_filter
     }
@@ -299,206 +354,325 @@ def issue_history(request):
 @staff_member_required
 def admin_users(request):
 
+    # Books out per user is a maintained count, joined in rather than aggregated over every issue
     users = User.objects.annotate(
-        active_issued_count=Count(
-            'issues', 
-            filter=Q(issues__status__in=['issued', 'overdue'])
-        )
+        active_issued_count=Coalesce('stats__active_issues', 0)
     ).order_by('username')
 
     context = {
         'users' : users,
-        'total_users': users.count()
+        # Every user is listed anyway; counting the fetched list saves a GROUP BY over all issues
+        'total_users': len(users)
     }
     return render(request, 'admin/users.html', context)
 
-@staff_member_required
-def admin_requests(request):
-    pending_requests = Request.objects.filter(status='pending').select_related('user', 'book').order_by('-request_date')
-    approved_requests = Request.objects.filter(status='approved').select_related('user', 'book').order_by('-request_date')
-    rejected_requests = Request.objects.filter(status='rejected').select_related('user', 'book').order_by('-request_date')
+REQUEST_TABS = ('pending', 'approved', 'rejected')
+
+def can_decide_requests(user):
+    """Who may approve or reject requests; the requests page only offers it to them."""
+    return user.is_superuser
+
+def _render_requests_page(request):
+    # Only the first page of pending requests is rendered with the page; the approved and
+    # rejected tabs (which only grow) and further pages load from admin_requests_page
+    pending_requests, next_cursor = keyset_page(
+        Request.objects.filter(status='pending').select_related('user', 'book'), 'request_date'
+    )
 
     context = {
         'pending_requests': pending_requests,
-        'approved_requests': approved_requests,
-        'rejected_requests': rejected_requests,
+        'pending_next_cursor': next_cursor,
+        'pending_count': stats.snapshot()['pending_requests'],
+        'request_tabs': REQUEST_TABS,
+        'can_decide_requests': can_decide_requests(request.user),
     }
     return render(request, 'admin/requests.html', context)
 
+@staff_member_required
+def admin_requests(request):
+    return _render_requests_page(request)
+
+@staff_member_required
+def admin_requests_page(request):
+    status = request.GET.get('status', 'pending')
+    if status not in REQUEST_TABS:
+        return JsonResponse({'status': 'error', 'message': 'Unknown status.'}, status=400)
+
+    try:
+        requests_page, next_cursor = keyset_page(
+            Request.objects.filter(status=status).select_related('user', 'book'), 'request_date',
+            request.GET.get('cursor'),
+        )
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor.'}, status=400)
+
+    html = render_to_string('partials/request_cards.html', {
+        'requests': requests_page, 'status': status, 'can_decide_requests': can_decide_requests(request.user),
+    })
+    return JsonResponse({'html': html, 'next_cursor': next_cursor})
+
 @staff_member_required
 def admin_settings(request):
     return render(request, 'admin/settings.html')
 
 @login_required
 def user_dashboard(request):
-    lru = LRUCache(request.session)
-    
-    recent_ids = lru.get_ids()
-    
-    books_unsorted = Book.objects.filter(pk__in=recent_ids)
-
-    recently_viewed = sorted(books_unsorted, key=lambda book: recent_ids.index(book.pk))
-    pending_list = Request.objects.filter(status='pending').select_related('user', 'book')
+    # Every row of cards comes from one book query, each list kept in its own order
+    recently_viewed, trending, recommended = activity.books_in_order(
+        activity.recent_ids(request.user.pk),
+        activity.trending_ids(),
+        recommendations.recommended_ids(request.user.pk),
+    )
 
     context = {
-        'pending_list': pending_list,
-        'recently_viewed': recently_viewed, 
+        'recently_viewed': recently_viewed,
+        'trending': trending,
+        'recommended': recommended,
     }
     return render(request, 'users/dashboard.html', context)
 
 @login_required
 def user_browse(request):
-    all_books_list = Book.objects.all().order_by('title')
-    
-    paginator = Paginator(all_books_list, 8) 
+    books_page_obj, next_cursor = _catalogue_page(request)
 
-    page_number = request.GET.get('page')
-    
-    books_page_obj = paginator.get_page(page_number)
-    
     context = {
         'books_page': books_page_obj,
+        'page_links': page_links(books_page_obj, last=not next_cursor),
+        'next_cursor': next_cursor,
         'all_genres': Genre.objects.all().order_by('genre_name'),
         'all_languages': Language.objects.all().order_by('language_name'),
         'user_type': 'user',
     }
     return render(request, 'users/browse.html', context)
 
+ALREADY_ISSUED = 'You already have this book issued.'
+ALREADY_REQUESTED = 'You already have a pending approval request for this book.'
+ALREADY_WAITING = 'You are already on the waiting list for this book.'
+
+def _request_refused(message):
+    return JsonResponse({'status': 'error', 'message': message}, status=400)
+
+def _request_eligibility(book):
+    """
+    The error response if the reader may not request ``book``, else None.
+    ``book`` comes from Book.objects.with_holdings(user), so one query
+    answered every check: issued, pending, waiting.
+    """
+    if book.has_active_issue:
+        return _request_refused(ALREADY_ISSUED)
+    if book.has_pending_request:
+        return _request_refused(ALREADY_REQUESTED)
+    if book.is_waiting:
+        return _request_refused(ALREADY_WAITING)
+    return None
+
+def _requested_response():
+    return JsonResponse({
+        'status': 'pending', 
+        'message': 'Book is available! Your request has been sent for admin approval.'
+    })
+
+def _waiting_response(rank):
+    return JsonResponse({
+        'status': 'waiting', 
+        'message': f'This book is unavailable. You have been added to the waiting list at position #{rank}.',
+        'position': rank,
+    })
+
 @login_required
 def request_book(request, book_id):
     if request.method != 'POST':
         return JsonResponse({'status': 'error', 'message': 'Invalid request method.'}, status=405)
     
     user = request.user
-    print(f"DEBUG: Final User object: {user} (ID: {user.pk})")
 
-    if not request.user.is_authenticated:
-        return JsonResponse({'status': 'error', 'message': 'Please log in to request books.'}, status=401)
+    # 1. Check the reader doesn't already hold, have requested or be queued for it
+    book = get_object_or_404(
+        Book.objects.with_holdings(user).only('book_id', 'available_copies'), pk=book_id
+    )
+    refused = _request_eligibility(book)
+    if refused:
+        return refused
 
-    book = get_object_or_404(Book, pk=book_id)
-    
-    # 1. Check if user already has this book issued
-    if IssueRecord.objects.filter(book=book, user=user, status__in=['issued', 'overdue']).exists():
-        return JsonResponse({
-            'status': 'error', 
-            'message': 'You already have this book issued.'
-        }, status=400)
-        
-    # 2. Check if user already has a PENDING request
-    if Request.objects.filter(book=book, user=user, status='pending').exists():
-        return JsonResponse({
-            'status': 'error', 
-            'message': 'You already have a pending approval request for this book.'
-        }, status=400)
-
-    # 2. Check if user is already on the waiting list
-    if WaitingList.objects.filter(book=book, user=user).exists():
-        return JsonResponse({
-            'status': 'error', 
-            'message': 'You are already on the waiting list for this book.'
-        }, status=400)
-        
+    # 2. Ask for the copy on the shelf, or queue for the next one back
     if book.available_copies > 0:
         # Book is available. Create a 'pending' request for the admin to approve.
-        Request.objects.create(
-            user=user,
-            book=book,
-            status='pending'
-        )
-        return JsonResponse({
-            'status': 'pending', 
-            'message': 'Book is available! Your request has been sent for admin approval.'
-        })
-
-    # 3. Process the request
-    # if book.available_copies > 0:
-    #     # --- Book is Available: Create an IssueRecord ---
-    #     book.available_copies -= 1
-    #     book.save()
-
-    #     newissue = IssueRecord.objects.create(
-    #         user=user,
-    #         book=book,
-    #         issue_date=date.today(),
-    #         due_date=date.today() + timedelta(days=14), # 2-week loan period
-    #         status='issued'
-    #     )
-    #     print("new issue created successfully ",newissue)
-    #     return JsonResponse({
-    #         'status': 'success', 
-    #         'message': 'Book issued successfully! It has been added to your profile.',
-    #         'new_copies': book.available_copies
-    #     })
+        # The partial unique constraint turns a concurrent double-click into an IntegrityError
+        try:
+            Request.objects.create(
+                user=user,
+                book=book,
+                status='pending'
+            )
+        except IntegrityError:
+            return _request_refused(ALREADY_REQUESTED)
+        return _requested_response()
     else:
         # --- Book is Unavailable: Add to WaitingList (Priority Queue) ---
         
-        # Find the next position in the queue for this specific book
-        current_count = WaitingList.objects.all().count()
-        pos = current_count + 1
-        
-        newList = WaitingList.objects.create(
-            user=user,
-            book=book,
-            position=pos
-        )
-        print("new waiting list created successfully ",newList)
-        
-        return JsonResponse({
-            'status': 'waiting', 
-            'message': 'This book is unavailable. You have been added to the waiting list.'
-        })
+        # Append to this book's queue; the position is allocated atomically by the insert
+        try:
+            entry = WaitingList.objects.enqueue(user, book)
+        except IntegrityError:
+            # enqueue retries a race for a position itself; this is the user's own entry
+            return _request_refused(ALREADY_WAITING)
+        rank = WaitingList.objects.with_rank().values_list('rank', flat=True).get(pk=entry.pk)
+        return _waiting_response(rank)
 
-@user_passes_test(lambda u: u.is_superuser)
-def view_pending_requests(request):
-    pending_list = Request.objects.filter(status='pending').select_related('user', 'book')
-    approved_list = Request.objects.filter(status='approved').select_related('user', 'book')
-    rejected_list = Request.objects.filter(status='rejected').select_related('user', 'book')
+@login_required
+async def arequest_book(request, book_id):
+    """request_book for ASGI (see LMS/asgi_urls.py)."""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method.'}, status=405)
     
-    context = {
-        'pending_requests': pending_list,
-        'approved_requests': approved_list,
-        'rejected_requests': rejected_list,
-    }
-    return render(request, 'admin/requests.html', context)
+    user = await request.auser()
+    try:
+        book = await Book.objects.with_holdings(user).only('book_id', 'available_copies').aget(pk=book_id)
+    except Book.DoesNotExist:
+        raise Http404('No Book matches the given query.')
+    refused = _request_eligibility(book)
+    if refused:
+        return refused
+
+    if book.available_copies > 0:
+        try:
+            await Request.objects.acreate(user=user, book=book, status='pending')
+        except IntegrityError:
+            return _request_refused(ALREADY_REQUESTED)
+        return _requested_response()
+
+    try:
+        entry = await sync_to_async(WaitingList.objects.enqueue)(user, book)
+    except IntegrityError:
+        return _request_refused(ALREADY_WAITING)
+    rank = await WaitingList.objects.with_rank().values_list('rank', flat=True).aget(pk=entry.pk)
+    return _waiting_response(rank)
 
 @user_passes_test(lambda u: u.is_superuser)
+def view_pending_requests(request):
+    return _render_requests_page(request)
+
+@user_passes_test(can_decide_requests)
 def approve_request(request, request_id):
-    req = get_object_or_404(Request, pk=request_id)
+    req = get_object_or_404(Request.objects.select_related('book', 'user'), pk=request_id)
     book = req.book
 
-    if book.available_copies > 0:
-        # Issue the book
-        book.available_copies -= 1
-        book.save()
-        
-        IssueRecord.objects.create(
-            user=req.user,
-            book=book,
-            issue_date=date.today(),
-            due_date=date.today() + timedelta(days=14),
-            status='issued'
-        )
-        
-        req.status = 'approved'
-        req.save()
-        messages.success(request, f"Request for '{book.title}' by {req.user.username} approved.")
-    else:
+    # Claims the request and takes a copy atomically, so concurrent approvals can't oversell
+    outcome = inventory.approve_request(req.pk)
+    if outcome is None:
+        messages.info(request, f"Request for '{book.title}' by {req.user.username} was already handled.")
+    elif outcome == 'rejected':
         # No copies, so we must reject it
-        req.status = 'rejected'
-        req.save()
         messages.error(request, f"Could not approve request for '{book.title}'. No copies available.")
+    else:
+        messages.success(request, f"Request for '{book.title}' by {req.user.username} approved.")
 
     return redirect('view_pending_requests')
 
 # --- NEW: Admin view to REJECT a request ---
-@user_passes_test(lambda u: u.is_superuser)
+@user_passes_test(can_decide_requests)
 def reject_request(request, request_id):
-    req = get_object_or_404(Request, pk=request_id)
-    req.status = 'rejected'
-    req.save()
-    messages.warning(request, f"Request for '{req.book.title}' by {req.user.username} rejected.")
+    req = get_object_or_404(Request.objects.select_related('book', 'user'), pk=request_id)
+
+    # Only a pending request is rejected, so one another admin just approved keeps its issue
+    if inventory.reject_requests([req.pk])[req.pk]:
+        messages.warning(request, f"Request for '{req.book.title}' by {req.user.username} rejected.")
+    else:
+        messages.info(request, f"Request for '{req.book.title}' by {req.user.username} was already handled.")
     return redirect('view_pending_requests')
 
+def _posted_ids(request):
+    """The IDs a bulk endpoint was sent as JSON ``{"ids": [...]}``, deduplicated; None if malformed."""
+    try:
+        ids = json.loads(request.body)['ids']
+    except (ValueError, KeyError, TypeError):
+        return None
+    if not isinstance(ids, list) or not all(type(pk) is int for pk in ids) or len(ids) > inventory.MAX_BATCH:
+        return None
+    return list(dict.fromkeys(ids))
+
+def _bulk_error(message, status):
+    return JsonResponse({'status': 'error', 'message': message}, status=status)
+
+def _bulk_permission(test_func):
+    """
+    ``user_passes_test`` for the bulk endpoints. They are called with fetch(),
+    so a refusal is a JSON 403 rather than a redirect to the login page.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if not test_func(request.user):
+                return _bulk_error('You do not have permission to do that.', 403)
+            return view(request, *args, **kwargs)
+        return wrapped
+    return decorator
+
+BULK_USAGE = f'Send {{"ids": [...]}} with at most {inventory.MAX_BATCH} IDs.'
+
+REJECT_REASONS = {
+    'no_copies': 'No copies available.',
+    'already_issued': 'The user already has this book issued.',
+}
+
+@_bulk_permission(can_decide_requests)
+def bulk_approve_requests(request):
+    if request.method != 'POST':
+        return _bulk_error('Invalid request method.', 405)
+    request_ids = _posted_ids(request)
+    if request_ids is None:
+        return _bulk_error(BULK_USAGE, 400)
+
+    # 1. One transaction: copies are shared out per book, oldest request first
+    outcomes = inventory.approve_requests(request_ids)
+
+    # 2. One result per ID, in the order they were sent
+    results = []
+    for request_id, outcome in outcomes.items():
+        if outcome is None:
+            results.append({'id': request_id, 'status': 'skipped', 'message': 'Not pending.'})
+        elif isinstance(outcome, IssueRecord):
+            results.append({'id': request_id, 'status': 'approved', 'issue_id': outcome.pk,
+                            'due_date': outcome.due_date.isoformat()})
+        else:
+            results.append({'id': request_id, 'status': 'rejected', 'message': REJECT_REASONS[outcome]})
+    return JsonResponse({'results': results})
+
+@_bulk_permission(can_decide_requests)
+def bulk_reject_requests(request):
+    if request.method != 'POST':
+        return _bulk_error('Invalid request method.', 405)
+    request_ids = _posted_ids(request)
+    if request_ids is None:
+        return _bulk_error(BULK_USAGE, 400)
+
+    results = [
+        {'id': request_id, 'status': 'rejected'} if rejected else
+        {'id': request_id, 'status': 'skipped', 'message': 'Not pending.'}
+        for request_id, rejected in inventory.reject_requests(request_ids).items()
+    ]
+    return JsonResponse({'results': results})
+
+# Same test as staff_member_required
+@_bulk_permission(lambda u: u.is_active and u.is_staff)
+def bulk_return_issues(request):
+    if request.method != 'POST':
+        return _bulk_error('Invalid request method.', 405)
+    issue_ids = _posted_ids(request)
+    if issue_ids is None:
+        return _bulk_error(BULK_USAGE, 400)
+
+    # Returned copies go to the front of each book's waiting list in the same transaction
+    results = []
+    for issue_id, outcome in inventory.return_issues(issue_ids).items():
+        if outcome is None:
+            results.append({'id': issue_id, 'status': 'skipped', 'message': 'Not out on loan.'})
+            continue
+        fine, next_issue = outcome
+        results.append({'id': issue_id, 'status': 'returned', 'fine': str(fine),
+                        'next_issue_id': next_issue.pk if next_issue else None})
+    return JsonResponse({'results': results})
+
 @login_required
 def user_my_books(request):
     issued_books = IssueRecord.objects.filter(user__email =request.user.email).select_related('book')
@@ -520,7 +694,7 @@ def user_my_requests(request):
     rejected_requests = Request.objects.filter(user=user, status='rejected').select_related('book')
     
     # Get items from the priority queue (WaitingList)
-    waiting_list_items = WaitingList.objects.filter(user=user).select_related('book').order_by('position')
+    waiting_list_items = WaitingList.objects.filter(user=user).with_rank().select_related('book').order_by('request_date', 'waiting_id')
 
     context = {
         'pending_requests': pending_requests,
@@ -532,18 +706,22 @@ def user_my_requests(request):
 
 @staff_member_required
 def admin_book_details(request, book_id):
-    book = get_object_or_404(Book, book_id=book_id)
+    book = get_object_or_404(Book.objects.for_catalogue(), book_id=book_id)
     return render(request, 'admin/book_details.html', {'book': book})
 
 @login_required
 def user_book_details(request, book_id):
-    book = get_object_or_404(Book, book_id=book_id)
-    
-    lru = LRUCache(request.session)
+    book = get_object_or_404(Book.objects.for_catalogue(), book_id=book_id)
     
-    lru.add(book.pk)
+    # Kept in the cache tier, not the session, so a view doesn't rewrite the session
+    activity.record_view(request.user.pk, book.pk)
 
-    return render(request, 'users/book_details.html', {'book': book})
+    # Precomputed by `manage.py build_recommendations`; this is one indexed lookup
+    context = {
+        'book': book,
+        'also_borrowed': recommendations.also_borrowed(book.pk, limit=4),
+    }
+    return render(request, 'users/book_details.html', context)
 
 def user_login(request):
     if request.method == 'POST':
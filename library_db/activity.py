@@ -0,0 +1,168 @@
+"""
+What readers look at: each user's recently viewed books and the "trending
+now" ranking across everyone.
+
+Recently viewed lives in the shared cache tier, one short tuple per user,
+not in the session, so viewing a book never rewrites the session row.
+Trending counts are buffered per process and flushed into hourly
+BookViewCount rows every few seconds, so a page view costs no database
+write of its own.
+"""
+
+import atexit
+import logging
+import threading
+from collections import Counter
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from library_db.models import Book, BookViewCount
+
+RECENT_CAPACITY = 8
+RECENT_TIMEOUT = 60 * 60 * 24 * 30
+TRENDING_WINDOW = timedelta(hours=24)
+TRENDING_CACHE_KEY = 'trending_books'
+TRENDING_CACHE_TIMEOUT = 60
+
+logger = logging.getLogger(__name__)
+
+
+def recent_key(user_id):
+    return f'recently_viewed:{user_id}'
+
+
+def record_view(user_id, book_id):
+    """Moves the book to the front of the user's recently viewed and counts the view."""
+    key = recent_key(user_id)
+    ids = cache.get(key, ())
+    # Re-viewing the newest book (a refresh) changes nothing, so skip the write
+    if ids[:1] != (book_id,):
+        # At most RECENT_CAPACITY ids, so this is constant work per view
+        ids = ((book_id,) + tuple(pk for pk in ids if pk != book_id))[:RECENT_CAPACITY]
+        cache.set(key, ids, RECENT_TIMEOUT)
+    view_counter.add(book_id)
+
+
+def recent_ids(user_id):
+    return list(cache.get(recent_key(user_id), ()))
+
+
+def trending_ids(limit=RECENT_CAPACITY):
+    """IDs of the most viewed books over the last TRENDING_WINDOW, most viewed first."""
+    ids = cache.get(TRENDING_CACHE_KEY)
+    if ids is None:
+        since = _hour(timezone.now()) - TRENDING_WINDOW
+        ids = list(
+            BookViewCount.objects.filter(hour__gt=since)
+            .values('book_id').annotate(total=Sum('views')).order_by('-total', 'book_id')
+            .values_list('book_id', flat=True)[:limit]
+        )
+        cache.set(TRENDING_CACHE_KEY, ids, TRENDING_CACHE_TIMEOUT)
+    return ids
+
+
+def books_in_order(*id_lists):
+    """
+    Loads the books of every list in one query and returns one list of Book
+    per argument, each in its own order. IDs of deleted books are dropped.
+    """
+    books = Book.objects.for_catalogue().in_bulk({pk for ids in id_lists for pk in ids})
+    return [[books[pk] for pk in ids if pk in books] for ids in id_lists]
+
+
+class ViewCounter:
+    """
+    Per-process tally of book views, added to BookViewCount once FLUSH_VIEWS
+    are buffered or FLUSH_SECONDS after the first unflushed view, whichever
+    comes first. The time bound runs on a timer thread, so a worker that goes
+    idle still writes its views; one that exits flushes on the way out.
+    """
+
+    FLUSH_SECONDS = 10
+    FLUSH_VIEWS = 1000
+
+    def __init__(self, timer=True):
+        self.counts = Counter()
+        self.pending = 0
+        self.lock = threading.Lock()
+        # timer=False leaves flushing to add() and callers, e.g. inside a test's transaction
+        self.use_timer = timer
+        self.timer = None
+
+    def add(self, book_id):
+        with self.lock:
+            self.counts[book_id] += 1
+            self.pending += 1
+            full = self.pending >= self.FLUSH_VIEWS
+            if not full and self.use_timer and self.timer is None:
+                self.timer = threading.Timer(self.FLUSH_SECONDS, self._flush_on_timer)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            counts, self.counts, self.pending = self.counts, Counter(), 0
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not counts:
+            return
+
+        hour = _hour(timezone.now())
+        try:
+            with transaction.atomic():
+                # Books deleted since they were viewed have nothing to count against
+                for book_id in Book.objects.filter(pk__in=counts).values_list('pk', flat=True):
+                    _add_views(book_id, hour, counts[book_id])
+                # Hours that have left the window are never read again
+                BookViewCount.objects.filter(hour__lt=hour - 2 * TRENDING_WINDOW).delete()
+        except Exception:
+            # Keep the views for the next flush rather than dropping them
+            with self.lock:
+                self.counts.update(counts)
+                self.pending += sum(counts.values())
+            raise
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not write buffered book views; they are kept for the next flush.')
+        finally:
+            # No request cycle closes this thread's connection
+            connections.close_all()
+
+
+view_counter = ViewCounter()
+
+
+def _flush_at_exit():
+    try:
+        view_counter.flush()
+    except Exception:
+        logger.exception('Could not write buffered book views at exit.')
+
+
+atexit.register(_flush_at_exit)
+
+
+def _add_views(book_id, hour, views):
+    bucket = BookViewCount.objects.filter(book_id=book_id, hour=hour)
+    if bucket.update(views=F('views') + views):
+        return
+    try:
+        with transaction.atomic():
+            BookViewCount.objects.create(book_id=book_id, hour=hour, views=views)
+    except IntegrityError:
+        # Another process created this hour's row first
+        bucket.update(views=F('views') + views)
+
+
+def _hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
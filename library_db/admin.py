@@ -41,6 +41,10 @@ class BookAdmin(admin.ModelAdmin):
     search_fields = ('title', 'author', 'isbn')
     list_filter = ('genre',)
 
+    def get_queryset(self, request):
+        # genre_display and language would otherwise cost two queries per row
+        return super().get_queryset(request).for_catalogue()
+
 
 @admin.register(IssueRecord)
 class IssueRecordAdmin(admin.ModelAdmin):
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class LibraryDbConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'library_db'
+
+    def ready(self):
+        from library_db import signals  # noqa: F401
@@ -0,0 +1,416 @@
+"Cache backends: an in-process LRU tier in front of a shared tier, and a SQLite-file shared tier."
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Process-wide local tiers, keyed by the shared cache alias. Django builds one backend
+# instance per thread, but every thread in a worker should share one LRU.
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+_MISSING = object()
+
+STAT_NAMES = ('local_hits', 'shared_hits', 'misses', 'evictions')
+
+
+class LocalTier:
+    """Byte-bounded LRU of pickled values, each with its own expiry."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key -> (expires_at, pickled)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(STAT_NAMES, 0)
+        self.unflushed = dict.fromkeys(STAT_NAMES, 0)
+        self.last_flush = time.monotonic()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, pickled = entry
+            if expires_at <= time.monotonic():
+                self._pop(key)
+                return _MISSING
+            self.entries.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def set(self, key, pickled, ttl):
+        with self.lock:
+            self._pop(key)
+            if ttl <= 0 or len(pickled) > self.max_bytes // 16:
+                return
+            self.entries[key] = (time.monotonic() + ttl, pickled)
+            self.size += len(key) + len(pickled)
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self.entries)))
+                self.count('evictions')
+
+    def delete(self, key):
+        with self.lock:
+            self._pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def count(self, stat):
+        self.stats[stat] += 1
+        self.unflushed[stat] += 1
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(key) + len(entry[1])
+
+
+class TieredCache(BaseCache):
+    """
+    Small in-process LRU (bounded in bytes, short TTL) in front of a shared
+    cache that every worker sees.
+
+    LOCATION names the shared cache alias. Reads are served locally for at
+    most LOCAL_TIMEOUT seconds, so keys other processes must see immediately
+    (version counters and the like) are listed in LOCAL_BYPASS and always go
+    to the shared tier. Writes go through to the shared tier.
+
+    Hit/miss counts are kept per process and periodically added to
+    ``cache_stats:*`` counters in the shared tier; see ``manage.py cache_stats``.
+
+    The async methods answer local hits on the event loop. Shared-tier calls
+    run on the default thread pool rather than the single thread that
+    sync_to_async uses by default, so cache reads in async views don't queue
+    behind database queries.
+    """
+
+    STATS_PREFIX = 'cache_stats:'
+    STATS_FLUSH_SECONDS = 30
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = location
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self._bypass = tuple(options.get('LOCAL_BYPASS', ()))
+        with _tiers_lock:
+            self._tier = _tiers.setdefault(location, LocalTier(options.get('MAX_BYTES', 32 * 2**20)))
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _local_ttl(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return self._local_timeout
+        return min(self._local_timeout, timeout - time.time())
+
+    def _is_local(self, key):
+        return not key.startswith(self._bypass)
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        if self._is_local(key):
+            value = self._tier.get(local_key)
+            if value is not _MISSING:
+                self._record('local_hits')
+                return value
+
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self._record('misses')
+            return default
+
+        self._record('shared_hits')
+        if self._is_local(key):
+            self._tier.set(local_key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._local_timeout)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self.shared.set(key, value, timeout=self._shared_timeout(timeout), version=version)
+        if self._is_local(key):
+            self._tier.set(local_key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._local_ttl(timeout))
+
+    def get_many(self, keys, version=None):
+        """Local hits first, then one get_many to the shared tier for the rest."""
+        found, remaining = {}, []
+        for key in keys:
+            if self._is_local(key):
+                value = self._tier.get(self.make_and_validate_key(key, version=version))
+                if value is not _MISSING:
+                    self._record('local_hits')
+                    found[key] = value
+                    continue
+            remaining.append(key)
+        if not remaining:
+            return found
+
+        shared = self.shared.get_many(remaining, version=version)
+        for key in remaining:
+            if key not in shared:
+                self._record('misses')
+                continue
+            self._record('shared_hits')
+            value = found[key] = shared[key]
+            if self._is_local(key):
+                local_key = self.make_and_validate_key(key, version=version)
+                self._tier.set(local_key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._local_timeout)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout=self._shared_timeout(timeout), version=version)
+        for key, value in data.items():
+            if self._is_local(key) and key not in failed:
+                local_key = self.make_and_validate_key(key, version=version)
+                self._tier.set(local_key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._local_ttl(timeout))
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        added = self.shared.add(key, value, timeout=self._shared_timeout(timeout), version=version)
+        if added and self._is_local(key):
+            self._tier.set(local_key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._local_ttl(timeout))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout=self._shared_timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self._tier.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._tier.delete(self.make_and_validate_key(key, version=version))
+        return self.shared.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    async def aget(self, key, default=None, version=None):
+        if self._is_local(key):
+            value = self._tier.get(self.make_and_validate_key(key, version=version))
+            if value is not _MISSING:
+                self._tier.count('local_hits')
+                return value
+        return await sync_to_async(self.get, thread_sensitive=False)(key, default, version)
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return await sync_to_async(self.set, thread_sensitive=False)(key, value, timeout, version)
+
+    async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return await sync_to_async(self.add, thread_sensitive=False)(key, value, timeout, version)
+
+    def clear(self):
+        self._tier.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    def stats(self):
+        """This process's counters plus the local tier's current footprint."""
+        tier = self._tier
+        return dict(tier.stats, local_entries=len(tier.entries), local_bytes=tier.size,
+                    local_max_bytes=tier.max_bytes)
+
+    def _shared_timeout(self, timeout):
+        # DEFAULT_TIMEOUT means "this cache's default", which is ours, not the shared tier's
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def _record(self, stat):
+        tier = self._tier
+        tier.count(stat)
+        if time.monotonic() - tier.last_flush < self.STATS_FLUSH_SECONDS:
+            return
+
+        with tier.lock:
+            pending, tier.unflushed = tier.unflushed, dict.fromkeys(STAT_NAMES, 0)
+            tier.last_flush = time.monotonic()
+        for name, value in pending.items():
+            if not value:
+                continue
+            key = self.STATS_PREFIX + name
+            try:
+                self.shared.incr(key, value)
+            except ValueError:
+                if not self.shared.add(key, value, timeout=None):
+                    self.shared.incr(key, value)
+
+
+class SQLiteCache(BaseCache):
+    """
+    Shared cache stored in its own SQLite file (LOCATION is the path).
+
+    Every worker on the host sees the same entries, and because the file is
+    separate from the application database, cache writes never contend with
+    the catalogue's write lock.
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+    # Keys per get_many query, well inside SQLite's limit on bound parameters
+    MAX_BATCH = 500
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._cull_every = params.get('OPTIONS', {}).get('CULL_EVERY', 100)
+        self._local = threading.local()
+        self._sets_since_cull = 0
+        os.makedirs(os.path.dirname(os.path.abspath(location)), exist_ok=True)
+
+    @property
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            self._local.conn = conn
+        return conn
+
+    def _expiry(self, timeout):
+        # NULL means "never expires"
+        return self.get_backend_timeout(timeout)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._db.execute(
+            'SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        self._db.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            (key, pickled, self._expiry(timeout)),
+        )
+        self._maybe_cull()
+
+    def get_many(self, keys, version=None):
+        # One query per batch of keys rather than one per key
+        originals = {self.make_and_validate_key(key, version=version): key for key in keys}
+        cache_keys = list(originals)
+        found = {}
+        for start in range(0, len(cache_keys), self.MAX_BATCH):
+            batch = cache_keys[start:start + self.MAX_BATCH]
+            rows = self._db.execute(
+                'SELECT key, value FROM cache WHERE key IN (%s) AND (expires IS NULL OR expires > ?)'
+                % ', '.join('?' * len(batch)),
+                (*batch, time.time()),
+            )
+            for key, value in rows:
+                found[originals[key]] = pickle.loads(value)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self._expiry(timeout)
+        rows = [
+            (self.make_and_validate_key(key, version=version), pickle.dumps(value, self.pickle_protocol), expires)
+            for key, value in data.items()
+        ]
+        db = self._db
+        # One transaction, so the batch costs one commit
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)', rows)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        self._maybe_cull()
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        cursor = self._db.execute(
+            'INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires '
+            'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+            (key, pickled, self._expiry(timeout), time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._db.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self._expiry(timeout), key, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._db.execute('DELETE FROM cache WHERE key = ?', (key,)).rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        db = self._db
+        # IMMEDIATE takes the write lock up front so concurrent incr()s serialise
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute(
+                'SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (key, time.time()),
+            ).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            db.execute('UPDATE cache SET value = ? WHERE key = ?', (pickle.dumps(value, self.pickle_protocol), key))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return value
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._db.execute(
+            'SELECT 1 FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Connections are per thread and reused across requests
+        pass
+
+    def _maybe_cull(self):
+        # Culling is a range delete on the expiry index, done every CULL_EVERY sets
+        # rather than on every write
+        self._sets_since_cull += 1
+        if self._sets_since_cull < self._cull_every:
+            return
+        self._sets_since_cull = 0
+        db = self._db
+        db.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+        excess = db.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self._max_entries
+        if excess > 0:
+            db.execute(
+                'DELETE FROM cache WHERE key IN '
+                '(SELECT key FROM cache WHERE expires IS NOT NULL ORDER BY expires LIMIT ?)',
+                (excess,),
+            )
@@ -0,0 +1,46 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+
+
+GENERATION_KEY = 'catalogue_generation'
+FRAGMENT_TIMEOUT = 300
+
+
+def catalogue_generation():
+    """Current catalogue generation; every cached fragment is keyed by it."""
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Start from the clock rather than 1 so a counter that was evicted
+        # can never come back to a value some stale fragment was stored under
+        cache.add(GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+async def acatalogue_generation():
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        await cache.aadd(GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = await cache.aget(GENERATION_KEY)
+    return generation
+
+
+def bump_catalogue_generation():
+    """Invalidates every cached fragment after a book or its inventory changes."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        catalogue_generation()
+
+
+def fragment_key(name, *signature):
+    """Cache key for a rendered fragment, e.g. ``fragment_key('book_grid', search, page)``."""
+    digest = hashlib.md5(repr(signature).encode()).hexdigest()
+    return f'{name}:{catalogue_generation()}:{digest}'
+
+
+async def afragment_key(name, *signature):
+    digest = hashlib.md5(repr(signature).encode()).hexdigest()
+    return f'{name}:{await acatalogue_generation()}:{digest}'
@@ -0,0 +1,166 @@
+"""
+Parsing and validation of catalogue CSV feeds (the ``books_500.csv`` format).
+
+Nothing in here touches Django or the database, so ranges of a file can be
+parsed in pool worker processes under any multiprocessing start method while
+the importing process stays the only writer.
+"""
+
+import csv
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+REQUIRED_COLUMNS = ('isbn', 'Title', 'Author')
+
+ISBN_RE = re.compile(r'^(\d{9}[\dX]|\d{13})$')
+
+# Mirrors the Book/Genre/Language column sizes
+MAX_LENGTHS = {'title': 255, 'author': 100, 'language': 100, 'image_url': 500}
+MAX_GENRE_LENGTH = 100
+
+
+class RowError(ValueError):
+    pass
+
+
+def clean_isbn(value):
+    """
+    The stored form of an ISBN: hyphens and spaces dropped, a check digit x
+    upper-cased, so '978-0-13-110362-7' and '9780131103627' are one book.
+    Migration 0012 brought the ISBNs already stored into this form.
+    """
+    return re.sub(r'[\s-]', '', value or '').upper()
+
+
+def _copies(row, column):
+    value = (row.get(column) or '').strip() or '0'
+    try:
+        copies = int(value)
+    except ValueError:
+        raise RowError(f'{column} is not a whole number: {value!r}')
+    if copies < 0:
+        raise RowError(f'{column} is negative')
+    return copies
+
+
+def parse_row(row):
+    """
+    Validates one CSV row (a dict keyed by the header) and returns the values
+    we store, e.g. ``{'isbn': '9780131103627', 'title': 'Dune', ...,
+    'genres': ['Fiction'], 'language': 'English'}``. Raises RowError.
+    """
+    isbn = clean_isbn(row.get('isbn'))
+    if not ISBN_RE.match(isbn):
+        raise RowError(f'invalid ISBN {row.get("isbn")!r}')
+
+    genres_raw = (row.get('Genres') or '').strip()
+    parsed = {
+        'isbn': isbn,
+        'title': (row.get('Title') or '').strip(),
+        'author': (row.get('Author') or '').strip(),
+        'description': (row.get('Description') or '').strip(),
+        'language': (row.get('Language') or '').strip() or None,
+        'genres': [g.strip() for g in genres_raw.replace(';', ',').split(',') if g.strip()],
+        'image_url': (row.get('image_url') or '').strip() or None,
+        'total_copies': _copies(row, 'Total Copies'),
+        'available_copies': _copies(row, 'available_copies'),
+    }
+
+    if not parsed['title'] or not parsed['author']:
+        raise RowError('Title and Author are required')
+    for field, limit in MAX_LENGTHS.items():
+        if parsed[field] and len(parsed[field]) > limit:
+            raise RowError(f'{field} is longer than {limit} characters')
+    if any(len(genre) > MAX_GENRE_LENGTH for genre in parsed['genres']):
+        raise RowError(f'a genre is longer than {MAX_GENRE_LENGTH} characters')
+    if parsed['available_copies'] > parsed['total_copies']:
+        raise RowError('available_copies is greater than Total Copies')
+    return parsed
+
+
+def read_header(path):
+    """Returns (columns, offset of the first data line)."""
+    with open(path, 'rb') as f:
+        line = f.readline()
+        columns = next(csv.reader([line.decode('utf-8-sig')]), [])
+        missing = set(REQUIRED_COLUMNS) - set(columns)
+        if missing:
+            raise RowError(f'missing columns: {", ".join(sorted(missing))}')
+        return columns, f.tell()
+
+
+def byte_ranges(path, start, range_size):
+    """Yields (start, end) offsets covering ``start`` to EOF, each ending on a line boundary."""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        while start < size:
+            end = start + range_size
+            if end < size:
+                # Extend to the end of the line the cut landed in
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            end = min(end, size)
+            yield start, end
+            start = end
+
+
+def parse_range(path, start, end, columns):
+    """
+    Parses the lines in [start, end). Returns ``(rows, errors, line_count)``
+    where errors are ``(line, message, raw)`` with line numbers counted from
+    1 at ``start``.
+
+    Records must fit on one line: a quoted field that spans lines can't be
+    split safely by byte offset, so it's rejected like any other bad row.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).split(b'\n')
+    if lines and not lines[-1]:
+        lines.pop() # the range ends with a newline
+
+    rows, errors = [], []
+    for number, raw in enumerate(lines, 1):
+        raw = raw.rstrip(b'\r')
+        if not raw.strip():
+            continue
+        try:
+            text = raw.decode('utf-8')
+        except UnicodeDecodeError:
+            errors.append((number, 'not valid UTF-8', raw.decode('utf-8', 'replace')))
+            continue
+        try:
+            fields = next(csv.reader([text], strict=True))
+            if len(fields) != len(columns):
+                raise RowError(f'expected {len(columns)} fields, got {len(fields)}')
+            rows.append(parse_row(dict(zip(columns, fields))))
+        except (csv.Error, RowError) as e:
+            errors.append((number, str(e), text))
+    return rows, errors, len(lines)
+
+
+def parse_file(path, ranges, columns, workers=1):
+    """
+    Parses ``ranges`` of ``path`` and yields each range's ``parse_range``
+    result in file order. With several workers the ranges are parsed in a
+    process pool, keeping at most two per worker in flight so a slow writer
+    doesn't leave the whole file buffered in memory.
+    """
+    if workers <= 1:
+        for start, end in ranges:
+            yield (start, end), parse_range(path, start, end, columns)
+        return
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for start, end in ranges:
+            pending.append(((start, end), pool.submit(parse_range, path, start, end, columns)))
+            if len(pending) >= workers * 2:
+                span, future = pending.popleft()
+                yield span, future.result()
+        while pending:
+            span, future = pending.popleft()
+            yield span, future.result()
@@ -0,0 +1,73 @@
+from django.db import transaction
+
+from library_db.models import Book, Genre, Language
+
+
+# Book columns an import overwrites when the ISBN already exists
+UPDATE_FIELDS = ['title', 'author', 'language', 'description', 'image_url', 'total_copies', 'available_copies']
+
+
+class CatalogueWriter:
+    """
+    Upserts rows parsed by ``library_db.feed.parse_row`` a chunk at a time.
+
+    Genre and language IDs are resolved from in-memory maps (only unseen names
+    hit the database), books are upserted on ISBN with one bulk INSERT ... ON
+    CONFLICT, and genre links go straight into the M2M through table. Each
+    chunk is one transaction.
+    """
+
+    def __init__(self):
+        self.languages = dict(Language.objects.values_list('language_name', 'pk'))
+        self.genres = dict(Genre.objects.values_list('genre_name', 'pk'))
+        self.rows_written = 0
+
+    def write(self, rows):
+        # Later rows win when a chunk repeats an ISBN, as they would one by one
+        rows = list({row['isbn']: row for row in rows}.values())
+        if not rows:
+            return
+
+        with transaction.atomic():
+            self._add_missing(Language, 'language_name', self.languages, {row['language'] for row in rows} - {None})
+            self._add_missing(Genre, 'genre_name', self.genres, {g for row in rows for g in row['genres']})
+
+            Book.objects.bulk_create(
+                [
+                    Book(
+                        isbn=row['isbn'],
+                        title=row['title'],
+                        author=row['author'],
+                        language_id=self.languages.get(row['language']),
+                        description=row['description'],
+                        image_url=row['image_url'],
+                        total_copies=row['total_copies'],
+                        available_copies=row['available_copies'],
+                    )
+                    for row in rows
+                ],
+                update_conflicts=True,
+                unique_fields=['isbn'],
+                update_fields=UPDATE_FIELDS,
+            )
+
+            # Genres are only ever added, never removed, matching book.genre.add()
+            book_ids = dict(Book.objects.filter(isbn__in=[row['isbn'] for row in rows]).values_list('isbn', 'pk'))
+            BookGenre = Book.genre.through
+            BookGenre.objects.bulk_create(
+                [
+                    BookGenre(book_id=book_ids[row['isbn']], genre_id=self.genres[name])
+                    for row in rows
+                    for name in row['genres']
+                ],
+                ignore_conflicts=True,
+            )
+        self.rows_written += len(rows)
+
+    @staticmethod
+    def _add_missing(model, field, known, names):
+        missing = names - known.keys()
+        if not missing:
+            return
+        model.objects.bulk_create([model(**{field: name}) for name in missing], ignore_conflicts=True)
+        known.update(model.objects.filter(**{f'{field}__in': missing}).values_list(field, 'pk'))
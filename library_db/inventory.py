@@ -0,0 +1,329 @@
+"""
+Issuing and returning copies.
+
+Every change to ``available_copies`` is a conditional UPDATE on the column
+itself (``available_copies = available_copies - 1 WHERE available_copies > 0``)
+inside a short transaction, so concurrent approvals and returns at the desk
+can't lose updates, oversell a book or push the count above ``total_copies``.
+Each transaction starts with a write, which on SQLite takes the write lock
+up front instead of failing to upgrade a read lock later.
+
+The batch versions for the circulation desk (approve_requests,
+reject_requests, return_issues) have to read a batch before deciding it, so
+they read with select_for_update(); on SQLite the IMMEDIATE transaction mode
+of the tuned profile takes the write lock at BEGIN instead.
+"""
+
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When, Window
+from django.db.models.functions import RowNumber
+
+from library_db import stats
+from library_db.catalogue import bump_catalogue_generation
+from library_db.models import Book, IssueRecord, Request, WaitingList
+
+LOAN_DAYS = 14
+# Most IDs one batch call takes, so a batch stays one short transaction
+MAX_BATCH = 500
+
+
+def take_copy(book_id):
+    """Takes one copy off the shelf. Returns False if none are left."""
+    with transaction.atomic():
+        taken = Book.objects.filter(pk=book_id, available_copies__gt=0).update(
+            available_copies=F('available_copies') - 1
+        ) == 1
+        if taken:
+            stats.bump(available_copies=-1)
+    return taken
+
+
+def put_back_copy(book_id):
+    """Puts one copy back, never beyond total_copies. Returns False if the shelf is already full."""
+    with transaction.atomic():
+        put_back = Book.objects.filter(pk=book_id, available_copies__lt=F('total_copies')).update(
+            available_copies=F('available_copies') + 1
+        ) == 1
+        if put_back:
+            stats.bump(available_copies=1)
+    return put_back
+
+
+def approve_request(request_id):
+    """
+    Issues the book for a pending request. Returns the new IssueRecord,
+    'rejected' if no copies were left, or None if the request had already
+    been handled (e.g. by another admin).
+    """
+    with transaction.atomic():
+        # Claim the request first so two admins can't both approve it
+        if not Request.objects.filter(pk=request_id, status='pending').update(status='approved'):
+            return None
+        stats.bump(pending_requests=-1)
+        user_id, book_id = Request.objects.values_list('user_id', 'book_id').get(pk=request_id)
+
+        if not take_copy(book_id):
+            Request.objects.filter(pk=request_id).update(status='rejected')
+            return 'rejected'
+
+        return _issue(user_id, book_id)
+
+
+def return_issue(issue_id):
+    """
+    Marks an issued (or overdue) record returned, puts the copy back and, if
+    anyone is waiting for the book, issues it straight to the head of the
+    queue. Returns (fine recorded, waiter's new IssueRecord or None), as
+    return_issues does per loan, or None if the record had already been
+    returned.
+    """
+    with transaction.atomic():
+        # Overdue first, then issued: which one matched tells the counters what changed
+        for status in ('overdue', 'issued'):
+            if IssueRecord.objects.filter(pk=issue_id, status=status).update(status='returned', return_date=date.today()):
+                break
+        else:
+            return None
+        book_id, user_id, due_date = IssueRecord.objects.values_list('book_id', 'user_id', 'due_date').get(pk=issue_id)
+        stats.bump(active_issues=-1, overdue_issues=-int(status == 'overdue'))
+        stats.bump_user(user_id, -1)
+        fine = fine_for(due_date, date.today())
+        IssueRecord.objects.filter(pk=issue_id).update(fine_amount=fine)
+        put_back_copy(book_id)
+        # Queryset updates skip the signals that normally invalidate cached book grids
+        transaction.on_commit(bump_catalogue_generation)
+        return fine, _promote_next_waiter(book_id)
+
+
+def approve_requests(request_ids):
+    """
+    Approves a batch of requests in one transaction. Where a book has fewer
+    copies on the shelf than pending requests in the batch, the oldest
+    requests get them and the rest are rejected, as approve_request does
+    when the shelf is empty. Requests the user can't be issued because they
+    already hold the book are rejected too.
+
+    Returns {request_id: outcome}, outcome being the new IssueRecord,
+    'no_copies', 'already_issued', or None if the request wasn't pending.
+    """
+    with transaction.atomic():
+        pending = list(
+            Request.objects.select_for_update().filter(pk__in=request_ids, status='pending')
+            .order_by('request_date', 'request_id').values_list('pk', 'user_id', 'book_id')
+        )
+        book_ids = {book_id for _, _, book_id in pending}
+        shelf = dict(Book.objects.select_for_update().filter(pk__in=book_ids).values_list('pk', 'available_copies'))
+        holding = set(
+            IssueRecord.objects.filter(book_id__in=book_ids, user_id__in={user_id for _, user_id, _ in pending},
+                                       status__in=IssueRecord.ACTIVE_STATUSES).values_list('user_id', 'book_id')
+        )
+
+        outcomes, granted = {}, []
+        for request_id, user_id, book_id in pending:
+            if (user_id, book_id) in holding:
+                outcomes[request_id] = 'already_issued'
+            elif shelf[book_id] > 0:
+                shelf[book_id] -= 1
+                holding.add((user_id, book_id))
+                granted.append((request_id, user_id, book_id))
+            else:
+                outcomes[request_id] = 'no_copies'
+
+        Request.objects.filter(pk__in=[request_id for request_id, _, _ in granted]).update(status='approved')
+        Request.objects.filter(pk__in=list(outcomes)).update(status='rejected')
+        moved = _move_copies(_tally((book_id, -1) for _, _, book_id in granted))
+        issues = _issue_many([(user_id, book_id) for _, user_id, book_id in granted])
+        stats.bump(pending_requests=-len(pending), available_copies=moved, active_issues=len(issues))
+        stats.bump_users(_tally((issue.user_id, 1) for issue in issues))
+        outcomes.update(zip((request_id for request_id, _, _ in granted), issues))
+        transaction.on_commit(bump_catalogue_generation)
+
+    return {request_id: outcomes.get(request_id) for request_id in request_ids}
+
+
+def reject_requests(request_ids):
+    """Rejects a batch of requests in one UPDATE. Returns {request_id: False if it wasn't pending}."""
+    with transaction.atomic():
+        pending = set(
+            Request.objects.select_for_update().filter(pk__in=request_ids, status='pending').values_list('pk', flat=True)
+        )
+        Request.objects.filter(pk__in=pending).update(status='rejected')
+        stats.bump(pending_requests=-len(pending))
+    return {request_id: request_id in pending for request_id in request_ids}
+
+
+def return_issues(issue_ids):
+    """
+    Returns a batch of loans in one transaction: each returned copy goes back
+    on the shelf (never beyond total_copies) and, as with return_issue, to
+    the head of the book's waiting list if anyone is waiting.
+
+    Returns {issue_id: (fine, waiter's new IssueRecord or None)}, or None
+    for loans that weren't out.
+    """
+    today = date.today()
+    with transaction.atomic():
+        active = list(
+            IssueRecord.objects.select_for_update().filter(pk__in=issue_ids, status__in=IssueRecord.ACTIVE_STATUSES)
+            .order_by('pk').values_list('pk', 'user_id', 'book_id', 'due_date', 'status')
+        )
+        # Loans due the same day owe the same fine, so it's one UPDATE per due date
+        by_due_date = defaultdict(list)
+        for issue_id, _, _, due_date, _ in active:
+            by_due_date[due_date].append(issue_id)
+        for due_date, ids in by_due_date.items():
+            IssueRecord.objects.filter(pk__in=ids).update(
+                status='returned', return_date=today, fine_amount=fine_for(due_date, today)
+            )
+
+        returned = _tally((book_id, 1) for _, _, book_id, _, _ in active)
+        copies = {
+            book_id: (available, total) for book_id, available, total in
+            Book.objects.select_for_update().filter(pk__in=returned).values_list('pk', 'available_copies', 'total_copies')
+        }
+        on_shelf = {book_id: min(total, available + returned[book_id]) for book_id, (available, total) in copies.items()}
+
+        # Each return hands at most one copy on, to the longest waiting, like return_issue
+        places = {book_id: min(returned[book_id], on_shelf[book_id]) for book_id in on_shelf}
+        waiters = list(
+            WaitingList.objects.filter(book_id__in=[book_id for book_id, n in places.items() if n])
+            .annotate(place=Window(RowNumber(), partition_by=F('book_id'), order_by=F('position').asc()))
+            .filter(place__lte=max(places.values(), default=0))
+            .order_by('book_id', 'place').values_list('pk', 'user_id', 'book_id', 'place')
+        )
+        promoted = [(waiting_id, user_id, book_id) for waiting_id, user_id, book_id, place in waiters
+                    if place <= places[book_id]]
+        WaitingList.objects.filter(pk__in=[waiting_id for waiting_id, _, _ in promoted]).delete()
+        Request.objects.bulk_create(
+            Request(user_id=user_id, book_id=book_id, status='approved') for _, user_id, book_id in promoted
+        )
+        new_issues = _issue_many([(user_id, book_id) for _, user_id, book_id in promoted])
+
+        handed_on = _tally((book_id, 1) for _, _, book_id in promoted)
+        moved = _move_copies({
+            book_id: on_shelf[book_id] - copies[book_id][0] - handed_on.get(book_id, 0) for book_id in copies
+        })
+        stats.bump(available_copies=moved, active_issues=len(new_issues) - len(active),
+                   overdue_issues=-sum(status == 'overdue' for *_, status in active))
+        stats.bump_users(_tally([(user_id, -1) for _, user_id, _, _, _ in active]
+                                + [(issue.user_id, 1) for issue in new_issues]))
+        transaction.on_commit(bump_catalogue_generation)
+
+    # The waiters are matched to this batch's returns of the same book, in order
+    next_issue = defaultdict(list)
+    for issue in new_issues:
+        next_issue[issue.book_id].append(issue)
+    results = {}
+    for issue_id, _, book_id, due_date, _ in active:
+        results[issue_id] = (fine_for(due_date, today), next_issue[book_id].pop(0) if next_issue[book_id] else None)
+    return {issue_id: results.get(issue_id) for issue_id in issue_ids}
+
+
+def fine_for(due_date, on):
+    """The late fine for a loan due on due_date, as of the date on."""
+    days_late = max(0, (on - due_date).days)
+    return (Decimal(settings.FINE_PER_DAY) * days_late).quantize(Decimal('0.01'))
+
+
+def sweep_overdue(today=None, batch_size=500, pause=0.05):
+    """
+    Marks open loans past their due date 'overdue' and brings their fines up
+    to date. Loans due on the same day owe the same fine, so each due date is
+    one set-based UPDATE, split into batches of batch_size rows, each its own
+    short transaction, with a pause between them so the desk's writes get
+    the lock in between. Rows already overdue with today's fine are skipped,
+    so running it again the same day is cheap. Returns the number of records
+    updated.
+    """
+    today = today or date.today()
+    open_loans = IssueRecord.objects.filter(status__in=IssueRecord.ACTIVE_STATUSES, due_date__lt=today)
+    due_dates = list(open_loans.order_by('due_date').values_list('due_date', flat=True).distinct())
+
+    updated = 0
+    for due_date in due_dates:
+        fine = fine_for(due_date, today)
+        stale = open_loans.filter(due_date=due_date).exclude(status='overdue', fine_amount=fine)
+        last_pk = 0
+        while True:
+            ids = list(stale.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                # Re-checking the status skips anything returned since the batch was read
+                newly_overdue = IssueRecord.objects.filter(pk__in=ids, status='issued').update(
+                    status='overdue', fine_amount=fine
+                )
+                refreshed = IssueRecord.objects.filter(pk__in=ids, status='overdue').exclude(fine_amount=fine).update(
+                    fine_amount=fine
+                )
+                stats.bump(overdue_issues=newly_overdue)
+            updated += newly_overdue + refreshed
+            last_pk = ids[-1]
+            if len(ids) < batch_size:
+                break
+            time.sleep(pause)
+    return updated
+
+
+def _promote_next_waiter(book_id):
+    # Only called inside a transaction that has already written, so the
+    # reads below can't race a concurrent return of the same book
+    head = WaitingList.objects.head(book_id)
+    if head is None or not take_copy(book_id):
+        return None
+    head.delete()
+    Request.objects.create(user_id=head.user_id, book_id=book_id, status='approved')
+    return _issue(head.user_id, book_id)
+
+
+def _tally(pairs):
+    """Sums (key, amount) pairs per key: [(3, 1), (3, 1), (5, -1)] -> {3: 2, 5: -1}."""
+    totals = defaultdict(int)
+    for key, amount in pairs:
+        totals[key] += amount
+    return totals
+
+
+def _move_copies(deltas):
+    """
+    Adds each book's delta to available_copies, e.g. {3: -2, 5: 1}, in one
+    UPDATE. Returns the total, for the caller's stats.bump().
+    """
+    deltas = {book_id: delta for book_id, delta in deltas.items() if delta}
+    if deltas:
+        Book.objects.filter(pk__in=deltas).update(
+            available_copies=F('available_copies') + Case(
+                *[When(pk=book_id, then=Value(delta)) for book_id, delta in deltas.items()], output_field=IntegerField()
+            )
+        )
+    return sum(deltas.values())
+
+
+def _issue_many(loans):
+    """
+    _issue for a list of (user_id, book_id), in one INSERT. bulk_create sends
+    no signals, so the caller counts the new issues.
+    """
+    today = date.today()
+    return IssueRecord.objects.bulk_create(
+        IssueRecord(user_id=user_id, book_id=book_id, issue_date=today,
+                    due_date=today + timedelta(days=LOAN_DAYS), status='issued')
+        for user_id, book_id in loans
+    )
+
+
+def _issue(user_id, book_id):
+    today = date.today()
+    return IssueRecord.objects.create(
+        user_id=user_id,
+        book_id=book_id,
+        issue_date=today,
+        due_date=today + timedelta(days=LOAN_DAYS),
+        status='issued',
+    )
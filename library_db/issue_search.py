@@ -0,0 +1,69 @@
+"""
+Substring search over the issue log by student (username, first name) and
+book (title, ISBN).
+
+The log is the largest table, and ORing icontains lookups through two joins
+reads all of it. Instead migration 0009 copies each issue's searchable text
+into an SQLite FTS5 table with the trigram tokenizer, kept current by
+triggers on the issue, user and book tables. Trigrams answer any substring
+(and so any prefix) of three or more characters from the index; shorter
+terms can only filter the rows the longer ones select.
+
+Results come newest first by issue_id, the FTS table's rowid, so a page is
+read straight off the index and stops as soon as it is full; the cursor is
+the last issue_id shown.
+"""
+
+from django.db import connection
+
+from library_db.models import IssueRecord
+
+SEARCH_TABLE = 'library_db_issue_search'
+SEARCH_COLUMNS = ('username', 'first_name', 'title', 'isbn')
+# Shortest term the trigram index can look up
+MIN_INDEXED_LENGTH = 3
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def search_page(query, status='', cursor=None, size=10):
+    """
+    Issues matching every term of ``query`` (optionally with ``status``),
+    newest first, after issue_id ``cursor``. Returns (records, next_cursor);
+    next_cursor is None on the last page.
+    """
+    terms = query.lower().split()
+    indexed = [term for term in terms if len(term) >= MIN_INDEXED_LENGTH]
+    short = [term for term in terms if len(term) < MIN_INDEXED_LENGTH]
+
+    where, params = [], []
+    if indexed:
+        # Each term quoted, so user input is matched literally, never parsed as FTS syntax
+        where.append(f's.{SEARCH_TABLE} MATCH %s')
+        params.append(' AND '.join('"%s"' % term.replace('"', '""') for term in indexed))
+    for term in short:
+        pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        where.append('(' + ' OR '.join(f"s.{column} LIKE %s ESCAPE '\\'" for column in SEARCH_COLUMNS) + ')')
+        params += [pattern] * len(SEARCH_COLUMNS)
+    if status:
+        where.append('i.status = %s')
+        params.append(status)
+    if cursor:
+        where.append('s.rowid < %s')
+        params.append(int(cursor))
+
+    sql = (
+        f'SELECT s.rowid FROM {SEARCH_TABLE} s '
+        f'JOIN {IssueRecord._meta.db_table} i ON i.issue_id = s.rowid '
+        f'WHERE {" AND ".join(where) or "1"} ORDER BY s.rowid DESC LIMIT %s'
+    )
+    with connection.cursor() as c:
+        c.execute(sql, params + [size + 1])
+        ids = [row[0] for row in c.fetchall()]
+
+    next_cursor = str(ids[size - 1]) if len(ids) > size else None
+    ids = ids[:size]
+    records = IssueRecord.objects.select_related('user', 'book').in_bulk(ids)
+    return [records[issue_id] for issue_id in ids if issue_id in records], next_cursor
@@ -0,0 +1,85 @@
+import random
+import statistics
+import string
+import sys
+import time
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand
+
+from library_db.search import InvertedIndex, document_terms
+
+
+def synthetic_titles(count, vocabulary_size=20000, seed=42):
+    """Deterministic 1-6 word titles drawn from a Zipf-like vocabulary."""
+    rng = random.Random(seed)
+    vocabulary = [
+        ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10)))
+        for _ in range(vocabulary_size)
+    ]
+    cum_weights = list(accumulate(1 / (rank + 1) for rank in range(vocabulary_size)))
+    for _ in range(count):
+        yield ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(1, 6)))
+
+
+def index_size(index, book_terms):
+    """Bytes held by everything the running service keeps: terms, postings and per-book terms."""
+    size = sys.getsizeof(index.terms) + sys.getsizeof(index.postings) + sys.getsizeof(index.weights)
+    size += sum(sys.getsizeof(term) for term in index.terms)
+    size += sum(sys.getsizeof(ids) + sys.getsizeof(weights) for ids, weights in zip(index.postings, index.weights))
+    size += sys.getsizeof(index.doc_lengths) + sys.getsizeof(book_terms)
+    size += sum(sys.getsizeof(book_id) + sys.getsizeof(terms) for book_id, terms in book_terms.items())
+    return size
+
+
+class Command(BaseCommand):
+    help = 'Measures memory, prefix-lookup and ranked-search latency of the search index on synthetic catalogues.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, nargs='+', default=[500, 50000, 1000000])
+        parser.add_argument('--queries', type=int, default=200)
+
+    def handle(self, *args, **options):
+        for count in options['books']:
+            titles = list(synthetic_titles(count))
+
+            started = time.perf_counter()
+            documents = {book_id: document_terms(title) for book_id, title in enumerate(titles, 1)}
+            index = InvertedIndex.build(documents)
+            book_terms = {book_id: tuple(terms) for book_id, terms in documents.items()}
+            build_seconds = time.perf_counter() - started
+            memory = index_size(index, book_terms)
+            del documents
+
+            rng = random.Random(7)
+            words = [word for title in rng.sample(titles, min(len(titles), options['queries'])) for word in title.split()]
+            self.stdout.write(self.style.HTTP_INFO(
+                f'{count} books: {len(index)} terms, {memory / 2**20:.1f} MiB, built in {build_seconds:.2f}s'
+            ))
+            for length in (1, 2, 3, None):
+                prefixes = [word[:length] if length else word for word in words][:options['queries']]
+                timings = []
+                hits = 0
+                for prefix in prefixes:
+                    started = time.perf_counter()
+                    hits += len(index.search_prefix(prefix))
+                    timings.append(time.perf_counter() - started)
+                label = f'{length}-char prefix' if length else 'full word'
+                self.stdout.write(
+                    f'  {label:>14}: median {statistics.median(timings) * 1e6:9.1f} us, '
+                    f'max {max(timings) * 1e6:9.1f} us, avg hits {hits / len(prefixes):.0f}'
+                )
+
+            # Ranked two-word queries as typed in the browse box: one full word plus a prefix
+            queries = [f'{a} {b[:3]}' for a, b in zip(words, words[1:])][:options['queries']]
+            timings = []
+            hits = 0
+            for query in queries:
+                started = time.perf_counter()
+                hits += len(index.search(query))
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(
+                f'  {"ranked 2-word":>14}: median {statistics.median(timings) * 1e6:9.1f} us, '
+                f'max {max(timings) * 1e6:9.1f} us, avg hits {hits / len(queries):.0f}'
+            )
+            del index, book_terms
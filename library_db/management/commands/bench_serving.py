@@ -0,0 +1,240 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY, BACKEND_SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from library_db.management.commands.bench_search_index import synthetic_titles
+from library_db.models import Book, Genre, Language
+from library_db.search import search_index
+
+SERVERS = {
+    'wsgi': lambda port, options: [
+        sys.executable, '-m', 'gunicorn', 'LMS.wsgi:application', '--bind', f'127.0.0.1:{port}',
+        '--workers', str(options['workers']), '--worker-class', 'gthread', '--threads', str(options['threads']),
+        '--backlog', '2048', '--log-level', 'warning',
+    ],
+    'asgi': lambda port, options: [
+        sys.executable, '-m', 'uvicorn', 'LMS.asgi:application', '--host', '127.0.0.1', '--port', str(port),
+        '--workers', str(options['workers']), '--backlog', '2048', '--log-level', 'warning', '--no-access-log',
+    ],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests the browse APIs (filter_books, request_book) under gunicorn (WSGI) and uvicorn (ASGI) '
+        'with many concurrent signed-in users, against a fresh scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['wsgi', 'asgi'])
+        parser.add_argument('--users', type=int, default=500, help='Concurrent users, one keep-alive connection each.')
+        parser.add_argument('--seconds', type=float, default=20)
+        parser.add_argument('--warmup', type=float, default=5,
+                            help='Seconds of load before measuring, while connections open and caches fill.')
+        parser.add_argument('--think', type=float, default=0,
+                            help='Mean pause between one user\'s requests, in seconds (0 = back to back).')
+        parser.add_argument('--write-ratio', type=float, default=0.1, help='Share of requests that are request_book.')
+        parser.add_argument('--books', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=1, help='Server processes.')
+        parser.add_argument('--threads', type=int, default=32, help='Threads per gunicorn worker.')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--seed', action='store_true', help='Internal: fill the scratch database.')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.stdout.write(json.dumps(self.seed(options)))
+            return
+
+        for server in options['servers']:
+            module = 'gunicorn' if server == 'wsgi' else 'uvicorn'
+            if subprocess.run([sys.executable, '-c', f'import {module}'], capture_output=True).returncode:
+                raise CommandError(f'{server} needs {module}: pip install {module}')
+
+        self.stdout.write(f'{options["users"]} users for {options["seconds"]:.0f}s per server (after {options["warmup"]:g}s warm-up), think time '
+                          f'{options["think"]:g}s, {options["write_ratio"]:.0%} request_book, {options["books"]} books, '
+                          f'{options["workers"]} worker(s)')
+        for server in options['servers']:
+            with tempfile.TemporaryDirectory() as scratch:
+                env = dict(
+                    os.environ,
+                    LMS_DB_NAME=os.path.join(scratch, 'bench.sqlite3'),
+                    LMS_SQLITE_WAL='1',
+                    LMS_CACHE_LOCATION=os.path.join(scratch, 'cache.sqlite3'),
+                )
+                command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_serving', '--seed',
+                           '--users', str(options['users']), '--books', str(options['books'])]
+                output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+                fixture = json.loads(output.strip().splitlines()[-1])
+
+                # Server logs are dropped: every request_book repeat logs a 400, and 5xx are counted below
+                _check_port_free(options['port'])
+                process = subprocess.Popen(SERVERS[server](options['port'], options), env=env, cwd=settings.BASE_DIR,
+                                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                try:
+                    _wait_for_port(options['port'])
+                    result = asyncio.run(_load(options, fixture))
+                finally:
+                    process.terminate()
+                    process.wait()
+
+            self.stdout.write(self.style.HTTP_INFO(server))
+            for kind in ('filter_books', 'request_book'):
+                stats = result[kind]
+                self.stdout.write(
+                    f'  {kind:>12}: {stats["per_second"]:8.1f}/s  p50 {stats["p50_ms"]:7.1f} ms  '
+                    f'p99 {stats["p99_ms"]:7.1f} ms  errors {stats["errors"]}'
+                )
+
+    def seed(self, options):
+        call_command('migrate', verbosity=0)
+        rng = random.Random(3)
+        languages = [Language.objects.create(language_name=name) for name in ('English', 'Hindi', 'French')]
+        genres = [Genre.objects.create(genre_name=f'Genre {n}') for n in range(12)]
+        titles = list(synthetic_titles(options['books']))
+        Book.objects.bulk_create(
+            Book(isbn=str(n), title=title, author=f'Author {n % 97}', language=rng.choice(languages),
+                 total_copies=3, available_copies=rng.choice((0, 1, 3)))
+            for n, title in enumerate(titles)
+        )
+        book_ids = list(Book.objects.values_list('pk', flat=True))
+        Book.genre.through.objects.bulk_create(
+            Book.genre.through(book_id=book_id, genre_id=genre.pk)
+            for book_id in book_ids for genre in rng.sample(genres, 2)
+        )
+        search_index.rebuild()
+
+        User = get_user_model()
+        User.objects.bulk_create(
+            User(username=f'reader{n}', email=f'reader{n}@example.com', phone=str(n))
+            for n in range(options['users'])
+        )
+        sessions = []
+        for user in User.objects.all():
+            session = SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.create()
+            sessions.append(session.session_key)
+
+        # What users type: the first few letters of title words, or nothing at all
+        prefixes = sorted({word[:rng.randint(3, 6)] for title in rng.sample(titles, 300) for word in title.split()})
+        return {'sessions': sessions, 'book_ids': book_ids, 'genre_ids': [g.pk for g in genres],
+                'prefixes': prefixes}
+
+
+def _check_port_free(port):
+    # A server left over from an interrupted run would answer the load instead
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=1).close()
+    except OSError:
+        return
+    raise CommandError(f'Something is already listening on port {port}; stop it or pass --port')
+
+
+def _wait_for_port(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError(f'Server did not start listening on port {port}')
+
+
+async def _load(options, fixture):
+    timings = {'filter_books': [], 'request_book': []}
+    errors = {'filter_books': 0, 'request_book': 0}
+    measure_from = time.perf_counter() + options['warmup']
+    deadline = measure_from + options['seconds']
+
+    async def user(seed, session_key):
+        rng = random.Random(seed)
+        csrf = ''.join(rng.choice(string.ascii_letters) for _ in range(32))
+        headers = f'Cookie: sessionid={session_key}; csrftoken={csrf}\r\nX-CSRFToken: {csrf}\r\n'
+        connection = None
+        # Stagger the start so 500 users don't all connect in the same instant
+        await asyncio.sleep(rng.random())
+        while time.perf_counter() < deadline:
+            if rng.random() < options['write_ratio']:
+                kind, method = 'request_book', 'POST'
+                path = f'/api/request-book/{rng.choice(fixture["book_ids"])}/'
+            else:
+                kind, method = 'filter_books', 'GET'
+                query = {'page': rng.choice((1, 1, 1, 2, 3))}
+                if rng.random() < 0.7:
+                    query['search'] = rng.choice(fixture['prefixes'])
+                if rng.random() < 0.3:
+                    query['genre_in'] = rng.choice(fixture['genre_ids'])
+                path = '/api/filter-books/?' + '&'.join(f'{k}={v}' for k, v in query.items())
+
+            started = time.perf_counter()
+            status = None
+            # A kept-alive connection may have been closed by the server while idle; reconnect once
+            for _ in range(2):
+                try:
+                    if connection is None:
+                        connection = await asyncio.open_connection('127.0.0.1', options['port'])
+                    status = await _request(*connection, method, path, headers)
+                    break
+                except (OSError, asyncio.IncompleteReadError, IndexError, ValueError):
+                    if connection is not None:
+                        connection[1].close()
+                    connection = None
+            if started >= measure_from:
+                if status is None or status >= 500:
+                    errors[kind] += 1
+                else:
+                    timings[kind].append(time.perf_counter() - started)
+            if options['think']:
+                await asyncio.sleep(rng.expovariate(1 / options['think']))
+        if connection is not None:
+            connection[1].close()
+
+    await asyncio.gather(*(user(seed, key) for seed, key in enumerate(fixture['sessions'])))
+
+    result = {}
+    for kind, samples in timings.items():
+        samples.sort()
+        result[kind] = {
+            'per_second': len(samples) / options['seconds'],
+            'p50_ms': samples[len(samples) // 2] * 1000 if samples else 0,
+            'p99_ms': samples[int(len(samples) * 0.99)] * 1000 if samples else 0,
+            'errors': errors[kind],
+        }
+    return result
+
+
+async def _request(reader, writer, method, path, headers, body=b''):
+    """One HTTP/1.1 request on a kept-alive connection. Returns the status code."""
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\n{headers}Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length, chunked = 0, False
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+        elif name.lower() == 'transfer-encoding':
+            chunked = 'chunked' in value.lower()
+    if not chunked:
+        await reader.readexactly(length)
+        return status
+    while size := int((await reader.readline()).split(b';')[0], 16):
+        await reader.readexactly(size + 2)
+    await reader.readline()
+    return status
@@ -0,0 +1,136 @@
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection
+
+from library_db import inventory
+from library_db.models import Book, IssueRecord, Language, Request
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures read and write throughput of the SQLite profiles (LMS_DB_PROFILE) with many '
+        'concurrent users. Each profile runs in its own process against a fresh scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', default=['stock', 'tuned'])
+        parser.add_argument('--users', type=int, default=32, help='Concurrent users (threads).')
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--write-ratio', type=float, default=0.2,
+                            help='Share of user actions that are a request/approve/return cycle.')
+        parser.add_argument('--books', type=int, default=2000)
+        parser.add_argument('--worker', action='store_true', help='Internal: run one profile in this process.')
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            self.stdout.write(json.dumps(self.run_worker(options)))
+            return
+
+        self.stdout.write(f'{options["users"]} users for {options["seconds"]:.0f}s each, '
+                          f'{options["write_ratio"]:.0%} writes, {options["books"]} books')
+        for profile in options['profiles']:
+            with tempfile.TemporaryDirectory() as scratch:
+                env = dict(
+                    os.environ,
+                    LMS_DB_PROFILE=profile,
+                    LMS_DB_NAME=os.path.join(scratch, 'bench.sqlite3'),
+                    LMS_SQLITE_WAL='1',
+                    # Keep the shared cache out of the measurement
+                    LMS_CACHE_BACKEND='django.core.cache.backends.locmem.LocMemCache',
+                )
+                command = [
+                    sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_sqlite', '--worker',
+                    '--users', str(options['users']), '--seconds', str(options['seconds']),
+                    '--write-ratio', str(options['write_ratio']), '--books', str(options['books']),
+                ]
+                output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            self.stdout.write(self.style.HTTP_INFO(profile))
+            for kind in ('reads', 'writes'):
+                stats = result[kind]
+                self.stdout.write(
+                    f'  {kind:>6}: {stats["per_second"]:8.1f}/s  p50 {stats["p50_ms"]:7.1f} ms  '
+                    f'p95 {stats["p95_ms"]:7.1f} ms  errors {stats["errors"]}'
+                )
+
+    def run_worker(self, options):
+        call_command('migrate', verbosity=0)
+        language = Language.objects.create(language_name='English')
+        Book.objects.bulk_create(
+            Book(isbn=str(n), title=f'Book {n:06d}', author=f'Author {n % 97}', language=language,
+                 total_copies=3, available_copies=3)
+            for n in range(options['books'])
+        )
+        User = get_user_model()
+        User.objects.bulk_create(
+            User(username=f'reader{n}', email=f'reader{n}@example.com', phone=str(n))
+            for n in range(options['users'])
+        )
+        book_ids = list(Book.objects.values_list('pk', flat=True))
+        user_ids = list(User.objects.values_list('pk', flat=True))
+        connection.close()
+
+        timings = {'reads': [], 'writes': []}
+        errors = {'reads': 0, 'writes': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['seconds']
+
+        def browse(rng, user_id):
+            page = rng.randrange(max(1, len(book_ids) // 8))
+            list(Book.objects.for_catalogue().order_by('title')[page * 8:page * 8 + 8])
+            Request.objects.filter(user_id=user_id, status='pending').count()
+            list(IssueRecord.objects.filter(user_id=user_id).select_related('book'))
+
+        def borrow(rng, user_id):
+            # What the desk does for one loan: request, approve, return
+            request = Request.objects.create(user_id=user_id, book_id=rng.choice(book_ids))
+            issue = inventory.approve_request(request.pk)
+            if isinstance(issue, IssueRecord):
+                inventory.return_issue(issue.pk)
+
+        def user(seed, user_id):
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                kind, action = ('writes', borrow) if rng.random() < options['write_ratio'] else ('reads', browse)
+                # Each action is one request: connections are closed or kept per CONN_MAX_AGE
+                close_old_connections()
+                started = time.perf_counter()
+                try:
+                    action(rng, user_id)
+                except OperationalError:
+                    with lock:
+                        errors[kind] += 1
+                else:
+                    with lock:
+                        timings[kind].append(time.perf_counter() - started)
+                close_old_connections()
+            connection.close()
+
+        threads = [threading.Thread(target=user, args=(seed, user_id)) for seed, user_id in enumerate(user_ids)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        result = {}
+        for kind, samples in timings.items():
+            samples.sort()
+            result[kind] = {
+                'per_second': len(samples) / options['seconds'],
+                'p50_ms': statistics.median(samples) * 1000 if samples else 0,
+                'p95_ms': samples[int(len(samples) * 0.95)] * 1000 if samples else 0,
+                'errors': errors[kind],
+            }
+        return result
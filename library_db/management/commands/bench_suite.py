@@ -0,0 +1,555 @@
+import asyncio
+import csv
+import json
+import os
+import platform
+import random
+import sqlite3
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import django
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from library_db import recommendations, stats
+from library_db.management.commands.bench_search_index import synthetic_titles
+from library_db.management.commands.bench_serving import SERVERS, _check_port_free, _request, _wait_for_port
+from library_db.models import Book, Genre, IssueRecord, Language, Request, UserStats, WaitingList
+from library_db.search import search_index
+
+# Each endpoint's share of the HTTP load, and who calls it
+ENDPOINTS = {
+    'filter_books': (30, 'reader'),
+    'user_browse': (10, 'reader'),
+    'user_dashboard': (10, 'reader'),
+    'request_book': (10, 'reader'),
+    'admin_dashboard': (5, 'desk'),
+    'issue_history': (15, 'desk'),
+    'approve_request': (10, 'desk'),
+    'return_book_handler': (10, 'desk'),
+}
+
+# Rows per INSERT batch while seeding
+CHUNK = 10000
+
+
+def scale(books):
+    """Readers, issues, pending requests and waiting-list places for a catalogue of ``books``."""
+    readers = max(200, books // 20)
+    return {'books': books, 'readers': readers, 'issues': readers * 10,
+            'requests': 2000 + readers // 2, 'waiting': readers // 2}
+
+
+def seed(books, readers, issues, requests, waiting, sessions=100, sample_path=None, rng_seed=3):
+    """
+    Fills an empty database with a synthetic library: genres, languages,
+    authors, descriptions and copy counts are drawn from the books_500.csv
+    sample, titles from bench_search_index's Zipf vocabulary. Returns what the
+    load needs: sessions for ``sessions`` readers and one desk account, and
+    the ids and search terms to pick from.
+    """
+    rng = random.Random(rng_seed)
+    sample = _read_sample(sample_path or settings.BASE_DIR / 'books_500.csv')
+    today = timezone.localdate()
+
+    # 1. Catalogue
+    languages = Language.objects.bulk_create(Language(language_name=name) for name in sample['languages'])
+    genres = Genre.objects.bulk_create(Genre(genre_name=name) for name in sample['genres'])
+    titles = list(synthetic_titles(books))
+    for start in range(0, books, CHUNK):
+        batch = []
+        for n in range(start, min(start + CHUNK, books)):
+            total, available = rng.choice(sample['copies'])
+            batch.append(Book(
+                isbn=f'978{n:010d}', title=titles[n], author=rng.choice(sample['authors']),
+                description=rng.choice(sample['descriptions']), language=rng.choice(languages),
+                total_copies=total, available_copies=available,
+            ))
+        Book.objects.bulk_create(batch)
+    book_ids = list(Book.objects.order_by('pk').values_list('pk', flat=True))
+    unavailable = list(Book.objects.filter(available_copies=0).values_list('pk', flat=True))
+    _insert(Book.genre.through(book_id=book_id, genre_id=genre.pk)
+            for book_id in book_ids for genre in rng.sample(genres, rng.randint(1, 3)))
+
+    # 2. Readers and the desk
+    User = get_user_model()
+    _insert(User(username=f'reader{n}', email=f'reader{n}@example.com', phone=str(n)) for n in range(readers))
+    desk = User.objects.create(username='desk', email='desk@example.com', phone='desk',
+                               is_staff=True, is_superuser=True)
+    user_ids = list(User.objects.exclude(pk=desk.pk).order_by('pk').values_list('pk', flat=True))
+
+    # 3. Issue log, oldest first so ids follow dates: a tenth still out (a third of those overdue)
+    # (days ago, user, book, days kept) tuples; model instances for all of them at once took gigabytes
+    loans, active_pairs = [], set()
+    for n in range(issues):
+        user_id, book_id = rng.choice(user_ids), rng.choice(book_ids)
+        if n % 10:
+            loans.append((rng.randint(15, 730), user_id, book_id, rng.randint(1, 30)))
+        elif (user_id, book_id) not in active_pairs:
+            active_pairs.add((user_id, book_id))
+            loans.append((rng.randint(15, 60) if n % 30 == 0 else rng.randint(0, 13), user_id, book_id, None))
+    loans.sort(reverse=True)
+    _insert(_loan(today, *loan) for loan in loans)
+
+    # 4. Requests: the pending queue, and as many already handled
+    pending_pairs = set()
+    while len(pending_pairs) < requests:
+        pending_pairs.add((rng.choice(user_ids), rng.choice(book_ids)))
+    _insert(Request(user_id=user_id, book_id=book_id) for user_id, book_id in sorted(pending_pairs))
+    _insert(Request(user_id=rng.choice(user_ids), book_id=rng.choice(book_ids), status=rng.choice(('approved', 'rejected')))
+            for _ in range(requests))
+
+    # 5. Waiting lists on books with no copy on the shelf
+    places, positions = set(), {}
+    while unavailable and len(places) < waiting:
+        places.add((rng.choice(unavailable), rng.choice(user_ids)))
+    queue = []
+    for book_id, user_id in sorted(places):
+        positions[book_id] = positions.get(book_id, 0) + 1
+        queue.append(WaitingList(book_id=book_id, user_id=user_id, position=positions[book_id]))
+    _insert(queue)
+
+    # 6. What serving keeps alongside the tables. The per-user counts are written
+    # here in bulk; reconcile would fix them one reader at a time.
+    out = Counter(user_id for user_id, _ in active_pairs)
+    _insert(UserStats(user_id=user_id, active_issues=n) for user_id, n in out.items())
+    stats.reconcile(users=False)
+    search_index.rebuild()
+    try:
+        recommendations.build(settings.RECOMMENDATIONS_STATE, full=True)
+        built_recommendations = True
+    except ImportError:
+        built_recommendations = False
+
+    # What users type: the first few letters of title words; the desk also looks up readers
+    prefixes = sorted({word[:rng.randint(3, 6)] for title in rng.sample(titles, min(300, books)) for word in title.split()})
+    return {
+        'counts': {
+            'books': books, 'readers': readers, 'issues': len(loans), 'active_issues': len(active_pairs),
+            'pending_requests': len(pending_pairs), 'waiting': len(queue), 'recommendations': built_recommendations,
+        },
+        'reader_sessions': _sessions(User.objects.filter(pk__in=rng.sample(user_ids, min(sessions, readers)))),
+        'desk_session': _sessions([desk])[0],
+        'book_ids': rng.sample(book_ids, min(10000, books)),
+        'genre_ids': [genre.pk for genre in genres],
+        'prefixes': prefixes,
+        'history_terms': prefixes[:100] + [f'reader{rng.randrange(readers)}' for _ in range(50)],
+        'pending_ids': rng.sample(
+            list(Request.objects.filter(status='pending').order_by('pk').values_list('pk', flat=True)), len(pending_pairs)
+        ),
+        'active_issue_ids': rng.sample(
+            list(IssueRecord.objects.filter(status__in=IssueRecord.ACTIVE_STATUSES).order_by('pk').values_list('pk', flat=True)),
+            len(active_pairs),
+        ),
+    }
+
+
+def measure_client(fixture, requests=50, warmup=3, rng_seed=5):
+    """
+    Calls every endpoint ``requests`` times through the Django test client,
+    after ``warmup`` unmeasured calls. Returns latency percentiles, queries
+    and response statuses per endpoint.
+    """
+    rng = random.Random(rng_seed)
+    clients = {'reader': Client(HTTP_HOST='localhost'), 'desk': Client(HTTP_HOST='localhost')}
+    clients['desk'].cookies[settings.SESSION_COOKIE_NAME] = fixture['desk_session']
+    result = {}
+    for name, (_, caller) in ENDPOINTS.items():
+        client = clients[caller]
+        timings, queries, statuses = [], [], {}
+        for n in range(warmup + requests):
+            call = _call(name, rng, fixture)
+            if call is None:
+                break
+            method, path, data = call
+            if caller == 'reader':
+                client.cookies[settings.SESSION_COOKIE_NAME] = rng.choice(fixture['reader_sessions'])
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.post(path, data) if method == 'POST' else client.get(path)
+                elapsed = time.perf_counter() - started
+            if n >= warmup:
+                timings.append(elapsed)
+                queries.append(len(captured))
+                statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        result[name] = dict(_percentiles(timings), requests=len(timings), statuses=statuses,
+                            queries_mean=sum(queries) / len(queries) if queries else 0,
+                            queries_max=max(queries, default=0))
+    return result
+
+
+def _call(name, rng, fixture):
+    """(method, path, form data) for one call to ``name``, or None once its rows are used up."""
+    if name == 'filter_books':
+        query = {'page': rng.choice((1, 1, 1, 2, 3))}
+        if rng.random() < 0.7:
+            query['search'] = rng.choice(fixture['prefixes'])
+        if rng.random() < 0.3:
+            query['genre_in'] = rng.choice(fixture['genre_ids'])
+        return 'GET', f'{reverse(name)}?{urlencode(query)}', None
+    if name == 'issue_history':
+        query = {}
+        if rng.random() < 0.5:
+            query['search'] = rng.choice(fixture['history_terms'])
+        if rng.random() < 0.3:
+            query['status'] = rng.choice(('issued', 'returned', 'overdue'))
+        return 'GET', f'{reverse(name)}?{urlencode(query)}', None
+    if name == 'request_book':
+        return 'POST', reverse(name, args=[rng.choice(fixture['book_ids'])]), {}
+    # Each pending request and loan is approved or returned once
+    if name == 'approve_request':
+        return ('GET', reverse(name, args=[fixture['pending_ids'].pop()]), None) if fixture['pending_ids'] else None
+    if name == 'return_book_handler':
+        if not fixture['active_issue_ids']:
+            return None
+        return 'POST', reverse(name), {'issue_id': fixture['active_issue_ids'].pop(), 'condition': 'good'}
+    return 'GET', reverse(name), None
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {'p50_ms': 0, 'p95_ms': 0, 'p99_ms': 0, 'max_ms': 0}
+    return {
+        'p50_ms': samples[len(samples) // 2] * 1000,
+        'p95_ms': samples[int(len(samples) * 0.95)] * 1000,
+        'p99_ms': samples[int(len(samples) * 0.99)] * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+def _read_sample(path):
+    sample = {'genres': set(), 'languages': set(), 'authors': [], 'descriptions': [], 'copies': []}
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            sample['genres'].update(name.strip() for name in row['Genres'].split(';') if name.strip())
+            sample['languages'].add(row['Language'].strip())
+            sample['authors'].append(row['Author'])
+            sample['descriptions'].append(row['Description'])
+            total = int(row['Total Copies'])
+            sample['copies'].append((total, min(int(row['available_copies']), total)))
+    sample['genres'], sample['languages'] = sorted(sample['genres']), sorted(sample['languages'])
+    return sample
+
+
+def _loan(today, days_ago, user_id, book_id, days_kept):
+    issued = today - timedelta(days=days_ago)
+    due = issued + timedelta(days=14)
+    if days_kept is None:
+        return IssueRecord(user_id=user_id, book_id=book_id, issue_date=issued, due_date=due,
+                           status='overdue' if due < today else 'issued')
+    return IssueRecord(user_id=user_id, book_id=book_id, issue_date=issued, due_date=due, status='returned',
+                       return_date=issued + timedelta(days=days_kept))
+
+
+def _insert(objs):
+    objs = iter(objs)
+    while batch := [obj for _, obj in zip(range(CHUNK), objs)]:
+        type(batch[0]).objects.bulk_create(batch)
+
+
+def _sessions(users):
+    # Written in one batch: one SessionStore.create() per reader would dominate seeding
+    Session = SessionStore.get_model_class()
+    store, rows = SessionStore(), []
+    expires = timezone.now() + timedelta(seconds=settings.SESSION_COOKIE_AGE)
+    for user in users:
+        data = {SESSION_KEY: str(user.pk), BACKEND_SESSION_KEY: 'django.contrib.auth.backends.ModelBackend',
+                HASH_SESSION_KEY: user.get_session_auth_hash()}
+        rows.append(Session(session_key=store._get_new_session_key(), session_data=store.encode(data),
+                            expire_date=expires))
+    Session.objects.bulk_create(rows)
+    return [row.session_key for row in rows]
+
+
+def _memory_mib(pid='self', field='VmHWM'):
+    """A process's resident memory (VmHWM = peak) from /proc, or None where there is no /proc."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+def _server_memory_mib(pid):
+    """Peak resident memory of a server process and its workers, summed."""
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids = [pid] + [int(child) for child in f.read().split()]
+    except OSError:
+        return None
+    sizes = [_memory_mib(child) for child in pids]
+    return sum(size for size in sizes if size is not None)
+
+
+async def _load(options, fixture):
+    names = list(ENDPOINTS)
+    weights = [ENDPOINTS[name][0] for name in names]
+    timings = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    measure_from = time.perf_counter() + options['warmup']
+    deadline = measure_from + options['seconds']
+
+    async def user(seed, session_key):
+        rng = random.Random(seed)
+        csrf = ''.join(rng.choice(string.ascii_letters) for _ in range(32))
+        cookies = {caller: f'Cookie: sessionid={key}; csrftoken={csrf}\r\nX-CSRFToken: {csrf}\r\n'
+                   for caller, key in (('reader', session_key), ('desk', fixture['desk_session']))}
+        conn = None
+        # Stagger the start so the users don't all connect in the same instant
+        await asyncio.sleep(rng.random())
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            call = _call(name, rng, fixture)
+            if call is None:
+                continue
+            method, path, data = call
+            headers, body = cookies[ENDPOINTS[name][1]], b''
+            if data is not None:
+                headers += 'Content-Type: application/x-www-form-urlencoded\r\n'
+                body = urlencode(data).encode()
+
+            started = time.perf_counter()
+            status = None
+            # A kept-alive connection may have been closed by the server while idle; reconnect once
+            for _ in range(2):
+                try:
+                    if conn is None:
+                        conn = await asyncio.open_connection('127.0.0.1', options['port'])
+                    status = await _request(*conn, method, path, headers, body)
+                    break
+                except (OSError, asyncio.IncompleteReadError, IndexError, ValueError):
+                    if conn is not None:
+                        conn[1].close()
+                    conn = None
+            if started >= measure_from:
+                if status is None or status >= 500:
+                    errors[name] += 1
+                else:
+                    timings[name].append(time.perf_counter() - started)
+        if conn is not None:
+            conn[1].close()
+
+    sessions = fixture['reader_sessions']
+    await asyncio.gather(*(user(seed, sessions[seed % len(sessions)]) for seed in range(options['users'])))
+    return {
+        name: dict(_percentiles(samples), per_second=len(samples) / options['seconds'], errors=errors[name])
+        for name, samples in timings.items()
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the hot paths (browse, request, approve, return, issue history, dashboards) on synthetic '
+        'libraries of each --sizes books: every endpoint through the test client (latency, queries per request), '
+        'then a mixed load of concurrent users over HTTP. Results are written as JSON; --compare diffs two runs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[500, 50000],
+                            help='Catalogue sizes, in books (e.g. 500 50000 1000000).')
+        parser.add_argument('--requests', type=int, default=50, help='Test-client calls per endpoint.')
+        parser.add_argument('--users', type=int, default=50, help='Concurrent users in the HTTP load.')
+        parser.add_argument('--seconds', type=float, default=15, help='Length of the HTTP load.')
+        parser.add_argument('--warmup', type=float, default=3,
+                            help='Seconds of HTTP load before measuring, while connections open and caches fill.')
+        parser.add_argument('--no-http', action='store_true', help='Skip the HTTP load.')
+        parser.add_argument('--server', choices=sorted(SERVERS), default='wsgi')
+        parser.add_argument('--workers', type=int, default=1, help='Server processes.')
+        parser.add_argument('--threads', type=int, default=32, help='Threads per gunicorn worker.')
+        parser.add_argument('--port', type=int, default=8766)
+        parser.add_argument('--output', help='JSON file for the results (default bench_results/<time>.json).')
+        parser.add_argument('--compare', nargs='+', metavar='JSON',
+                            help='Diff this run against an earlier one; with two files, diff them without running.')
+        parser.add_argument('--worker', choices=['seed', 'measure'], help='Internal: one step of one size.')
+        parser.add_argument('--fixture', help='Internal: where the seed step leaves what the measure step needs.')
+
+    def handle(self, *args, **options):
+        if options['worker'] == 'seed':
+            call_command('migrate', verbosity=0)
+            started = time.perf_counter()
+            fixture = seed(**scale(options['sizes'][0]), sessions=max(options['users'], 100))
+            fixture['counts']['seed_seconds'] = time.perf_counter() - started
+            with open(options['fixture'], 'w') as f:
+                json.dump(fixture, f)
+            return
+        if options['worker'] == 'measure':
+            self.stdout.write(json.dumps(self.measure(options)))
+            return
+
+        compare = options['compare'] or []
+        if len(compare) > 2:
+            raise CommandError('--compare takes one earlier run, or two runs to diff.')
+        if len(compare) == 2:
+            self.compare(*(_read_results(path) for path in compare))
+            return
+        baseline = _read_results(compare[0]) if compare else None
+        if not options['no_http']:
+            module = 'gunicorn' if options['server'] == 'wsgi' else 'uvicorn'
+            if subprocess.run([sys.executable, '-c', f'import {module}'], capture_output=True).returncode:
+                raise CommandError(f'The HTTP load needs {module}: pip install {module} (or pass --no-http)')
+
+        results = {'meta': _meta(options), 'sizes': {}}
+        for size in options['sizes']:
+            self.stdout.write(f'Seeding {size} books...')
+            with tempfile.TemporaryDirectory() as scratch:
+                env = dict(
+                    os.environ,
+                    LMS_DB_NAME=os.path.join(scratch, 'bench.sqlite3'),
+                    LMS_SQLITE_WAL='1',
+                    LMS_CACHE_LOCATION=os.path.join(scratch, 'cache.sqlite3'),
+                    LMS_RECOMMENDATIONS_STATE=os.path.join(scratch, 'coborrowing.npz'),
+                )
+                # Seeding and measuring are separate processes, so the measured memory is a server's, not the seeder's
+                for step in ('seed', 'measure'):
+                    command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_suite', '--worker', step,
+                               '--fixture', os.path.join(scratch, 'fixture.json'), '--sizes', str(size)]
+                    for name in ('requests', 'users', 'seconds', 'warmup', 'server', 'workers', 'threads', 'port'):
+                        command += [f'--{name}', str(options[name])]
+                    if options['no_http']:
+                        command.append('--no-http')
+                    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+                    if completed.returncode:
+                        raise CommandError(f'{step} step for {size} books failed:\n{completed.stderr[-3000:]}')
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            results['sizes'][str(size)] = result
+            self.report(size, result)
+
+        path = options['output'] or str(settings.BASE_DIR / 'bench_results' / f'{datetime.now():%Y%m%d-%H%M%S}.json')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Results written to {path}'))
+        if baseline:
+            self.compare(baseline, results)
+
+    def measure(self, options):
+        with open(options['fixture']) as f:
+            fixture = json.load(f)
+        result = dict(fixture['counts'])
+        result['client'] = measure_client(fixture, options['requests'])
+        result['client_memory_mib'] = _memory_mib()
+        result['http'] = None
+        if options['no_http']:
+            return result
+
+        # The server has the same environment, so the same scratch database and cache
+        connection.close()
+        _check_port_free(options['port'])
+        process = subprocess.Popen(SERVERS[options['server']](options['port'], options), cwd=settings.BASE_DIR,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _wait_for_port(options['port'])
+            endpoints = asyncio.run(_load(options, fixture))
+            memory = _server_memory_mib(process.pid)
+        finally:
+            process.terminate()
+            process.wait()
+        result['http'] = {
+            'server': options['server'], 'users': options['users'], 'seconds': options['seconds'],
+            'per_second': sum(numbers['per_second'] for numbers in endpoints.values()),
+            'server_memory_mib': memory, 'endpoints': endpoints,
+        }
+        return result
+
+    def report(self, size, result):
+        self.stdout.write(self.style.HTTP_INFO(
+            f'{size} books, {result["readers"]} readers, {result["issues"]} issues, '
+            f'{result["pending_requests"]} pending requests (seeded in {result["seed_seconds"]:.1f}s)'
+        ))
+        self.stdout.write(f'  test client, peak memory {_mib(result["client_memory_mib"])}')
+        for name, numbers in result['client'].items():
+            self.stdout.write(
+                f'  {name:>20}: p50 {numbers["p50_ms"]:7.1f} ms  p95 {numbers["p95_ms"]:7.1f} ms  '
+                f'p99 {numbers["p99_ms"]:7.1f} ms  queries {numbers["queries_mean"]:5.1f} (max {numbers["queries_max"]})'
+            )
+        http = result['http']
+        if http:
+            self.stdout.write(f'  {http["server"]}, {http["users"]} users: {http["per_second"]:.1f} req/s, '
+                              f'server peak memory {_mib(http["server_memory_mib"])}')
+            for name, numbers in http['endpoints'].items():
+                self.stdout.write(
+                    f'  {name:>20}: {numbers["per_second"]:7.1f}/s  p50 {numbers["p50_ms"]:7.1f} ms  '
+                    f'p99 {numbers["p99_ms"]:7.1f} ms  errors {numbers["errors"]}'
+                )
+
+    def compare(self, old, new):
+        """Prints new against old for every size both runs measured; regressions are highlighted."""
+        self.stdout.write(f'{old["meta"]["started"]} ({old["meta"]["commit"]}) -> '
+                          f'{new["meta"]["started"]} ({new["meta"]["commit"]})')
+        for size, result in new['sizes'].items():
+            before = old['sizes'].get(size)
+            if before is None:
+                continue
+            self.stdout.write(self.style.HTTP_INFO(f'{size} books'))
+            for name, now in result['client'].items():
+                was = before['client'].get(name)
+                if was is None:
+                    continue
+                line = (f'  {name:>20}: p50 {_change(was["p50_ms"], now["p50_ms"])}  '
+                        f'p95 {_change(was["p95_ms"], now["p95_ms"])}  '
+                        f'queries {was["queries_mean"]:.1f} -> {now["queries_mean"]:.1f}')
+                worse = now['p95_ms'] > was['p95_ms'] * 1.2 or now['queries_max'] > was['queries_max']
+                self.stdout.write(self.style.WARNING(line) if worse else line)
+            if result['http'] and before['http']:
+                line = (f'  {"HTTP":>20}: {before["http"]["per_second"]:.1f} -> {result["http"]["per_second"]:.1f} req/s, '
+                        f'server memory {_mib(before["http"]["server_memory_mib"])} -> '
+                        f'{_mib(result["http"]["server_memory_mib"])}')
+                worse = result['http']['per_second'] < before['http']['per_second'] * 0.8
+                self.stdout.write(self.style.WARNING(line) if worse else line)
+
+
+def _read_results(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        raise CommandError(f'Cannot read {path}: {e}')
+
+
+def _meta(options):
+    """What a run was measured on, so two runs can be told apart."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'db_profile': settings.DB_PROFILE,
+        'options': {name: options[name] for name in
+                    ('requests', 'users', 'seconds', 'warmup', 'no_http', 'server', 'workers', 'threads')},
+    }
+
+
+def _change(before, after):
+    if not before:
+        return f'{before:.1f} -> {after:.1f} ms'
+    return f'{before:.1f} -> {after:.1f} ms ({after / before - 1:+.0%})'
+
+
+def _mib(value):
+    return 'n/a' if value is None else f'{value:.0f} MiB'
@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from library_db import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Updates the "readers who borrowed this also borrowed" lists from issues made since the last run. '
+        'Needs NumPy and SciPy. Run it from cron; use --full after deleting books or issues.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Rebuild from the whole issue log instead of only new issues.')
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K,
+                            help=f'Neighbours kept per book (default {recommendations.TOP_K}).')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            updated = recommendations.build(settings.RECOMMENDATIONS_STATE, full=options['full'],
+                                            top_k=options['top_k'])
+        except ImportError as e:
+            raise CommandError(f'{e}. Building recommendations needs NumPy and SciPy: pip install numpy scipy')
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated the neighbour lists of {updated} books in {time.perf_counter() - started:.2f}s.'
+        ))
@@ -0,0 +1,32 @@
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+
+from library_db.cache_backends import STAT_NAMES, TieredCache
+
+
+class Command(BaseCommand):
+    help = 'Shows cache hit/miss counters aggregated across all worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them.')
+
+    def handle(self, *args, **options):
+        cache = caches['default']
+        if not isinstance(cache, TieredCache):
+            raise CommandError('The default cache is not a TieredCache; there are no counters to show.')
+
+        # Workers add their counts to the shared tier every STATS_FLUSH_SECONDS
+        keys = [TieredCache.STATS_PREFIX + name for name in STAT_NAMES]
+        counts = {name: cache.shared.get(key, 0) for name, key in zip(STAT_NAMES, keys)}
+
+        lookups = counts['local_hits'] + counts['shared_hits'] + counts['misses']
+        for name, value in counts.items():
+            self.stdout.write(f'{name:>12}: {value}')
+        if lookups:
+            self.stdout.write(self.style.SUCCESS(
+                f'local hit ratio {counts["local_hits"] / lookups:.1%}, '
+                f'overall hit ratio {(lookups - counts["misses"]) / lookups:.1%}'
+            ))
+
+        if options['reset']:
+            cache.shared.delete_many(keys)
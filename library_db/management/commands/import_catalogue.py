@@ -0,0 +1,118 @@
+import csv
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library_db import stats
+from library_db.catalogue import bump_catalogue_generation
+from library_db.feed import RowError, byte_ranges, parse_file, read_header
+from library_db.importer import CatalogueWriter
+from library_db.search import search_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports or updates books from a catalogue CSV (books_500.csv format) in bulk. '
+        'The file is parsed and validated in parallel; rejected rows go to an error file '
+        'and an interrupted import can be picked up again with --resume.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Rows per transaction (default 500).')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Parser processes (default: one per CPU).')
+        parser.add_argument('--range-size', type=int, default=4 * 2**20,
+                            help='Bytes of the file each parser task takes (default 4 MiB).')
+        parser.add_argument('--errors',
+                            help='CSV to write rejected rows to (default <csv_path>.errors.csv).')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue from the checkpoint a previous, interrupted run left.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        path = options['csv_path']
+        checkpoint_path = path + '.checkpoint'
+        errors_path = options['errors'] or path + '.errors.csv'
+
+        # 1. Read the header and fingerprint the file so a checkpoint is only reused for the same file
+        try:
+            columns, data_start = read_header(path)
+            stat = os.stat(path)
+        except (OSError, RowError) as e:
+            raise CommandError(e)
+        fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+        # 2. Start fresh, or pick up where the checkpoint says the last run got to
+        state = dict(fingerprint, offset=data_start, line=2, rows=0, rejected=0, errors_size=0)
+        if options['resume'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                saved = json.load(f)
+            if {key: saved.get(key) for key in fingerprint} != fingerprint:
+                raise CommandError(f'{path} has changed since {checkpoint_path} was written; import it from the start.')
+            state = saved
+            self.stdout.write(f'Resuming at line {state["line"]} ({state["rows"]} rows already imported).')
+
+        if state['errors_size']:
+            # Drop anything written after the checkpoint; those rows are parsed again
+            errors_file = open(errors_path, 'r+', newline='', encoding='utf-8')
+            errors_file.truncate(state['errors_size'])
+            errors_file.seek(state['errors_size'])
+        else:
+            errors_file = open(errors_path, 'w', newline='', encoding='utf-8')
+            csv.writer(errors_file).writerow(['line', 'error', 'row'])
+
+        # 3. Parse ranges in the pool; this process is the only one that writes to the database
+        writer = CatalogueWriter()
+        rows_this_run = 0
+        workers = max(1, min(options['workers'], -(-(stat.st_size - state['offset']) // options['range_size'])))
+        ranges = byte_ranges(path, state['offset'], options['range_size'])
+        with errors_file:
+            errors_csv = csv.writer(errors_file)
+            for (_, end), (rows, errors, line_count) in parse_file(path, ranges, columns, workers):
+                for i in range(0, len(rows), options['chunk_size']):
+                    writer.write(rows[i:i + options['chunk_size']])
+                for number, message, raw in errors:
+                    errors_csv.writerow([state['line'] + number - 1, message, raw])
+                errors_file.flush()
+
+                state.update(
+                    offset=end,
+                    line=state['line'] + line_count,
+                    rows=state['rows'] + len(rows),
+                    rejected=state['rejected'] + len(errors),
+                    errors_size=errors_file.tell(),
+                )
+                self._save_checkpoint(checkpoint_path, state)
+                rows_this_run += len(rows)
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{state["rows"]} rows, {state["rejected"]} rejected...')
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        if not state['rejected']:
+            os.remove(errors_path)
+
+        # 4. Bulk writes skip model signals, so refresh the search index,
+        # invalidate cached grids and recount the book counters once at the end
+        search_index.rebuild()
+        bump_catalogue_generation()
+        stats.reconcile(stats.BOOK_COUNTERS, users=False)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {state["rows"]} books in {elapsed:.1f}s '
+            f'({rows_this_run / elapsed:,.0f} rows/sec, {workers} parser process(es)).'
+        ))
+        if state['rejected']:
+            self.stdout.write(self.style.WARNING(f'{state["rejected"]} rows rejected; see {errors_path}.'))
+
+    @staticmethod
+    def _save_checkpoint(path, state):
+        # Write then rename, so a crash never leaves a half-written checkpoint
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from library_db import stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the dashboard counters and per-user issue counts from the source tables '
+        'and corrects any that have drifted. With --check, only reports drift.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Report drift without correcting it; exit non-zero if there is any.')
+
+    def handle(self, *args, **options):
+        drift = stats.reconcile(fix=not options['check'])
+
+        for name, (stored, actual) in sorted(drift.items()):
+            self.stdout.write(f'{name}: stored {stored}, actual {actual}')
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('All counters match.'))
+        elif options['check']:
+            raise CommandError(f'{len(drift)} counter(s) have drifted; run reconcile_stats to correct them.')
+        else:
+            self.stdout.write(self.style.WARNING(f'Corrected {len(drift)} counter(s).'))
@@ -0,0 +1,35 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from library_db.inventory import sweep_overdue
+
+
+class Command(BaseCommand):
+    help = (
+        'Marks issued books past their due date as overdue and updates their fines. '
+        'Run it from cron, or with --every to keep it running as a scheduler.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Records per transaction (default 500).')
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to wait between batches so other writers get the lock.')
+        parser.add_argument('--every', type=float, metavar='SECONDS',
+                            help='Keep running and sweep again every SECONDS.')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            updated = sweep_overdue(batch_size=options['batch_size'], pause=options['pause'])
+            self.stdout.write(
+                f'{date.today()}: {updated} overdue records updated in {time.perf_counter() - started:.2f}s.'
+            )
+            if not options['every']:
+                break
+            # Don't hold a connection open while sleeping
+            connection.close()
+            time.sleep(options['every'])
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:40
+
+from django.db import migrations, models
+
+
+def renumber_queues(apps, schema_editor):
+    """
+    Positions used to come from a global count, so they repeat across and
+    within books. Keep each user's earliest entry per book and number every
+    book's queue 1..n in its current order.
+    """
+    WaitingList = apps.get_model('library_db', 'WaitingList')
+    seen = set()
+    next_position = {}
+    for entry in WaitingList.objects.order_by('book_id', 'position', 'waiting_id'):
+        if (entry.book_id, entry.user_id) in seen:
+            entry.delete()
+            continue
+        seen.add((entry.book_id, entry.user_id))
+        next_position[entry.book_id] = next_position.get(entry.book_id, 0) + 1
+        WaitingList.objects.filter(pk=entry.pk).update(position=next_position[entry.book_id])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_db', '0002_alter_waitinglist_position'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_queues, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='waitinglist',
+            constraint=models.UniqueConstraint(fields=('book', 'position'), name='waitinglist_book_position'),
+        ),
+        migrations.AddConstraint(
+            model_name='waitinglist',
+            constraint=models.UniqueConstraint(fields=('book', 'user'), name='waitinglist_book_user'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:41
+
+from django.db import migrations, models
+from django.db.models import F, Value
+from django.db.models.functions import Least
+
+
+def reject_duplicate_pending_requests(apps, schema_editor):
+    """Double-clicks used to leave several pending requests; keep the earliest of each."""
+    Request = apps.get_model('library_db', 'Request')
+    seen = set()
+    duplicates = []
+    for request_id, user_id, book_id in Request.objects.filter(status='pending').order_by('request_id').values_list('request_id', 'user_id', 'book_id'):
+        if (user_id, book_id) in seen:
+            duplicates.append(request_id)
+        seen.add((user_id, book_id))
+    Request.objects.filter(pk__in=duplicates).update(status='rejected')
+
+
+def close_duplicate_active_issues(apps, schema_editor):
+    """
+    Approving the same request twice issued the book twice: two active loans
+    for one reader and one book, and two copies taken off the shelf. Keep the
+    earliest loan, close the others as returned the day they were issued, and
+    put their copies back.
+    """
+    IssueRecord = apps.get_model('library_db', 'IssueRecord')
+    Book = apps.get_model('library_db', 'Book')
+    seen = set()
+    copies_back = {}
+    active = IssueRecord.objects.filter(status__in=['issued', 'overdue']).order_by('issue_date', 'issue_id')
+    for issue in active:
+        if (issue.user_id, issue.book_id) not in seen:
+            seen.add((issue.user_id, issue.book_id))
+            continue
+        IssueRecord.objects.filter(pk=issue.pk).update(status='returned', return_date=issue.issue_date)
+        copies_back[issue.book_id] = copies_back.get(issue.book_id, 0) + 1
+    for book_id, copies in copies_back.items():
+        Book.objects.filter(pk=book_id).update(
+            available_copies=Least(F('available_copies') + Value(copies), F('total_copies'))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_db', '0003_waitinglist_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(reject_duplicate_pending_requests, migrations.RunPython.noop),
+        migrations.RunPython(close_duplicate_active_issues, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='issuerecord',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['issued', 'overdue'])), fields=('user', 'book'), name='issuerecord_one_active_per_user_book'),
+        ),
+        migrations.AddConstraint(
+            model_name='request',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('user', 'book'), name='request_one_pending_per_user_book'),
+        ),
+    ]
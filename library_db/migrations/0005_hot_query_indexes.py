@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_db', '0004_one_active_request_per_book'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title', 'book_id'], name='book_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuerecord',
+            index=models.Index(fields=['-issue_date'], name='issue_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuerecord',
+            index=models.Index(fields=['status', '-issue_date'], name='issue_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(fields=['status', '-request_date'], name='request_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(fields=['user', 'status'], name='request_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='waitinglist',
+            index=models.Index(fields=['user', 'request_date'], name='waitinglist_user_date_idx'),
+        ),
+    ]
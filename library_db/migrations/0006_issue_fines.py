@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_db', '0005_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issuerecord',
+            name='fine_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=8),
+        ),
+        migrations.AddIndex(
+            model_name='issuerecord',
+            index=models.Index(fields=['due_date', 'issue_id'], name='issue_due_date_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_db', '0007_stat_counters'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='issuerecord',
+            name='issue_status_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='request',
+            name='request_status_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='issuerecord',
+            index=models.Index(fields=['status', 'issue_date', 'issue_id'], name='issue_status_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(fields=['status', 'request_date', 'request_id'], name='request_status_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:58
+
+from django.db import migrations, models
+
+SEARCH_TABLE = 'library_db_issue_search'
+
+# One row per issue (rowid = issue_id) holding the text issue history is
+# searched by. The triggers keep it in step with every write to the issue,
+# user and book tables, bulk ones included.
+CREATE_SQL = [
+    f"""CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+        username, first_name, title, isbn, tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_issue_insert AFTER INSERT ON {{issues}} BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, username, first_name, title, isbn)
+        SELECT new.issue_id, u.username, u.first_name, b.title, b.isbn
+        FROM {{users}} u, {{books}} b WHERE u.id = new.user_id AND b.book_id = new.book_id;
+    END""",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_issue_update AFTER UPDATE OF user_id, book_id ON {{issues}} BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.issue_id;
+        INSERT INTO {SEARCH_TABLE} (rowid, username, first_name, title, isbn)
+        SELECT new.issue_id, u.username, u.first_name, b.title, b.isbn
+        FROM {{users}} u, {{books}} b WHERE u.id = new.user_id AND b.book_id = new.book_id;
+    END""",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_issue_delete AFTER DELETE ON {{issues}} BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.issue_id;
+    END""",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_user_update AFTER UPDATE OF username, first_name ON {{users}} BEGIN
+        UPDATE {SEARCH_TABLE} SET username = new.username, first_name = new.first_name
+        WHERE rowid IN (SELECT issue_id FROM {{issues}} WHERE user_id = new.id);
+    END""",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_book_update AFTER UPDATE OF title, isbn ON {{books}} BEGIN
+        UPDATE {SEARCH_TABLE} SET title = new.title, isbn = new.isbn
+        WHERE rowid IN (SELECT issue_id FROM {{issues}} WHERE book_id = new.book_id);
+    END""",
+    f"""INSERT INTO {SEARCH_TABLE} (rowid, username, first_name, title, isbn)
+        SELECT i.issue_id, u.username, u.first_name, b.title, b.isbn
+        FROM {{issues}} i JOIN {{users}} u ON u.id = i.user_id JOIN {{books}} b ON b.book_id = i.book_id""",
+]
+
+
+def table_names(apps):
+    return {
+        'issues': apps.get_model('library_db', 'IssueRecord')._meta.db_table,
+        'users': apps.get_model('library_db', 'CustomUser')._meta.db_table,
+        'books': apps.get_model('library_db', 'Book')._meta.db_table,
+    }
+
+
+def create_issue_search(apps, schema_editor):
+    # FTS5 is SQLite's; on other databases issue_history keeps its plain lookups
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql.format(**table_names(apps)))
+
+
+def drop_issue_search(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # The triggers belong to the source tables, so they go separately
+    for suffix in ('issue_insert', 'issue_update', 'issue_delete', 'user_update', 'book_update'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{suffix}')
+    schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_db', '0008_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='issuerecord',
+            name='issue_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='issuerecord',
+            index=models.Index(fields=['issue_date', 'issue_id'], name='issue_date_keyset_idx'),
+        ),
+        migrations.RunPython(create_issue_search, drop_issue_search),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_db', '0009_issue_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookViewCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_counts', to='library_db.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour'], name='bookviewcount_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'hour'), name='bookviewcount_book_hour')],
+            },
+        ),
+    ]
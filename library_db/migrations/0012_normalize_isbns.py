@@ -0,0 +1,31 @@
+import re
+
+from django.db import migrations
+
+
+def normalize_isbns(apps, schema_editor):
+    """
+    Imports match books on the ISBN with hyphens and spaces dropped
+    (library_db.feed.clean_isbn), so bring stored ISBNs into that form.
+    Where the cleaned ISBN already belongs to another book, both rows are
+    left as they are for someone to merge by hand.
+    """
+    Book = apps.get_model('library_db', 'Book')
+    taken = set(Book.objects.values_list('isbn', flat=True))
+    for book_id, isbn in Book.objects.order_by('book_id').values_list('book_id', 'isbn'):
+        cleaned = re.sub(r'[\s-]', '', isbn or '').upper()
+        if cleaned == isbn or cleaned in taken:
+            continue
+        Book.objects.filter(pk=book_id).update(isbn=cleaned)
+        taken.add(cleaned)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_db', '0011_book_neighbours'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_isbns, migrations.RunPython.noop),
+    ]
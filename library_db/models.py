@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, Exists, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 
@@ -34,6 +36,25 @@ class Language(models.Model):
     def __str__(self):
         return self.language_name
 
+class BookQuerySet(models.QuerySet):
+    def for_catalogue(self):
+        # Book cards and detail pages show the language and every genre; load
+        # them up front so a page costs the same number of queries at any size
+        return self.select_related('language').prefetch_related('genre')
+
+    def with_holdings(self, user):
+        """
+        Annotates what the user already has for each book (an active issue, a
+        pending request, a waiting-list place) so request_book can decide in
+        one query.
+        """
+        book = OuterRef('pk')
+        return self.annotate(
+            has_active_issue=Exists(IssueRecord.objects.filter(book=book, user=user, status__in=IssueRecord.ACTIVE_STATUSES)),
+            has_pending_request=Exists(Request.objects.filter(book=book, user=user, status='pending')),
+            is_waiting=Exists(WaitingList.objects.filter(book=book, user=user)),
+        )
+
 class Book(models.Model):
     book_id = models.AutoField(primary_key=True)
     isbn = models.CharField(max_length=20, unique=True)
@@ -46,6 +67,14 @@ class Book(models.Model):
     total_copies = models.IntegerField()
     available_copies = models.IntegerField()
 
+    objects = BookQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Admin book list and the browse pages' title ordering
+            models.Index(fields=['title', 'book_id'], name='book_title_idx'),
+        ]
+
     def __str__(self):
         return self.title
       
@@ -60,6 +89,7 @@ class IssueRecord(models.Model):
         ('returned', 'Returned'),
         ('overdue', 'Overdue'),
     ]
+    ACTIVE_STATUSES = ['issued', 'overdue']
 
     issue_id = models.AutoField(primary_key=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='issues')
@@ -68,6 +98,23 @@ class IssueRecord(models.Model):
     due_date = models.DateField()
     return_date = models.DateField(blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    # Accrued late fine; kept current by `manage.py sweep_overdue` and fixed on return
+    fine_amount = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book'], condition=Q(status__in=['issued', 'overdue']),
+                                    name='issuerecord_one_active_per_user_book'),
+        ]
+        indexes = [
+            # Issue history, newest first, with and without a status filter, in keyset pages
+            models.Index(fields=['issue_date', 'issue_id'], name='issue_date_keyset_idx'),
+            # With the pk as the last column it also serves keyset pages on (issue_date, issue_id)
+            models.Index(fields=['status', 'issue_date', 'issue_id'], name='issue_status_keyset_idx'),
+            # The overdue sweep walks loans one due date at a time. Not partial:
+            # SQLite can't match a partial index's condition against bound parameters
+            models.Index(fields=['due_date', 'issue_id'], name='issue_due_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.book.title} → {self.user.username}"
@@ -86,16 +133,137 @@ class Request(models.Model):
     request_date = models.DateField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book'], condition=Q(status='pending'),
+                                    name='request_one_pending_per_user_book'),
+        ]
+        indexes = [
+            # Admin request tabs and dashboard: one status, keyset pages on (request_date, request_id)
+            models.Index(fields=['status', 'request_date', 'request_id'], name='request_status_keyset_idx'),
+            # The user's own tabs
+            models.Index(fields=['user', 'status'], name='request_user_status_idx'),
+        ]
+
     def __str__(self):
         return f"Request {self.request_id} - {self.book.title} by {self.user.username}"
 
 
+class WaitingListQuerySet(models.QuerySet):
+    ENQUEUE_ATTEMPTS = 5
+
+    def enqueue(self, user, book):
+        """
+        Appends the user to the book's queue. The position is allocated by the
+        INSERT itself (MAX + 1 over the book's (book, position) index). Where
+        two concurrent enqueues still read the same MAX, the one that loses on
+        the (book, position) constraint takes the next number. Raises
+        IntegrityError if the user is already in the queue.
+        """
+        tail = self.model.objects.filter(book=book).order_by().values('book').annotate(last=Max('position')).values('last')
+        for attempt in range(self.ENQUEUE_ATTEMPTS):
+            try:
+                # A savepoint, so a lost race leaves the caller's transaction usable
+                with transaction.atomic():
+                    entry = self.create(user=user, book=book, position=Coalesce(Subquery(tail), 0) + 1)
+                break
+            except IntegrityError:
+                if attempt == self.ENQUEUE_ATTEMPTS - 1 or self.model.objects.filter(book=book, user=user).exists():
+                    raise
+        entry.refresh_from_db(fields=['position'])
+        return entry
+
+    def with_rank(self):
+        # 1-based place in the book's queue: a count over the (book, position)
+        # index range ahead of each entry, not a scan of the whole table
+        ahead = self.model.objects.filter(book=OuterRef('book'), position__lt=OuterRef('position')).order_by().values('book').annotate(n=Count('pk')).values('n')
+        return self.annotate(rank=Coalesce(Subquery(ahead), 0) + 1)
+
+    def head(self, book_id):
+        """The longest-waiting entry for a book, or None."""
+        return self.filter(book_id=book_id).order_by('position').first()
+
+
 class WaitingList(models.Model):
     waiting_id = models.AutoField(primary_key=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='waiting_list')
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='waiting_list')
+    # Per-book sequence number: increases down the queue and is never reused
+    # while the queue is non-empty. Use with_rank() for "you are #N".
     position = models.IntegerField(default=0)
     request_date = models.DateField(auto_now_add=True)
 
+    objects = WaitingListQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Also the (book, position) index that head(), enqueue() and with_rank() use
+            models.UniqueConstraint(fields=['book', 'position'], name='waitinglist_book_position'),
+            models.UniqueConstraint(fields=['book', 'user'], name='waitinglist_book_user'),
+        ]
+        indexes = [
+            # My Requests lists a user's places in the order they joined
+            models.Index(fields=['user', 'request_date'], name='waitinglist_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} waiting for {self.book.title} (#{self.position})"
+
+
+class StatCounter(models.Model):
+    """
+    One denormalized count behind the admin dashboard, e.g. ('pending_requests', 3).
+    Maintained by library_db.stats; `manage.py reconcile_stats` corrects drift.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+class UserStats(models.Model):
+    """Per-user counts kept alongside StatCounter (books currently out)."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    active_issues = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user} has {self.active_issues} out"
+
+
+class BookViewCount(models.Model):
+    """Detail-page views of a book within one hour; the "trending now" ranking sums recent hours."""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='view_counts')
+    hour = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'hour'], name='bookviewcount_book_hour'),
+        ]
+        indexes = [
+            models.Index(fields=['hour'], name='bookviewcount_hour_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.book.title}: {self.views} views at {self.hour:%Y-%m-%d %H:00}"
+
+
+class BookNeighbour(models.Model):
+    """
+    One of a book's most co-borrowed books ("readers who borrowed this also
+    borrowed"), precomputed by `manage.py build_recommendations`.
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='neighbours')
+    neighbour = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='neighbour_of')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            # Also the index a book's list is read from, in rank order
+            models.UniqueConstraint(fields=['book', 'rank'], name='bookneighbour_book_rank'),
+        ]
+
     def __str__(self):
-        return f"{self.user.username} waiting for {self.book.title} (#{self.position})"
\ No newline at end of file
+        return f"{self.book.title} → #{self.rank} {self.neighbour.title}"
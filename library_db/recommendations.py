@@ -0,0 +1,172 @@
+"""
+"Readers who borrowed this also borrowed": item-item recommendations from
+the issue log.
+
+Lists are built offline by `manage.py build_recommendations`, which needs
+NumPy and SciPy. Serving only reads BookNeighbour, one indexed lookup, and
+needs neither.
+
+B is the sparse reader x book matrix of who has borrowed what (1 per pair,
+however often). C = BᵀB counts, for every pair of books, the readers who
+borrowed both; its diagonal is each book's reader count. Neighbours are
+ranked by cosine similarity C[i,j] / sqrt(C[i,i] * C[j,j]), so a book that
+everyone borrows doesn't top every list.
+
+Both matrices and the last issue_id seen are saved between runs, and a run
+only adds the pairs D from newer issues:
+
+    (B + D)ᵀ(B + D) = C + BᵀD + DᵀB + DᵀD
+
+then rewrites the lists of the books whose rows changed. Issues are only
+ever added, never taken away, so after deleting books or issues run it
+once with --full.
+"""
+
+import os
+
+from django.db import connection, transaction
+from django.db.models import Max
+
+from library_db.models import Book, BookNeighbour, IssueRecord
+
+TOP_K = 10
+# Dashboard recommendations draw on this many of the reader's latest borrows
+BASED_ON_LATEST = 3
+
+
+def also_borrowed(book_id, limit=TOP_K):
+    """Books most often borrowed by readers of ``book_id``, best first."""
+    return list(
+        Book.objects.for_catalogue().filter(neighbour_of__book_id=book_id).order_by('neighbour_of__rank')[:limit]
+    )
+
+
+def recommended_ids(user_id, limit=8):
+    """
+    IDs of books co-borrowed with the reader's latest borrows that they
+    haven't borrowed themselves, best first.
+    """
+    borrowed = IssueRecord.objects.filter(user_id=user_id)
+    latest = borrowed.order_by('-issue_date', '-issue_id').values('book_id')[:BASED_ON_LATEST]
+    return list(
+        BookNeighbour.objects.filter(book_id__in=latest)
+        .exclude(neighbour_id__in=borrowed.values('book_id'))
+        .values('neighbour_id').annotate(best=Max('score')).order_by('-best', 'neighbour_id')
+        .values_list('neighbour_id', flat=True)[:limit]
+    )
+
+
+def build(state_path, full=False, top_k=TOP_K):
+    """
+    Adds issues made since the last run (all of them with ``full``) and
+    rewrites the neighbour lists that changed. Returns how many books'
+    lists were rewritten.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    state = None if full else _load_state(state_path)
+    if state is None:
+        B = sparse.csr_matrix((0, 0), dtype=np.int64)
+        C = sparse.csr_matrix((0, 0), dtype=np.int64)
+        last_issue_id = 0
+    else:
+        B, C, last_issue_id = state
+
+    # 1. Reader/book pairs from the issues made since the last run
+    issues = IssueRecord.objects.filter(issue_id__gt=last_issue_id)
+    newest = issues.aggregate(newest=Max('issue_id'))['newest']
+    if newest is None:
+        if full:
+            _replace_neighbours([], full=True)
+        return 0
+    pairs = np.array(
+        list(issues.filter(issue_id__lte=newest).values_list('user_id', 'book_id').distinct()), dtype=np.int64
+    )
+
+    readers = max(B.shape[0], int(pairs[:, 0].max()) + 1)
+    books = max(B.shape[1], int(pairs[:, 1].max()) + 1)
+    B.resize((readers, books))
+    C.resize((books, books))
+
+    # 2. D holds the pairs B doesn't have yet (a reader borrowing a book again adds nothing)
+    D = sparse.csr_matrix((np.ones(len(pairs), dtype=np.int64), (pairs[:, 0], pairs[:, 1])), shape=(readers, books))
+    D = D - D.multiply(B)
+    D.eliminate_zeros()
+
+    changed = np.array([], dtype=np.int64)
+    if D.nnz:
+        C = (C + B.T @ D + D.T @ B + D.T @ D).tocsr()
+        B = (B + D).tocsr()
+        # Lists that moved: every book co-borrowed with a book that gained a reader. That
+        # covers new co-borrowings and the books whose similarity shifted because the
+        # other book's reader count (the cosine denominator) went up.
+        changed = np.unique(C[np.unique(D.nonzero()[1])].indices)
+
+    # 3. Top-K of each changed row by cosine similarity
+    readers_per_book = C.diagonal()
+    lists = []
+    for book in changed:
+        start, end = C.indptr[book], C.indptr[book + 1]
+        others, together = C.indices[start:end], C.data[start:end]
+        keep = others != book
+        others, together = others[keep], together[keep]
+        scores = together / np.sqrt(readers_per_book[book] * readers_per_book[others])
+        top = np.lexsort((others, -scores))[:top_k]  # best score first, then lowest id
+        lists.append((int(book), others[top].tolist(), scores[top].tolist()))
+
+    _replace_neighbours(lists, full=full)
+    _save_state(state_path, B, C, newest)
+    return len(lists)
+
+
+def _replace_neighbours(lists, full=False):
+    existing = set(Book.objects.values_list('pk', flat=True))
+    rows = [
+        (book, neighbour, rank, score)
+        for book, neighbours, scores in lists if book in existing
+        for rank, (neighbour, score) in enumerate(
+            ((n, s) for n, s in zip(neighbours, scores) if n in existing), start=1
+        )
+    ]
+    table = BookNeighbour._meta.db_table
+    with transaction.atomic():
+        if full:
+            BookNeighbour.objects.all().delete()
+        else:
+            books = [book for book, _, _ in lists]
+            # Chunked to stay under SQLite's bound-parameter limit
+            for i in range(0, len(books), 500):
+                BookNeighbour.objects.filter(book_id__in=books[i:i + 500]).delete()
+        # A full build writes a row per book per rank; building that many model
+        # instances for bulk_create took longer than the matrix work itself
+        with connection.cursor() as c:
+            c.executemany(
+                f'INSERT INTO {table} (book_id, neighbour_id, rank, score) VALUES (%s, %s, %s, %s)', rows
+            )
+
+
+def _load_state(path):
+    import numpy as np
+    from scipy import sparse
+
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as saved:
+        B = sparse.csr_matrix((saved['B_data'], saved['B_indices'], saved['B_indptr']), shape=tuple(saved['B_shape']))
+        C = sparse.csr_matrix((saved['C_data'], saved['C_indices'], saved['C_indptr']), shape=tuple(saved['C_shape']))
+        return B, C, int(saved['last_issue_id'])
+
+
+def _save_state(path, B, C, last_issue_id):
+    import numpy as np
+
+    # Write then rename, so an interrupted run leaves the previous state intact
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(
+            f,
+            B_data=B.data, B_indices=B.indices, B_indptr=B.indptr, B_shape=B.shape,
+            C_data=C.data, C_indices=C.indices, C_indptr=C.indptr, C_shape=C.shape,
+            last_issue_id=last_issue_id,
+        )
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,668 @@
+import logging
+import pickle
+import re
+from math import log
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+')
+
+ISBN_RE = re.compile(r'[0-9]+x?')
+
+# Sorts after every character a title word can contain
+PREFIX_SENTINEL = chr(sys.maxunicode)
+
+# A word in the title counts three times as much as one in the description
+FIELD_WEIGHTS = (('title', 3.0), ('author', 2.0), ('description', 1.0))
+ISBN_WEIGHT = 3.0
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def normalize_isbn(isbn):
+    """'978-0-13-110362-7' -> '9780131103627', so hyphenated and bare ISBNs match."""
+    return re.sub(r'[^0-9x]', '', (isbn or '').lower())
+
+
+def document_terms(title, author='', isbn='', description=''):
+    """Weighted term frequencies for one book, e.g. {'dune': 3.0, 'herbert': 2.0}."""
+    fields = {'title': title, 'author': author, 'description': description}
+    weights = {}
+    for field, weight in FIELD_WEIGHTS:
+        for word in WORD_RE.findall((fields[field] or '').lower()):
+            weights[word] = weights.get(word, 0.0) + weight
+
+    isbn_term = normalize_isbn(isbn)
+    if isbn_term:
+        weights[isbn_term] = weights.get(isbn_term, 0.0) + ISBN_WEIGHT
+    return {sys.intern(term): weight for term, weight in weights.items()}
+
+
+def query_terms(query):
+    """Lowercase query words in order, with duplicates dropped; ISBNs stay one term."""
+    query = query.lower()
+    compact = re.sub(r'[\s-]', '', query)
+    if ISBN_RE.fullmatch(compact):
+        return [compact]
+    return list(dict.fromkeys(WORD_RE.findall(query)))
+
+
+class PrefixIndex:
+    """
+    Sorted term array with one posting list per term.
+
+    Terms are kept in lexicographic order so every word sharing a prefix sits
+    in one contiguous run; a prefix lookup is two binary searches plus a union
+    of the postings in that run. Postings are sorted ``array('I')`` of book IDs,
+    which costs 4 bytes per entry instead of a set slot and a boxed int.
+    """
+
+    __slots__ = ('terms', 'postings')
+
+    def __init__(self):
+        self.terms = []
+        self.postings = []
+
+    @classmethod
+    def build(cls, book_words):
+        """Builds the index in one pass from a ``{book_id: words}`` mapping."""
+        by_term = {}
+        for book_id, words in book_words.items():
+            for word in words:
+                by_term.setdefault(word, []).append(book_id)
+
+        index = cls()
+        index.terms = sorted(by_term)
+        index.postings = [array('I', sorted(by_term[term])) for term in index.terms]
+        return index
+
+    def insert(self, word, book_id):
+        i = bisect_left(self.terms, word)
+        if i < len(self.terms) and self.terms[i] == word:
+            ids = self.postings[i]
+            j = bisect_left(ids, book_id)
+            if j == len(ids) or ids[j] != book_id:
+                ids.insert(j, book_id)
+        else:
+            self.terms.insert(i, word)
+            self.postings.insert(i, array('I', [book_id]))
+
+    def remove(self, word, book_id):
+        i = bisect_left(self.terms, word)
+        if i == len(self.terms) or self.terms[i] != word:
+            return
+        ids = self.postings[i]
+        j = bisect_left(ids, book_id)
+        if j < len(ids) and ids[j] == book_id:
+            del ids[j]
+        if not ids:
+            del self.terms[i]
+            del self.postings[i]
+
+    def prefix_range(self, prefix):
+        """Returns the ``[lo, hi)`` slice of terms starting with ``prefix``."""
+        lo = bisect_left(self.terms, prefix)
+        hi = bisect_left(self.terms, prefix + PREFIX_SENTINEL, lo)
+        return lo, hi
+
+    def search_prefix(self, prefix):
+        lo, hi = self.prefix_range(prefix)
+        if hi - lo == 1:
+            return set(self.postings[lo])
+        return set().union(*self.postings[lo:hi])
+
+    def __len__(self):
+        return len(self.terms)
+
+
+class InvertedIndex(PrefixIndex):
+    """
+    Prefix index whose postings also carry a weighted term frequency per book,
+    which is enough to rank matches with BM25.
+    """
+
+    __slots__ = ('weights', 'doc_lengths', 'total_length')
+
+    def __init__(self):
+        super().__init__()
+        self.weights = []
+        self.doc_lengths = {}
+        self.total_length = 0.0
+
+    @classmethod
+    def build(cls, documents):
+        """Builds the index in one pass from ``{book_id: {term: weight}}``."""
+        by_term = {}
+        index = cls()
+        for book_id, term_weights in documents.items():
+            for term, weight in term_weights.items():
+                by_term.setdefault(term, []).append((book_id, weight))
+            index.doc_lengths[book_id] = sum(term_weights.values())
+
+        index.terms = sorted(by_term)
+        for term in index.terms:
+            entries = sorted(by_term[term])
+            index.postings.append(array('I', [book_id for book_id, _ in entries]))
+            index.weights.append(array('f', [weight for _, weight in entries]))
+        index.total_length = sum(index.doc_lengths.values())
+        return index
+
+    def add_document(self, book_id, term_weights):
+        for term, weight in term_weights.items():
+            self.insert(term, book_id, weight)
+        length = sum(term_weights.values())
+        self.doc_lengths[book_id] = length
+        self.total_length += length
+
+    def remove_document(self, book_id, terms):
+        for term in terms:
+            self.remove(term, book_id)
+        self.total_length -= self.doc_lengths.pop(book_id, 0.0)
+
+    def insert(self, word, book_id, weight=1.0):
+        i = bisect_left(self.terms, word)
+        if i < len(self.terms) and self.terms[i] == word:
+            ids = self.postings[i]
+            j = bisect_left(ids, book_id)
+            if j < len(ids) and ids[j] == book_id:
+                self.weights[i][j] = weight
+            else:
+                ids.insert(j, book_id)
+                self.weights[i].insert(j, weight)
+        else:
+            self.terms.insert(i, word)
+            self.postings.insert(i, array('I', [book_id]))
+            self.weights.insert(i, array('f', [weight]))
+
+    def remove(self, word, book_id):
+        i = bisect_left(self.terms, word)
+        if i == len(self.terms) or self.terms[i] != word:
+            return
+        ids = self.postings[i]
+        j = bisect_left(ids, book_id)
+        if j < len(ids) and ids[j] == book_id:
+            del ids[j]
+            del self.weights[i][j]
+        if not ids:
+            del self.terms[i]
+            del self.postings[i]
+            del self.weights[i]
+
+    def search(self, query):
+        """
+        Returns the IDs of books matching every query word, best match first.
+
+        The last word is treated as a prefix because the browse page searches
+        as the user types. Words are processed rarest first, so each later
+        posting list only has to be probed for the books still in the running.
+        """
+        tokens = query_terms(query)
+        if not tokens or not self.doc_lengths:
+            return []
+
+        groups = []
+        for position, token in enumerate(tokens):
+            if position == len(tokens) - 1:
+                lo, hi = self.prefix_range(token)
+            else:
+                lo = bisect_left(self.terms, token)
+                hi = lo + 1 if lo < len(self.terms) and self.terms[lo] == token else lo
+            if lo == hi:
+                return []
+            groups.append(range(lo, hi))
+        groups.sort(key=lambda group: sum(len(self.postings[i]) for i in group))
+
+        book_count = len(self.doc_lengths)
+        average_length = self.total_length / book_count
+        scores = None
+        for group in groups:
+            group_scores = {}
+            for i in group:
+                ids, weights = self.postings[i], self.weights[i]
+                idf = log(1 + (book_count - len(ids) + 0.5) / (len(ids) + 0.5))
+                for book_id, tf in self._matches(ids, weights, scores):
+                    norm = tf + K1 * (1 - B + B * self.doc_lengths[book_id] / average_length)
+                    score = idf * tf * (K1 + 1) / norm
+                    # A prefix can expand to several words in one book; keep the best one
+                    if score > group_scores.get(book_id, 0.0):
+                        group_scores[book_id] = score
+
+            if scores is None:
+                scores = group_scores
+            else:
+                scores = {book_id: scores[book_id] + score for book_id, score in group_scores.items()}
+            if not scores:
+                return []
+
+        return sorted(scores, key=lambda book_id: (-scores[book_id], book_id))
+
+    @staticmethod
+    def _matches(ids, weights, candidates):
+        if candidates is None:
+            return zip(ids, weights)
+        if len(candidates) * 8 < len(ids):
+            # Few survivors left: binary-search each one instead of scanning the list
+            found = []
+            for book_id in candidates:
+                j = bisect_left(ids, book_id)
+                if j < len(ids) and ids[j] == book_id:
+                    found.append((book_id, weights[j]))
+            return found
+        return ((book_id, tf) for book_id, tf in zip(ids, weights) if book_id in candidates)
+
+
+def bitmap_from_ids(book_ids):
+    """Packs book IDs into an int with bit ``book_id`` set for each one."""
+    book_ids = list(book_ids)
+    if not book_ids:
+        return 0
+    bits = bytearray(max(book_ids) // 8 + 1)
+    for book_id in book_ids:
+        bits[book_id >> 3] |= 1 << (book_id & 7)
+    return int.from_bytes(bits, 'little')
+
+
+class FacetIndex:
+    """
+    One int bitmap per genre and per language, with bit ``book_id`` set for
+    every book carrying that facet.
+
+    Include filters are OR-ed within a facet and AND-ed across facets, exclude
+    filters drop books with ANY excluded tag, and the per-facet counts for the
+    sidebar are popcounts of the final mask, all without touching the database.
+    Books are also kept in title order so unsearched results can be paged.
+    """
+
+    __slots__ = ('genres', 'languages', 'all_books', 'book_facets', 'title_order')
+
+    def __init__(self):
+        self.genres = {}
+        self.languages = {}
+        self.all_books = 0
+        self.book_facets = {} # book_id -> (title, language_id, genre_ids)
+        self.title_order = array('I')
+
+    @classmethod
+    def build(cls, books):
+        """Builds the index from ``{book_id: (title, language_id, genre_ids)}``."""
+        index = cls()
+        index.book_facets = dict(books)
+        genres, languages = {}, {}
+        for book_id, (_, language_id, genre_ids) in books.items():
+            if language_id is not None:
+                languages.setdefault(language_id, []).append(book_id)
+            for genre_id in genre_ids:
+                genres.setdefault(genre_id, []).append(book_id)
+
+        index.genres = {genre_id: bitmap_from_ids(ids) for genre_id, ids in genres.items()}
+        index.languages = {language_id: bitmap_from_ids(ids) for language_id, ids in languages.items()}
+        index.all_books = bitmap_from_ids(books)
+        index.title_order = array('I', sorted(books, key=index._title_key))
+        return index
+
+    def add_book(self, book_id, title, language_id, genre_ids):
+        bit = 1 << book_id
+        if language_id is not None:
+            self.languages[language_id] = self.languages.get(language_id, 0) | bit
+        for genre_id in genre_ids:
+            self.genres[genre_id] = self.genres.get(genre_id, 0) | bit
+        self.all_books |= bit
+        self.book_facets[book_id] = (title, language_id, tuple(genre_ids))
+        self.title_order.insert(bisect_left(self.title_order, self._title_key(book_id), key=self._title_key), book_id)
+
+    def remove_book(self, book_id):
+        if book_id not in self.book_facets:
+            return
+        i = bisect_left(self.title_order, self._title_key(book_id), key=self._title_key)
+        del self.title_order[i]
+        _, language_id, genre_ids = self.book_facets.pop(book_id)
+
+        bit = 1 << book_id
+        if language_id is not None:
+            self.languages[language_id] &= ~bit
+        for genre_id in genre_ids:
+            self.genres[genre_id] &= ~bit
+        self.all_books &= ~bit
+
+    def _title_key(self, book_id):
+        # Same order as .order_by('title'), with the ID breaking ties
+        return self.book_facets[book_id][0], book_id
+
+    def filter(self, book_ids=None, genre_in=(), genre_ex=(), lang_in=(), lang_ex=()):
+        """
+        Applies the include/exclude filters to ``book_ids`` (ranked search hits)
+        or, when there is no search, to the whole catalogue in title order.
+
+        Returns the surviving IDs in their original order plus the per-genre and
+        per-language counts within that result.
+        """
+        mask = self.all_books
+        if book_ids is not None:
+            mask &= bitmap_from_ids(book_ids)
+
+        # 1. Include Logic (OR within a facet, e.g. Fiction OR Sci-Fi)
+        if genre_in:
+            mask &= self._union(self.genres, genre_in)
+        if lang_in:
+            mask &= self._union(self.languages, lang_in)
+
+        # 2. Exclude Logic (drop books with ANY of these tags)
+        if genre_ex:
+            mask &= ~self._union(self.genres, genre_ex)
+        if lang_ex:
+            mask &= ~self._union(self.languages, lang_ex)
+
+        if book_ids is None:
+            book_ids = self.title_order
+        if mask != self.all_books or len(book_ids) != len(self.book_facets):
+            bits = mask.to_bytes(mask.bit_length() // 8 + 1, 'little')
+            size = len(bits) * 8
+            book_ids = [
+                book_id for book_id in book_ids
+                if book_id < size and bits[book_id >> 3] >> (book_id & 7) & 1
+            ]
+
+        counts = {
+            'genre': {genre_id: (mask & bitmap).bit_count() for genre_id, bitmap in self.genres.items()},
+            'language': {language_id: (mask & bitmap).bit_count() for language_id, bitmap in self.languages.items()},
+        }
+        return book_ids, counts
+
+    @staticmethod
+    def _union(bitmaps, facet_ids):
+        union = 0
+        for facet_id in facet_ids:
+            union |= bitmaps.get(facet_id, 0)
+        return union
+
+
+class SearchIndex:
+    """
+    Process-resident catalogue index: ranked text search plus genre/language facets.
+
+    The index is loaded once per process and kept in memory. A small version
+    number in the cache tells us whether another process has changed the
+    catalogue; if so we replay the changes since our version (one cache entry
+    per change, holding the touched book ID) instead of reloading the whole
+    snapshot. Only ``manage.py build_search_index`` and ``import_catalogue``
+    rebuild from the database and publish a new snapshot.
+    """
+
+    __slots__ = ('_lock', '_index', '_facets', '_book_terms', '_version', '_gap')
+
+    SNAPSHOT_KEY = 'book_inverted_index'
+    SNAPSHOT_VERSION_KEY = 'book_search_index_snapshot_version'
+    VERSION_KEY = 'book_search_index_version'
+    # One entry per version: the changed book's ID, or RELOAD for a rebuild
+    CHANGE_KEY = 'book_search_index_change:%d'
+    CHANGE_TIMEOUT = 7 * 24 * 60 * 60
+    RELOAD = 'reload'
+    # Changes fetched per cache round trip while catching up
+    REPLAY_BATCH = 500
+    # Seconds to wait for a published version's entry before skipping it
+    GAP_GRACE = 10
+    FIELDS = ('pk', 'title', 'author', 'isbn', 'description', 'language_id')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._index = None
+        self._facets = None
+        self._book_terms = {} # book_id -> indexed terms, so edits can be undone
+        self._version = None
+        self._gap = None # (version, when first missed) while waiting for an entry
+
+    def search(self, query):
+        """Ranked book IDs for a free-text query over title, author, ISBN and description."""
+        self.sync()
+        with self._lock:
+            return self._index.search(query)
+
+    def search_prefix(self, prefix):
+        self.sync()
+        with self._lock:
+            return self._index.search_prefix(prefix)
+
+    def filter(self, book_ids=None, genre_in=(), genre_ex=(), lang_in=(), lang_ex=()):
+        """Genre/language filtering and sidebar counts; see ``FacetIndex.filter``."""
+        self.sync()
+        with self._lock:
+            return self._facets.filter(book_ids, genre_in, genre_ex, lang_in, lang_ex)
+
+    def search_and_filter(self, query, genre_in=(), genre_ex=(), lang_in=(), lang_ex=()):
+        """``search(query)`` (skipped when empty) then ``filter()``, catching up once for both."""
+        self.sync()
+        return self._search_and_filter(query, genre_in, genre_ex, lang_in, lang_ex)
+
+    async def asearch_and_filter(self, query, genre_in=(), genre_ex=(), lang_in=(), lang_ex=()):
+        """
+        ``search(query)`` (skipped when empty) then ``filter()``, for async views.
+
+        Catching up may read the database, so it runs where the ORM's async
+        calls do. The lookup itself is CPU work under the index lock, so it runs
+        on a pool thread. Neither blocks the event loop.
+        """
+        version = await cache.aget(self.VERSION_KEY)
+        if self._is_behind(version):
+            await sync_to_async(self.sync)()
+        return await sync_to_async(self._search_and_filter, thread_sensitive=False)(
+            query, genre_in, genre_ex, lang_in, lang_ex
+        )
+
+    def _search_and_filter(self, query, genre_in, genre_ex, lang_in, lang_ex):
+        with self._lock:
+            book_ids = self._index.search(query) if query else None
+            return self._facets.filter(book_ids, genre_in, genre_ex, lang_in, lang_ex)
+
+    def sync(self):
+        """Brings the in-memory index up to the version published in the cache."""
+        version = cache.get(self.VERSION_KEY)
+        if not self._is_behind(version):
+            return
+
+        with self._lock:
+            if self._index is None:
+                self._load(version)
+            elif self._is_behind(version):
+                self._replay_changes(version)
+
+    def _is_behind(self, version):
+        # A missing version (cache cleared) leaves the index as it is
+        return self._index is None or (version is not None and version != self._version)
+
+    def record_change(self, book_id):
+        """
+        Publishes that a book was added, edited or deleted, then catches up.
+
+        The version is taken first so concurrent writers never share one; a
+        reader that sees it before its entry is written waits for the entry.
+        """
+        version = self._next_version()
+        cache.set(self.CHANGE_KEY % version, book_id, timeout=self.CHANGE_TIMEOUT)
+        self.sync()
+
+    def rebuild(self):
+        """
+        Rebuilds the index from the database and publishes a fresh snapshot.
+
+        This reads every book, so it is for management commands, never a request.
+        Running processes load the snapshot when they reach its RELOAD entry.
+        """
+        from library_db.models import Book
+
+        with self._lock:
+            # Versioned before reading, so a change the read misses comes after it
+            version = self._next_version()
+            cache.set(self.CHANGE_KEY % version, self.RELOAD, timeout=self.CHANGE_TIMEOUT)
+            index = self._build(Book.objects.all(), version)
+            cache.set(self.SNAPSHOT_KEY, pickle.dumps(self._snapshot()), timeout=None)
+            cache.set(self.SNAPSHOT_VERSION_KEY, version, timeout=None)
+            return index
+
+    def _build(self, books, version):
+        documents, facets = self._fetch_books(books)
+        self._index = InvertedIndex.build(documents)
+        self._book_terms = {book_id: tuple(terms) for book_id, terms in documents.items()}
+        self._facets = FacetIndex.build(facets)
+        self._version = version
+        return self._index
+
+    def _snapshot(self):
+        return {'version': self._version, 'index': self._index, 'facets': self._facets, 'book_terms': self._book_terms}
+
+    def _next_version(self):
+        try:
+            return cache.incr(self.VERSION_KEY)
+        except ValueError:
+            if cache.add(self.VERSION_KEY, 1, timeout=None):
+                return 1
+            return cache.incr(self.VERSION_KEY)
+
+    def _load(self, version):
+        """
+        Takes the published snapshot and replays the changes made since. With no
+        snapshot yet, this process indexes the database for itself; publishing
+        one is left to ``manage.py build_search_index``.
+        """
+        from library_db.models import Book
+
+        if not self._load_snapshot():
+            # `version` was read before the books, so nothing falls between them
+            self._build(Book.objects.all(), version or 0)
+        if version is not None and version != self._version:
+            self._replay_changes(version)
+
+    def _load_snapshot(self, newer_than=0):
+        pickled = cache.get(self.SNAPSHOT_KEY)
+        try:
+            snapshot = pickle.loads(pickled) if pickled else None
+        except Exception:
+            snapshot = None
+        if not isinstance(snapshot, dict) or not isinstance(snapshot.get('facets'), FacetIndex):
+            return False
+        if snapshot['version'] < newer_than:
+            return False
+        self._index = snapshot['index']
+        self._facets = snapshot['facets']
+        self._book_terms = snapshot['book_terms']
+        self._version = snapshot['version']
+        return True
+
+    def _replay_changes(self, version):
+        """
+        Reindexes the books changed after our version, up to ``version``.
+
+        Reindexing reads a book's current row, so replaying a change twice is
+        harmless. That makes a version counter that went backwards (the cache
+        was cleared) safe to replay from the start. An entry that is not there
+        yet stops the replay at the change before it; the next sync picks up
+        from there.
+        """
+        if version < self._version:
+            self._version = 0
+
+        changed, fetched = set(), {}
+        position = self._version + 1
+        while position <= version:
+            key = self.CHANGE_KEY % position
+            if key not in fetched:
+                batch = [self.CHANGE_KEY % v for v in range(position, min(position + self.REPLAY_BATCH, version + 1))]
+                fetched = dict.fromkeys(batch)
+                fetched.update(cache.get_many(batch))
+
+            book_id = fetched[key]
+            if book_id == self.RELOAD:
+                # A rebuild: everything before it is in its snapshot, once published
+                if (cache.get(self.SNAPSHOT_VERSION_KEY) or 0) < position or not self._load_snapshot(position):
+                    break
+                changed.clear()
+                position = self._version + 1
+                continue
+            if book_id is None:
+                if not self._gap_expired(position):
+                    break
+                # Evicted, or its writer died between taking the version and writing it
+                logger.warning('Search index change %d never arrived; run build_search_index '
+                               'if a book edited around then is missing from search.', position)
+            else:
+                changed.add(book_id)
+            position += 1
+
+        self._reindex(changed)
+        self._version = position - 1
+
+    def _gap_expired(self, version):
+        now = time.monotonic()
+        if self._gap is None or self._gap[0] != version:
+            self._gap = (version, now)
+        return now - self._gap[1] >= self.GAP_GRACE
+
+    def _reindex(self, book_ids):
+        from library_db.models import Book
+
+        book_ids = list(book_ids)
+        for start in range(0, len(book_ids), self.REPLAY_BATCH):
+            chunk = book_ids[start:start + self.REPLAY_BATCH]
+            documents, facets = self._fetch_books(Book.objects.filter(pk__in=chunk))
+            for book_id in chunk:
+                self._index.remove_document(book_id, self._book_terms.pop(book_id, ()))
+                self._facets.remove_book(book_id)
+                if book_id in documents:
+                    self._index.add_document(book_id, documents[book_id])
+                    self._book_terms[book_id] = tuple(documents[book_id])
+                    self._facets.add_book(book_id, *facets[book_id])
+
+    def _fetch_books(self, books):
+        """Reads what both indexes need: ``({id: term weights}, {id: (title, language, genres)})``."""
+        documents, facets = {}, {}
+        for book_id, title, author, isbn, description, language_id in books.values_list(*self.FIELDS).iterator():
+            documents[book_id] = document_terms(title, author, isbn, description)
+            facets[book_id] = (title, language_id, [])
+
+        genre_links = books.model.genre.through.objects.filter(book__in=books)
+        for book_id, genre_id in genre_links.values_list('book_id', 'genre_id').iterator():
+            facets[book_id][2].append(genre_id)
+        return documents, {book_id: (title, language_id, tuple(genre_ids))
+                           for book_id, (title, language_id, genre_ids) in facets.items()}
+
+
+search_index = SearchIndex()
+
+
+class SearchResults:
+    """
+    Ranked book IDs that load their rows lazily, one page at a time.
+
+    Paginator only needs ``count()`` and slicing, so handing it this object
+    means the total comes straight from the index and only the requested
+    page's books are fetched, in one query, in rank order.
+    """
+
+    def __init__(self, book_ids, queryset=None):
+        from library_db.models import Book
+
+        self.book_ids = book_ids
+        self.queryset = queryset if queryset is not None else Book.objects.for_catalogue()
+
+    def count(self):
+        return len(self.book_ids)
+
+    def __len__(self):
+        return len(self.book_ids)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            ids = self.book_ids[key]
+            books = self.queryset.in_bulk(ids)
+            return [books[book_id] for book_id in ids if book_id in books]
+        return self[key:key + 1][0]
@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from library_db import stats
+from library_db.catalogue import bump_catalogue_generation
+from library_db.models import Book, IssueRecord, Request
+from library_db.search import search_index
+
+
+# Columns the search and facet indexes are built from
+INDEXED_FIELDS = {'title', 'author', 'isbn', 'description', 'language'}
+
+
+def reindex_on_commit(book_id):
+    transaction.on_commit(lambda: search_index.record_change(book_id))
+
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, update_fields=None, **kwargs):
+    # Saves that don't touch indexed columns (e.g. copy counts) can't change the index
+    if update_fields is not None and not INDEXED_FIELDS.intersection(update_fields):
+        return
+    reindex_on_commit(instance.pk)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+    reindex_on_commit(instance.pk)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def reindex_book_genres(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        reindex_on_commit(instance.pk)
+    elif pk_set:
+        # genre.books.add(...) etc.: pk_set holds the affected books
+        for book_id in pk_set:
+            reindex_on_commit(book_id)
+
+
+# Anything that can change a book card (details, genres, available copies)
+# moves the catalogue to a new generation so cached grid fragments are dropped
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(m2m_changed, sender=Book.genre.through)
+@receiver(post_save, sender=IssueRecord)
+def invalidate_catalogue_fragments(sender, **kwargs):
+    transaction.on_commit(bump_catalogue_generation)
+
+
+# Dashboard counters. Saves count the difference from the row as it was in
+# the database, so edits through the admin site are counted too.
+
+def counted_values(sender, instance):
+    return {field: getattr(instance, field) for field in stats.TRACKED_FIELDS[sender]}
+
+
+@receiver(pre_save, sender=Book)
+@receiver(pre_save, sender=IssueRecord)
+@receiver(pre_save, sender=Request)
+def remember_counted_values(sender, instance, **kwargs):
+    instance._counted = None
+    if not instance._state.adding:
+        instance._counted = sender.objects.filter(pk=instance.pk).values(*stats.TRACKED_FIELDS[sender]).first()
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=IssueRecord)
+@receiver(post_save, sender=Request)
+def count_saved(sender, instance, **kwargs):
+    stats.record_change(sender, getattr(instance, '_counted', None), counted_values(sender, instance))
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=IssueRecord)
+@receiver(post_delete, sender=Request)
+def count_deleted(sender, instance, **kwargs):
+    stats.record_change(sender, counted_values(sender, instance), None)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def count_new_user(sender, created, **kwargs):
+    if created:
+        stats.bump(users=1)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def count_deleted_user(sender, **kwargs):
+    stats.bump(users=-1)
@@ -0,0 +1,159 @@
+"""
+Denormalized counts for the admin dashboard and user list.
+
+Saves and deletes of model instances are counted by the signal handlers in
+library_db.signals; the inventory service's queryset updates, which send no
+signals, call bump() themselves. Each change is counted in the transaction
+that made it. Counter rows that don't exist yet (a new install, a flushed
+table) start from the true values, and `manage.py reconcile_stats`
+recomputes everything from the source tables to correct any drift.
+"""
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, Count, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from library_db.models import Book, IssueRecord, Request, StatCounter, UserStats
+
+BOOK_COUNTERS = ('books', 'total_copies', 'available_copies')
+COUNTERS = BOOK_COUNTERS + ('users', 'pending_requests', 'active_issues', 'overdue_issues')
+
+# The columns each counted model contributes from
+TRACKED_FIELDS = {
+    Book: ('total_copies', 'available_copies'),
+    IssueRecord: ('status', 'user_id'),
+    Request: ('status',),
+}
+
+
+def bump(**deltas):
+    """Adds to counters in one UPDATE, e.g. bump(pending_requests=-1, active_issues=1)."""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = StatCounter.objects.filter(name__in=deltas).update(
+        value=F('value') + Case(*[When(name=name, then=Value(delta)) for name, delta in deltas.items()],
+                                output_field=BigIntegerField())
+    )
+    if updated < len(deltas):
+        _seed(set(deltas) - set(StatCounter.objects.filter(name__in=deltas).values_list('name', flat=True)))
+
+
+def bump_user(user_id, delta):
+    if delta and not UserStats.objects.filter(user_id=user_id).update(active_issues=F('active_issues') + delta):
+        # No row yet: start from the true count, which already includes this change
+        UserStats.objects.create(user_id=user_id, active_issues=_active_issues_by_user([user_id]).get(user_id, 0))
+
+
+def bump_users(deltas):
+    """bump_user for many users at once, e.g. bump_users({3: 1, 7: -2}), in one UPDATE."""
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = UserStats.objects.filter(user_id__in=deltas).update(
+        active_issues=F('active_issues') + Case(*[When(user_id=user_id, then=Value(delta)) for user_id, delta in deltas.items()],
+                                                output_field=IntegerField())
+    )
+    if updated < len(deltas):
+        missing = set(deltas) - set(UserStats.objects.filter(user_id__in=deltas).values_list('user_id', flat=True))
+        true = _active_issues_by_user(missing)
+        UserStats.objects.bulk_create([UserStats(user_id=user_id, active_issues=true.get(user_id, 0)) for user_id in missing])
+
+
+def record_change(model, old, new):
+    """
+    Counts one row changing from ``old`` to ``new`` (dicts of TRACKED_FIELDS;
+    None for a created or deleted row).
+    """
+    old_counts, old_user = _contribution(model, old)
+    new_counts, new_user = _contribution(model, new)
+    bump(**{name: new_counts.get(name, 0) - old_counts.get(name, 0) for name in old_counts.keys() | new_counts.keys()})
+    if old_user:
+        bump_user(old_user[0], -old_user[1])
+    if new_user:
+        bump_user(new_user[0], new_user[1])
+
+
+def snapshot():
+    """Every counter by name, in one query."""
+    values = dict(StatCounter.objects.filter(name__in=COUNTERS).values_list('name', 'value'))
+    missing = set(COUNTERS) - values.keys()
+    if missing:
+        values.update(_seed(missing))
+    return values
+
+
+def actual(names=COUNTERS):
+    """The true counts, straight from the source tables."""
+    values = {}
+    if set(names) & set(BOOK_COUNTERS):
+        values.update(Book.objects.aggregate(
+            books=Count('pk'),
+            total_copies=Coalesce(Sum('total_copies'), 0),
+            available_copies=Coalesce(Sum('available_copies'), 0),
+        ))
+    if 'users' in names:
+        values['users'] = get_user_model().objects.count()
+    if 'pending_requests' in names:
+        values['pending_requests'] = Request.objects.filter(status='pending').count()
+    if {'active_issues', 'overdue_issues'} & set(names):
+        values.update(IssueRecord.objects.aggregate(
+            active_issues=Count('pk', filter=Q(status__in=IssueRecord.ACTIVE_STATUSES)),
+            overdue_issues=Count('pk', filter=Q(status='overdue')),
+        ))
+    return {name: values[name] for name in names}
+
+
+def reconcile(names=COUNTERS, users=True, fix=True):
+    """
+    Resets every counter (and, with users, every per-user count) that has
+    drifted from the source tables. Returns {name: (stored, actual)} for
+    each one found; per-user entries are keyed 'user <id>'. With fix=False
+    the drift is only reported.
+    """
+    drift = {}
+    # One transaction, so nothing is counted twice or missed while comparing
+    with transaction.atomic():
+        stored = dict(StatCounter.objects.values_list('name', 'value'))
+        for name, value in actual(names).items():
+            if stored.get(name) != value:
+                drift[name] = (stored.get(name), value)
+                if fix:
+                    StatCounter.objects.update_or_create(name=name, defaults={'value': value})
+
+        if users:
+            stored = dict(UserStats.objects.values_list('user_id', 'active_issues'))
+            true = _active_issues_by_user()
+            for user_id in stored.keys() | true.keys():
+                if stored.get(user_id, 0) != true.get(user_id, 0):
+                    drift[f'user {user_id}'] = (stored.get(user_id), true.get(user_id, 0))
+                    if fix:
+                        UserStats.objects.update_or_create(user_id=user_id,
+                                                           defaults={'active_issues': true.get(user_id, 0)})
+    return drift
+
+
+def _contribution(model, values):
+    if values is None:
+        return {}, None
+    if model is Book:
+        return {'books': 1, 'total_copies': values['total_copies'], 'available_copies': values['available_copies']}, None
+    if model is IssueRecord:
+        active = int(values['status'] in IssueRecord.ACTIVE_STATUSES)
+        return {'active_issues': active, 'overdue_issues': int(values['status'] == 'overdue')}, (values['user_id'], active)
+    return {'pending_requests': int(values['status'] == 'pending')}, None
+
+
+def _active_issues_by_user(user_ids=None):
+    issues = IssueRecord.objects.filter(status__in=IssueRecord.ACTIVE_STATUSES)
+    if user_ids is not None:
+        issues = issues.filter(user_id__in=user_ids)
+    return dict(issues.order_by().values('user_id').annotate(n=Count('pk')).values_list('user_id', 'n'))
+
+
+def _seed(names):
+    values = actual(sorted(names))
+    StatCounter.objects.bulk_create([StatCounter(name=name, value=value) for name, value in values.items()],
+                                    ignore_conflicts=True)
+    return values
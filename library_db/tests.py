@@ -1,3 +1,1224 @@
-from django.test import TestCase
+import csv
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.core.paginator import Paginator
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from library_db import activity, inventory, recommendations, stats
+from library_db.importer import CatalogueWriter
+from library_db.management.commands.bench_suite import ENDPOINTS, measure_client, seed
+from library_db.pagination import encode_cursor, page_links
+from library_db.models import (
+    Book, BookNeighbour, BookViewCount, Genre, IssueRecord, Language, Request, StatCounter, UserStats,
+    WaitingList, WaitingListQuerySet,
+)
+from library_db.search import SearchIndex, search_index
+
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        search_index.rebuild()
+
+    def test_index_follows_book_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(isbn='1', title='Dune Messiah', author='Frank Herbert',
+                                       total_copies=1, available_copies=1)
+        self.assertEqual(search_index.search_prefix('mess'), {book.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.title = 'Children of Dune'
+            book.save()
+        self.assertEqual(search_index.search_prefix('mess'), set())
+        self.assertEqual(search_index.search_prefix('chil'), {book.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.delete()
+        self.assertEqual(search_index.search_prefix('dune'), set())
+
+    def test_ranked_search_over_title_author_and_isbn(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            dune = Book.objects.create(isbn='978-0-441-17271-9', title='Dune', author='Frank Herbert',
+                                       description='Desert planet.', total_copies=1, available_copies=1)
+            messiah = Book.objects.create(isbn='978-0-441-17269-6', title='Dune Messiah', author='Frank Herbert',
+                                          total_copies=1, available_copies=1)
+            guide = Book.objects.create(isbn='978-0-345-39180-3', title='Desert Guide', author='Dune Smith',
+                                        total_copies=1, available_copies=1)
+
+        # A title hit outranks an author hit; every word must match
+        self.assertEqual(search_index.search('dune')[-1], guide.pk)
+        self.assertEqual(search_index.search('herbert mess'), [messiah.pk])
+        self.assertEqual(search_index.search('9780441172719'), [dune.pk])
+        self.assertEqual(search_index.search('978-0-441-1727'), [dune.pk])
+        self.assertEqual(search_index.search('dune nothing'), [])
+
+    def test_filter_books_pages_in_rank_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(1, 10):
+                Book.objects.create(isbn=f'isbn-{n}', title=f'Volume {n}', author='Anon',
+                                    description='A Dune story.', total_copies=1, available_copies=1)
+            Book.objects.create(isbn='isbn-top', title='Dune', author='Frank Herbert',
+                                total_copies=1, available_copies=1)
+
+        # The title match ranks above the description matches, across pages
+        html = self.client.get('/api/filter-books/', {'search': 'dune', 'page': 1}).json()['books_html']
+        self.assertLess(html.index('>Dune<'), html.index('>Volume 1<'))
+        self.assertNotIn('>Volume 8<', html)
+
+        html = self.client.get('/api/filter-books/', {'search': 'dune', 'page': 2}).json()['books_html']
+        self.assertIn('>Volume 8<', html)
+        self.assertNotIn('>Dune<', html)
+
+    def test_facet_filters_and_counts(self):
+        fiction = Genre.objects.create(genre_name='Fiction')
+        horror = Genre.objects.create(genre_name='Horror')
+        english = Language.objects.create(language_name='English')
+        with self.captureOnCommitCallbacks(execute=True):
+            both = Book.objects.create(isbn='1', title='A', author='X', language=english,
+                                       total_copies=1, available_copies=1)
+            both.genre.add(fiction, horror)
+            scary = Book.objects.create(isbn='2', title='B', author='X', total_copies=1, available_copies=1)
+            scary.genre.add(horror)
+            plain = Book.objects.create(isbn='3', title='C', author='X', language=english,
+                                        total_copies=1, available_copies=1)
+
+        # Matching several included genres must not duplicate a book
+        ids, counts = search_index.filter(genre_in=[fiction.pk, horror.pk])
+        self.assertEqual(ids, [both.pk, scary.pk])
+        self.assertEqual(counts['genre'], {fiction.pk: 1, horror.pk: 2})
+        self.assertEqual(counts['language'], {english.pk: 1})
+
+        ids, _ = search_index.filter(genre_ex=[horror.pk], lang_in=[english.pk])
+        self.assertEqual(ids, [plain.pk])
+
+        ids, _ = search_index.filter(search_index.search('c'), genre_ex=[fiction.pk])
+        self.assertEqual(ids, [plain.pk])
+
+    def test_filter_books_catches_up_once_per_request(self):
+        with mock.patch.object(SearchIndex, 'sync', autospec=True, side_effect=SearchIndex.sync) as sync:
+            self.client.get('/api/filter-books/', {'search': 'dune', 'genre_in': '1'})
+        self.assertEqual(sync.call_count, 1)
+
+    def test_other_processes_wait_for_a_change_instead_of_rebuilding(self):
+        other = SearchIndex()
+        other.sync()
+        first = Book.objects.create(isbn='1', title='Dune Messiah', author='X', total_copies=1, available_copies=1)
+        second = Book.objects.create(isbn='2', title='Messiah Redux', author='X', total_copies=1, available_copies=1)
+        # Two writers took versions; the later one wrote its entry first
+        first_version, second_version = search_index._next_version(), search_index._next_version()
+        cache.set(SearchIndex.CHANGE_KEY % second_version, second.pk)
+
+        with mock.patch.object(SearchIndex, 'rebuild') as rebuild:
+            self.assertEqual(other.search_prefix('mess'), set())
+            cache.set(SearchIndex.CHANGE_KEY % first_version, first.pk)
+            self.assertEqual(other.search_prefix('mess'), {first.pk, second.pk})
+        rebuild.assert_not_called()
+
+    def test_a_change_that_never_arrives_is_skipped(self):
+        other = SearchIndex()
+        other.sync()
+        search_index._next_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(isbn='1', title='Dune Messiah', author='X', total_copies=1, available_copies=1)
+
+        with mock.patch.object(SearchIndex, 'GAP_GRACE', 0), self.assertLogs('library_db.search', 'WARNING'):
+            self.assertEqual(other.search_prefix('mess'), {book.pk})
+
+    def test_other_processes_load_a_rebuilt_snapshot(self):
+        other = SearchIndex()
+        other.sync()
+        # Imports skip the signals and rebuild afterwards
+        book, = Book.objects.bulk_create([Book(isbn='1', title='Dune Messiah', author='X',
+                                               total_copies=1, available_copies=1)])
+        SearchIndex().rebuild()
+
+        with mock.patch.object(SearchIndex, '_fetch_books') as fetch_books:
+            self.assertEqual(other.search_prefix('mess'), {book.pk})
+        fetch_books.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogueQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.language = Language.objects.create(language_name='English')
+        self.genres = [Genre.objects.create(genre_name=f'Genre {n}') for n in range(3)]
+        user = get_user_model().objects.create_user(username='reader', email='reader@example.com',
+                                                    password='pw', is_staff=True)
+        self.client.force_login(user)
+        # Counters start from the tables on first use; do that here, not in a measured request
+        stats.snapshot()
+
+    def add_books(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(count):
+                book = Book.objects.create(isbn=f'{count}-{n}', title=f'Book {count}-{n}', author='X',
+                                           language=self.language, total_copies=1, available_copies=1)
+                book.genre.add(*self.genres)
+        search_index.sync()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        for url in ('/user/browse/', '/admin/books/', '/api/filter-books/'):
+            with self.subTest(url=url):
+                Book.objects.all().delete()
+                self.add_books(1)
+                one_book = self.count_queries(url)
+                self.add_books(7)
+                full_page = self.count_queries(url)
+                self.assertEqual(one_book, full_page)
+
+    def test_grid_fragment_is_cached_until_inventory_changes(self):
+        self.client.logout()
+        self.add_books(1)
+        book = Book.objects.get()
+        self.assertIn('Copies Available: 1 / 1', self.client.get('/api/filter-books/').json()['books_html'])
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/filter-books/', {'page': '1', 'genre_in': ''})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.available_copies = 0
+            book.save(update_fields=['available_copies'])
+        self.assertIn('Copies Available: 0 / 1', self.client.get('/api/filter-books/').json()['books_html'])
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'library_db.cache_backends.TieredCache',
+                'LOCATION': 'tiered-test-shared',
+                'OPTIONS': {'MAX_BYTES': 16 * 1024, 'LOCAL_BYPASS': ['counter']},
+            },
+            'tiered-test-shared': {
+                'BACKEND': 'library_db.cache_backends.SQLiteCache',
+                'LOCATION': os.path.join(directory.name, 'cache.sqlite3'),
+            },
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+
+    def test_reads_come_from_the_local_tier_until_bypassed(self):
+        cache.set('grid', {'html': 'x'})
+        caches['tiered-test-shared'].set('grid', {'html': 'changed elsewhere'})
+        local_hits = cache.stats()['local_hits']
+        self.assertEqual(cache.get('grid'), {'html': 'x'})
+        self.assertEqual(cache.stats()['local_hits'], local_hits + 1)
+
+        cache.set('counter', 1)
+        caches['tiered-test-shared'].incr('counter')
+        self.assertEqual(cache.get('counter'), 2)
+        self.assertEqual(cache.incr('counter'), 3)
+
+    def test_local_tier_is_bounded_in_bytes(self):
+        for n in range(40):
+            cache.set(f'key-{n}', 'x' * 900)
+        stats = cache.stats()
+        self.assertLessEqual(stats['local_bytes'], 16 * 1024)
+        self.assertGreater(stats['evictions'], 0)
+        # Evicted locally, still served by the shared tier
+        self.assertEqual(cache.get('key-0'), 'x' * 900)
+
+    async def test_async_methods_share_both_tiers(self):
+        await cache.aset('grid', {'html': 'x'})
+        self.assertFalse(await cache.aadd('grid', {'html': 'y'}))
+        local_hits = cache.stats()['local_hits']
+        self.assertEqual(await cache.aget('grid'), {'html': 'x'})
+        self.assertEqual(cache.stats()['local_hits'], local_hits + 1)
+
+        await cache.aset('counter', 1)
+        await sync_to_async(caches['tiered-test-shared'].incr, thread_sensitive=False)('counter')
+        self.assertEqual(await cache.aget('counter'), 2)
+        self.assertEqual(await cache.aget('missing', 'default'), 'default')
+
+    def test_get_many_reads_the_shared_tier_in_one_query(self):
+        cache.set_many({'grid': 1, 'counter': 2})
+        caches['tiered-test-shared'].set_many({'elsewhere': 3})
+        shared = type(caches['tiered-test-shared'])
+        with mock.patch.object(shared, 'get', side_effect=AssertionError('read one key at a time')):
+            found = cache.get_many(['grid', 'counter', 'elsewhere', 'missing'])
+        self.assertEqual(found, {'grid': 1, 'counter': 2, 'elsewhere': 3})
+
+        # Served locally from now on; the bypassed counter still comes from the shared tier
+        caches['tiered-test-shared'].set_many({'elsewhere': 4, 'counter': 5})
+        self.assertEqual(cache.get_many(['elsewhere', 'counter']), {'elsewhere': 3, 'counter': 5})
+
+    def test_shared_sqlite_tier_semantics(self):
+        shared = caches['tiered-test-shared']
+        self.assertTrue(shared.add('a', 1))
+        self.assertFalse(shared.add('a', 2))
+        self.assertEqual(shared.incr('a', 5), 6)
+        with self.assertRaises(ValueError):
+            shared.incr('missing')
+        shared.set('gone', 1, timeout=-1)
+        self.assertIsNone(shared.get('gone'))
+        self.assertTrue(shared.add('gone', 2))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ImportCatalogueTests(TestCase):
+    HEADER = 'isbn,Title,Author,Genres,Description,Language,Total Copies,available_copies\n'
+
+    def write_csv(self, rows):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'books.csv')
+        with open(path, 'w') as f:
+            f.write(self.HEADER + rows)
+        return path
+
+    def import_csv(self, path, **options):
+        call_command('import_catalogue', path, chunk_size=2, stdout=io.StringIO(), **options)
+
+    def test_import_upserts_on_isbn_and_indexes_books(self):
+        self.import_csv(self.write_csv(
+            '1111111111,Dune,Frank Herbert,Sci-Fi;Classic,,English,3,3\n'
+            '2222222222,Emma,Jane Austen,Classic,,English,2,2\n'
+            '3333333333,Gitanjali,Tagore,Poetry,,Bengali,1,1\n'
+        ))
+        self.import_csv(self.write_csv('1111111111,Dune (Deluxe),Frank Herbert,Sci-Fi;Space,,English,5,4\n'))
+
+        self.assertEqual(Book.objects.count(), 3)
+        dune = Book.objects.get(isbn='1111111111')
+        self.assertEqual((dune.title, dune.total_copies, dune.available_copies), ('Dune (Deluxe)', 5, 4))
+        self.assertEqual(sorted(dune.genre.values_list('genre_name', flat=True)), ['Classic', 'Sci-Fi', 'Space'])
+        self.assertEqual(Language.objects.count(), 2)
+        self.assertEqual(search_index.search_prefix('delu'), {dune.pk})
+
+    def test_rejected_rows_are_reported_with_line_numbers(self):
+        path = self.write_csv(
+            '978-0-13-110362-7,C Programming,Kernighan,,,English,2,1\n'
+            'not-an-isbn,Bad ISBN,Nobody,,,English,1,1\n'
+            '9780000000002,Too Many Out,Someone,,,English,1,3\n'
+            '9780000000003,"Unclosed,Someone,,,English,1,1\n'
+            '9780000000004,Fine,Someone,,,,1,1\n'
+        )
+        self.import_csv(path, workers=2, range_size=64)
+
+        self.assertEqual(sorted(Book.objects.values_list('isbn', flat=True)), ['9780000000004', '9780131103627'])
+        with open(path + '.errors.csv') as f:
+            self.assertEqual([row[0] for row in csv.reader(f)], ['line', '3', '4', '5'])
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_interrupted_import_resumes_from_checkpoint(self):
+        path = self.write_csv(''.join(f'978000000000{i},Book {i},Author,,,English,1,1\n' for i in range(6)))
+        original_write = CatalogueWriter.write
+        calls = []
+
+        def interrupt_third_write(writer, rows):
+            calls.append(rows)
+            if len(calls) == 3:
+                raise RuntimeError('interrupted')
+            original_write(writer, rows)
+
+        # range_size=1 makes every line its own range, so each write is followed by a checkpoint
+        with mock.patch.object(CatalogueWriter, 'write', interrupt_third_write):
+            with self.assertRaises(RuntimeError):
+                self.import_csv(path, range_size=1)
+        self.assertEqual(Book.objects.count(), 2)
+
+        self.import_csv(path, range_size=1, resume=True)
+        self.assertEqual(Book.objects.count(), 6)
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class WaitingListTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.users = [User.objects.create(username=f'reader{i}', email=f'reader{i}@example.com', phone=str(i))
+                      for i in range(3)]
+        self.book = Book.objects.create(isbn='1', title='Dune', author='Frank Herbert', total_copies=1, available_copies=0)
+        self.other = Book.objects.create(isbn='2', title='Emma', author='Jane Austen', total_copies=1, available_copies=0)
+
+    def test_queues_are_per_book_and_rank_follows_the_head(self):
+        first, second, third = self.users
+        self.client.force_login(third)
+        response = self.client.post(reverse('request_book', args=[self.other.pk]))
+        self.assertEqual(response.json()['position'], 1)
+
+        entries = [WaitingList.objects.enqueue(user, self.book) for user in self.users]
+        self.assertEqual([entry.position for entry in entries], [1, 2, 3])
+
+        entries[0].delete()
+        self.assertEqual(WaitingList.objects.enqueue(first, self.book).position, 4)
+        ranks = dict(WaitingList.objects.filter(book=self.book).with_rank().values_list('user', 'rank'))
+        self.assertEqual(ranks, {second.pk: 1, third.pk: 2, first.pk: 3})
+
+    def test_losing_a_race_for_a_position_still_queues_the_user(self):
+        first, second, _ = self.users
+        head = WaitingList.objects.enqueue(first, self.book)
+        create = WaitingListQuerySet.create
+        calls = []
+
+        def racing_create(queryset, **fields):
+            calls.append(fields)
+            if len(calls) == 1:
+                # A concurrent enqueue took this number first
+                fields = dict(fields, position=head.position)
+            return create(queryset, **fields)
+
+        self.client.force_login(second)
+        with mock.patch.object(WaitingListQuerySet, 'create', racing_create):
+            response = self.client.post(reverse('request_book', args=[self.book.pk]))
+        self.assertEqual((response.status_code, response.json()['position']), (200, 2))
+        self.assertEqual(len(calls), 2)
+
+        # Only a second place for the same user is refused
+        response = self.client.post(reverse('request_book', args=[self.book.pk]))
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaises(IntegrityError):
+            WaitingList.objects.enqueue(second, self.book)
+
+    def test_return_issues_the_copy_to_the_head_of_the_queue(self):
+        holder, first, second = self.users
+        issue = IssueRecord.objects.create(user=holder, book=self.book, issue_date='2025-01-01',
+                                           due_date='2025-01-15', status='issued')
+        WaitingList.objects.enqueue(first, self.book)
+        WaitingList.objects.enqueue(second, self.book)
+
+        _, promoted = inventory.return_issue(issue.pk)
+
+        self.assertEqual((promoted.user, promoted.status), (first, 'issued'))
+        self.assertTrue(Request.objects.filter(user=first, book=self.book, status='approved').exists())
+        self.assertEqual(list(WaitingList.objects.filter(book=self.book).values_list('user', flat=True)), [second.pk])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RequestBookTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='reader', email='reader@example.com', phone='1')
+        self.book = Book.objects.create(isbn='1', title='Dune', author='Frank Herbert', total_copies=1, available_copies=1)
+        self.client.force_login(self.user)
+
+    def test_eligibility_is_checked_in_one_query(self):
+        url = reverse('request_book', args=[self.book.pk])
+        self.assertEqual(self.client.post(url).json()['status'], 'pending')
+
+        # Session and user lookups, then a single eligibility query
+        with self.assertNumQueries(3):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pending approval', response.json()['message'])
+        self.assertEqual(Request.objects.filter(user=self.user, book=self.book).count(), 1)
+
+    def test_one_pending_request_and_active_issue_per_user_and_book(self):
+        Request.objects.create(user=self.user, book=self.book)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Request.objects.create(user=self.user, book=self.book)
+        Request.objects.create(user=self.user, book=self.book, status='rejected')
+
+        IssueRecord.objects.create(user=self.user, book=self.book, issue_date='2025-01-01',
+                                   due_date='2025-01-15', status='issued')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            IssueRecord.objects.create(user=self.user, book=self.book, issue_date='2025-01-02',
+                                       due_date='2025-01-16', status='overdue')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, ROOT_URLCONF='LMS.asgi_urls')
+class AsyncViewTests(TestCase):
+    """filter_books and request_book as served under ASGI."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(username='reader', email='reader@example.com', phone='1')
+        self.dune = Book.objects.create(isbn='1', title='Dune', author='Frank Herbert', total_copies=1, available_copies=1)
+        self.gone = Book.objects.create(isbn='2', title='Emma', author='Jane Austen', total_copies=1, available_copies=0)
+        search_index.rebuild()
+
+    async def test_filter_books_searches_off_the_event_loop(self):
+        await self.async_client.aforce_login(self.user)
+        loop_thread = threading.current_thread()
+        threads = []
+        search = SearchIndex._search_and_filter
+
+        def recording_search(index, *args):
+            threads.append(threading.current_thread())
+            return search(index, *args)
+
+        with mock.patch.object(SearchIndex, '_search_and_filter', recording_search):
+            payload = (await self.async_client.get(reverse('filter_books'), {'search': 'dun'})).json()
+            # The second request is the cached fragment
+            self.assertEqual((await self.async_client.get(reverse('filter_books'), {'search': 'dun'})).json(), payload)
+        self.assertIn('>Dune<', payload['books_html'])
+        self.assertNotIn('>Emma<', payload['books_html'])
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], loop_thread)
+
+    async def test_request_book(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('request_book', args=[self.dune.pk]))
+        self.assertEqual(response.json()['status'], 'pending')
+        response = await self.async_client.post(reverse('request_book', args=[self.dune.pk]))
+        self.assertEqual(response.status_code, 400)
+
+        response = await self.async_client.post(reverse('request_book', args=[self.gone.pk]))
+        self.assertEqual(response.json()['position'], 1)
+        response = await self.async_client.post(reverse('request_book', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, FINE_PER_DAY='0.50')
+class OverdueSweepTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='reader', email='reader@example.com', phone='1')
+
+    def issue(self, isbn, due_date, status='issued'):
+        book = Book.objects.create(isbn=isbn, title=isbn, author='X', total_copies=1, available_copies=0)
+        return IssueRecord.objects.create(user=self.user, book=book, issue_date=due_date - timedelta(days=14),
+                                          due_date=due_date, status=status)
+
+    def test_sweep_marks_overdue_and_updates_fines_in_batches(self):
+        today = date(2025, 3, 10)
+        late = [self.issue(f'late{n}', today - timedelta(days=n % 3 + 1)) for n in range(7)]
+        due_today = self.issue('today', today)
+        returned = self.issue('returned', today - timedelta(days=30), status='returned')
+
+        self.assertEqual(inventory.sweep_overdue(today, batch_size=3, pause=0), 7)
+        for record in late:
+            record.refresh_from_db()
+            self.assertEqual(record.status, 'overdue')
+            self.assertEqual(record.fine_amount, Decimal('0.50') * (today - record.due_date).days)
+        due_today.refresh_from_db()
+        returned.refresh_from_db()
+        self.assertEqual((due_today.status, due_today.fine_amount), ('issued', 0))
+        self.assertEqual((returned.status, returned.fine_amount), ('returned', 0))
+
+        # A day later the same records are swept again and their fines grow
+        inventory.sweep_overdue(today + timedelta(days=1), batch_size=3, pause=0)
+        late[0].refresh_from_db()
+        self.assertEqual(late[0].fine_amount, Decimal('1.00'))
+
+    def test_return_records_the_fine(self):
+        record = self.issue('late', date.today() - timedelta(days=4))
+        inventory.return_issue(record.pk)
+        record.refresh_from_db()
+        self.assertEqual((record.status, record.fine_amount), ('returned', Decimal('2.00')))
+
+    def test_return_desk_reports_the_recorded_fine(self):
+        record = self.issue('late', date.today() - timedelta(days=4))
+        self.client.force_login(get_user_model().objects.create(username='desk', email='desk@example.com',
+                                                                phone='2', is_staff=True))
+        # A second calculation (say, just past midnight) would come out differently
+        with mock.patch.object(inventory, 'fine_for', side_effect=[Decimal('2.00'), Decimal('2.50')]):
+            response = self.client.post(reverse('return_book_handler'), {'issue_id': record.pk}, follow=True)
+
+        record.refresh_from_db()
+        self.assertEqual(record.fine_amount, Decimal('2.00'))
+        self.assertIn('Late return: fine due 2.00.', [str(message) for message in response.context['messages']])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StatCounterTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='reader', email='reader@example.com', phone='1')
+
+    def test_counters_follow_the_lending_cycle(self):
+        dune = Book.objects.create(isbn='1', title='Dune', author='Frank Herbert', total_copies=2, available_copies=2)
+        emma = Book.objects.create(isbn='2', title='Emma', author='Jane Austen', total_copies=1, available_copies=1)
+        self.client.force_login(self.user)
+        self.client.post(reverse('request_book', args=[dune.pk]))
+        self.assertEqual(stats.snapshot()['pending_requests'], 1)
+
+        issue = inventory.approve_request(Request.objects.get().pk)
+        late = IssueRecord.objects.create(user=self.user, book=emma, issue_date=date.today() - timedelta(days=20),
+                                          due_date=date.today() - timedelta(days=6), status='issued')
+        Book.objects.filter(pk=emma.pk).update(available_copies=0)
+        stats.reconcile()  # the queryset update above is outside the counted paths
+        inventory.sweep_overdue(pause=0)
+        counters = stats.snapshot()
+        self.assertEqual((counters['pending_requests'], counters['active_issues'], counters['overdue_issues']),
+                         (0, 2, 1))
+        self.assertEqual(UserStats.objects.get(user=self.user).active_issues, 2)
+
+        inventory.return_issue(issue.pk)
+        inventory.return_issue(late.pk)
+        dune.delete()
+        self.assertEqual(stats.snapshot(), stats.actual())
+        self.assertEqual(UserStats.objects.get(user=self.user).active_issues, 0)
+        self.assertEqual(stats.reconcile(), {})
+
+    def test_reconcile_corrects_drift(self):
+        Book.objects.create(isbn='1', title='Dune', author='Frank Herbert', total_copies=3, available_copies=3)
+        StatCounter.objects.filter(name='total_copies').update(value=99)
+        UserStats.objects.create(user=self.user, active_issues=4)
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile_stats', '--check', stdout=io.StringIO())
+        self.assertEqual(stats.snapshot()['total_copies'], 99)
+
+        call_command('reconcile_stats', stdout=io.StringIO())
+        self.assertEqual(stats.snapshot(), stats.actual())
+        self.assertEqual(UserStats.objects.get(user=self.user).active_issues, 0)
+        call_command('reconcile_stats', '--check', stdout=io.StringIO())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, FINE_PER_DAY='0.50')
+class BulkCirculationTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.admin = User.objects.create(username='desk', email='desk@example.com', phone='0',
+                                         is_staff=True, is_superuser=True)
+        self.readers = [User.objects.create(username=f'reader{n}', email=f'reader{n}@example.com', phone=str(n + 1))
+                        for n in range(4)]
+        self.client.force_login(self.admin)
+        stats.snapshot()
+
+    def post(self, name, ids):
+        return self.client.post(reverse(name), {'ids': ids}, content_type='application/json')
+
+    def test_scarce_copies_go_to_the_oldest_requests(self):
+        dune = Book.objects.create(isbn='1', title='Dune', author='Frank Herbert', total_copies=2, available_copies=2)
+        emma = Book.objects.create(isbn='2', title='Emma', author='Jane Austen', total_copies=1, available_copies=1)
+        requests = [Request.objects.create(user=reader, book=dune) for reader in self.readers[:3]]
+        Request.objects.filter(pk=requests[0].pk).update(request_date=date.today() - timedelta(days=1))
+        holder = Request.objects.create(user=self.readers[3], book=emma)
+        IssueRecord.objects.create(user=self.readers[3], book=emma, issue_date=date.today(),
+                                   due_date=date.today(), status='issued')
+
+        # Newest first in the body, so the order of the IDs sent doesn't decide who gets a copy
+        ids = [requests[2].pk, requests[1].pk, requests[0].pk, holder.pk, 0]
+        results = self.post('bulk_approve_requests', ids).json()['results']
+        self.assertEqual([(r['id'], r['status']) for r in results], [
+            (requests[2].pk, 'rejected'), (requests[1].pk, 'approved'), (requests[0].pk, 'approved'),
+            (holder.pk, 'rejected'), (0, 'skipped'),
+        ])
+        self.assertEqual(results[0]['message'], 'No copies available.')
+        self.assertEqual(results[3]['message'], 'The user already has this book issued.')
+        dune.refresh_from_db()
+        self.assertEqual(dune.available_copies, 0)
+        self.assertEqual(IssueRecord.objects.get(pk=results[1]['issue_id']).user, self.readers[1])
+        self.assertEqual(stats.reconcile(fix=False), {})
+
+        # Everything in the batch has been handled now
+        self.assertEqual({r['status'] for r in self.post('bulk_reject_requests', ids).json()['results']}, {'skipped'})
+
+    def test_reject_batch(self):
+        dune = Book.objects.create(isbn='1', title='Dune', author='Frank Herbert', total_copies=1, available_copies=1)
+        requests = [Request.objects.create(user=reader, book=dune) for reader in self.readers]
+        results = self.post('bulk_reject_requests', [r.pk for r in requests]).json()['results']
+        self.assertEqual({r['status'] for r in results}, {'rejected'})
+        self.assertEqual(stats.snapshot()['pending_requests'], 0)
+        self.assertEqual(self.post('bulk_reject_requests', {'not': 'a list'}).status_code, 400)
+        self.assertEqual(self.post('bulk_reject_requests', list(range(inventory.MAX_BATCH + 1))).status_code, 400)
+
+    def test_rejecting_a_request_already_approved_leaves_it_approved(self):
+        dune = Book.objects.create(isbn='1', title='Dune', author='Frank Herbert', total_copies=1, available_copies=1)
+        approved = Request.objects.create(user=self.readers[0], book=dune)
+        issue = inventory.approve_request(approved.pk)
+
+        response = self.client.get(reverse('reject_request', args=[approved.pk]), follow=True)
+        self.assertEqual(Request.objects.get(pk=approved.pk).status, 'approved')
+        self.assertEqual(IssueRecord.objects.get(pk=issue.pk).status, 'issued')
+        self.assertIn('already handled', ' '.join(str(message) for message in response.context['messages']))
+        self.assertEqual(stats.reconcile(fix=False), {})
+
+        pending = Request.objects.create(user=self.readers[1], book=dune)
+        self.client.get(reverse('reject_request', args=[pending.pk]))
+        self.assertEqual(Request.objects.get(pk=pending.pk).status, 'rejected')
+        self.assertEqual(stats.reconcile(fix=False), {})
+
+    def test_staff_who_cannot_decide_requests_get_no_bulk_bar_and_a_json_403(self):
+        dune = Book.objects.create(isbn='1', title='Dune', author='Frank Herbert', total_copies=1, available_copies=1)
+        pending = Request.objects.create(user=self.readers[0], book=dune)
+        self.admin.is_superuser = False
+        self.admin.save()
+
+        html = self.client.get(reverse('admin_requests')).content.decode()
+        self.assertIn(f'id="request-{pending.pk}"', html)
+        self.assertNotIn('bulkRequests(', html.split('<script>')[0])
+        self.assertNotIn('bulk-select', html.split('<script>')[0])
+
+        for name in ('bulk_approve_requests', 'bulk_reject_requests'):
+            response = self.post(name, [pending.pk])
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(response.json()['status'], 'error')
+        self.assertEqual(Request.objects.get(pk=pending.pk).status, 'pending')
+
+        self.client.force_login(self.readers[0])
+        self.assertEqual(self.post('bulk_return_issues', [1]).status_code, 403)
+
+    def test_returns_put_copies_back_and_serve_the_waiting_list(self):
+        dune = Book.objects.create(isbn='1', title='Dune', author='Frank Herbert', total_copies=3, available_copies=0)
+        emma = Book.objects.create(isbn='2', title='Emma', author='Jane Austen', total_copies=1, available_copies=0)
+        late = date.today() - timedelta(days=4)
+        loans = [
+            IssueRecord.objects.create(user=self.readers[0], book=dune, issue_date=late, due_date=late, status='overdue'),
+            IssueRecord.objects.create(user=self.readers[1], book=dune, issue_date=late, due_date=date.today(),
+                                       status='issued'),
+            IssueRecord.objects.create(user=self.readers[0], book=emma, issue_date=late, due_date=date.today(),
+                                       status='issued'),
+        ]
+        waiting = WaitingList.objects.enqueue(self.readers[2], dune)
+        WaitingList.objects.enqueue(self.readers[3], emma)
+        returned = IssueRecord.objects.create(user=self.readers[2], book=emma, issue_date=late, due_date=late,
+                                              status='returned')
+
+        results = self.post('bulk_return_issues', [loan.pk for loan in loans] + [returned.pk]).json()['results']
+        self.assertEqual([r['status'] for r in results], ['returned', 'returned', 'returned', 'skipped'])
+        self.assertEqual([r['fine'] for r in results[:3]], ['2.00', '0.00', '0.00'])
+
+        # One of Dune's two returned copies goes to the waiting reader, Emma's to hers
+        handed_on = IssueRecord.objects.get(pk=results[0]['next_issue_id'])
+        self.assertEqual((handed_on.user, handed_on.book, results[1]['next_issue_id']), (self.readers[2], dune, None))
+        self.assertEqual(IssueRecord.objects.get(pk=results[2]['next_issue_id']).user, self.readers[3])
+        self.assertFalse(WaitingList.objects.filter(pk=waiting.pk).exists())
+        dune.refresh_from_db()
+        emma.refresh_from_db()
+        self.assertEqual((dune.available_copies, emma.available_copies), (1, 0))
+        self.assertEqual(stats.reconcile(fix=False), {})
+
+    def test_batch_cost_does_not_grow_with_its_size(self):
+        def approve(count):
+            books = Book.objects.bulk_create(
+                Book(isbn=f'{count}-{n}', title='T', author='A', total_copies=1, available_copies=1) for n in range(count)
+            )
+            ids = [Request.objects.create(user=self.readers[n % 4], book=book).pk for n, book in enumerate(books)]
+            with CaptureQueriesContext(connection) as queries:
+                self.post('bulk_approve_requests', ids)
+            return len(queries)
+
+        self.assertEqual(approve(2), approve(40))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser(username='admin', email='admin@example.com',
+                                                               password='pw', phone='1')
+        self.client.force_login(self.admin)
+        books = Book.objects.bulk_create(
+            Book(isbn=str(n), title=f'Book {n}', author='X', total_copies=1, available_copies=1) for n in range(30)
+        )
+        # Several requests share each date, so the pk has to break ties
+        Request.objects.bulk_create(Request(user=self.admin, book=book, status='approved') for book in books)
+        for n, request in enumerate(Request.objects.order_by('pk')):
+            Request.objects.filter(pk=request.pk).update(request_date=date(2025, 1, 1) + timedelta(days=n // 4))
+
+    def test_pages_walk_the_history_newest_first_without_gaps(self):
+        expected = list(Request.objects.order_by('-request_date', '-request_id').values_list('book__title', flat=True))
+        seen, params = [], {'status': 'approved'}
+        while True:
+            # Session, user, then the page itself: a deep page costs what the first one does
+            with self.assertNumQueries(3):
+                data = self.client.get(reverse('admin_requests_page'), params).json()
+            seen += re.findall(r'Book \d+', data['html'])
+            if not data['next_cursor']:
+                break
+            params['cursor'] = data['next_cursor']
+        self.assertEqual(seen, expected)
+
+        # A request made while paging shows up on the first page, not in the middle
+        Request.objects.create(user=self.admin, book=Book.objects.get(title='Book 0'), status='approved')
+        self.assertIn('Book 0', self.client.get(reverse('admin_requests_page'), {'status': 'approved'}).json()['html'])
+
+    def test_bad_cursor_and_status_are_rejected(self):
+        url = reverse('admin_requests_page')
+        self.assertEqual(self.client.get(url, {'status': 'approved', 'cursor': 'nope'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'status': 'everything'}).status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogueScrollTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='reader', email='reader@example.com', phone='1')
+        self.client.force_login(self.user)
+        # Repeated titles, so (title, book_id) has to break ties
+        for n in range(21):
+            Book.objects.create(isbn=str(n), title=f'Book {n % 7}', author='X', total_copies=1, available_copies=1)
+        stats.snapshot()
+
+    def test_browse_scrolls_by_cursor_without_count_or_offset(self):
+        expected = list(Book.objects.order_by('title', 'book_id').values_list('pk', flat=True))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('user_browse'))
+        self.assertEqual(response.context['books_page'].paginator.num_pages, 3)
+        seen = [book.pk for book in response.context['books_page']]
+        cursor = response.context['next_cursor']
+        while cursor:
+            with CaptureQueriesContext(connection) as more:
+                data = self.client.get(reverse('browse_books_page'), {'cursor': cursor}).json()
+            queries.captured_queries.extend(more.captured_queries)
+            seen += [int(pk) for pk in re.findall(r'data-book-id="(\d+)"', data['books_html'])]
+            cursor = data['next_cursor']
+
+        self.assertEqual(seen, expected)
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('COUNT(', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_shallow_page_numbers_still_work(self):
+        response = self.client.get(reverse('user_browse'), {'page': 2})
+        expected = list(Book.objects.order_by('title', 'book_id').values_list('pk', flat=True))[8:16]
+        self.assertEqual([book.pk for book in response.context['books_page']], expected)
+
+    def test_pagination_bar_stays_the_same_size_as_the_catalogue_grows(self):
+        middle = Paginator(range(10**6), 8).page(60000)
+        self.assertEqual(page_links(middle), [1, Paginator.ELLIPSIS, 59998, 59999, 60000, 60001, 60002,
+                                              Paginator.ELLIPSIS, 125000])
+
+        # A counter saying a million books: still Previous, 1-4 and Next, with no deep last-page link
+        StatCounter.objects.filter(name='books').update(value=10**6)
+        # Walking every page number is what made the bar's cost grow with the catalogue
+        with mock.patch.object(Paginator, 'page_range', new_callable=mock.PropertyMock, side_effect=AssertionError):
+            html = self.client.get(reverse('user_browse'), {'page': 2}).content.decode()
+        self.assertEqual(html.count('class="pagination-link'), 6)
+        self.assertNotIn('page=125000', html)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class IssueHistorySearchTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='pw', phone='0')
+        self.client.force_login(self.admin)
+        self.alice = User.objects.create(username='alice.w', first_name='Alice', email='a@example.com', phone='1')
+        self.bob = User.objects.create(username='bobby', first_name='Robert', email='b@example.com', phone='2')
+        self.dune = Book.objects.create(isbn='9780441013593', title='Dune', author='Frank Herbert',
+                                        total_copies=5, available_copies=5)
+        self.emma = Book.objects.create(isbn='9780141439587', title='Emma', author='Jane Austen',
+                                        total_copies=5, available_copies=5)
+
+    def issue(self, user, book, status='returned'):
+        return IssueRecord.objects.create(user=user, book=book, issue_date='2025-01-01', due_date='2025-01-15',
+                                          status=status)
+
+    def search(self, query, status=''):
+        return [record.pk for record in self.client.get(reverse('issue_history'),
+                                                        {'search': query, 'status': status}).context['records']]
+
+    def test_substring_prefix_and_status(self):
+        alice_dune = self.issue(self.alice, self.dune, status='issued')
+        alice_emma = self.issue(self.alice, self.emma)
+        bob_dune = self.issue(self.bob, self.dune)
+
+        self.assertEqual(self.search('UNE'), [bob_dune.pk, alice_dune.pk])  # inside a title, any case
+        self.assertEqual(self.search('0141439'), [alice_emma.pk])  # inside an ISBN
+        self.assertEqual(self.search('rob'), [bob_dune.pk])  # first name prefix
+        self.assertEqual(self.search('alice dune'), [alice_dune.pk])  # every term must match
+        self.assertEqual(self.search('al em'), [alice_emma.pk])  # terms too short for the index
+        self.assertEqual(self.search('dune', status='returned'), [bob_dune.pk])
+        self.assertEqual(self.search('dune"*'), [])  # FTS syntax is matched literally
+
+    def test_index_follows_edits_and_deletes(self):
+        record = self.issue(self.bob, self.dune)
+        Book.objects.filter(pk=self.dune.pk).update(title='Children of Dune')
+        self.assertEqual(self.search('children'), [record.pk])
+        get_user_model().objects.filter(pk=self.bob.pk).update(username='robert.b')
+        self.assertEqual(self.search('robert.b'), [record.pk])
+        self.assertEqual(self.search('bobby'), [])
+        record.delete()
+        self.assertEqual(self.search('children'), [])
+
+    def test_search_pages_by_cursor(self):
+        records = [self.issue(self.alice, self.emma) for _ in range(25)]
+        expected = [record.pk for record in reversed(records)]
+        seen, params = [], {'search': 'emma'}
+        while True:
+            response = self.client.get(reverse('issue_history'), params)
+            seen += [record.pk for record in response.context['records']]
+            if not response.context['next_cursor']:
+                break
+            params['cursor'] = response.context['next_cursor']
+        self.assertEqual(seen, expected)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RecentlyViewedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(username='reader', email='reader@example.com', phone='1')
+        self.client.force_login(self.user)
+        self.books = [Book.objects.create(isbn=str(n), title=f'Book {n}', author='X', total_copies=1, available_copies=1)
+                      for n in range(10)]
+        # A fresh per-process tally, so views from other tests aren't flushed into this one;
+        # flushed by hand, as a timer thread can't write inside the test's transaction
+        patcher = mock.patch.object(activity, 'view_counter', activity.ViewCounter(timer=False))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def view(self, *books):
+        for book in books:
+            self.client.get(reverse('user_book_details', args=[book.pk]))
+
+    def test_most_recent_first_without_touching_the_session(self):
+        b = self.books
+        self.view(b[0], b[1], b[2], b[0])
+        self.assertNotIn('recently_viewed', self.client.session)
+
+        # Session, user, the trending ranking (then cached for a minute), recommendations,
+        # the books for every row, their genres
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('user_dashboard'))
+        self.assertEqual(response.context['recently_viewed'], [b[0], b[2], b[1]])
+
+        self.view(*b)
+        self.assertEqual(activity.recent_ids(self.user.pk), [book.pk for book in reversed(b)][:activity.RECENT_CAPACITY])
+
+    def test_trending_ranks_everyones_views(self):
+        other = get_user_model().objects.create(username='other', email='other@example.com', phone='2')
+        b = self.books
+        self.view(b[3], b[3], b[5])
+        self.client.force_login(other)
+        self.view(b[3], b[5], b[5], b[5], b[7])
+        activity.view_counter.flush()
+        self.assertEqual(activity.trending_ids(), [b[5].pk, b[3].pk, b[7].pk])
+
+        # The cached ranking can name a book deleted since; the dashboard skips it
+        b[7].delete()
+        self.assertEqual(self.client.get(reverse('user_dashboard')).context['trending'], [b[5], b[3]])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ViewCounterFlushTests(TransactionTestCase):
+    """Buffered views reach BookViewCount without waiting for the next view."""
+
+    def setUp(self):
+        self.book = Book.objects.create(isbn='1', title='Dune', author='Frank Herbert', total_copies=1, available_copies=1)
+
+    def written(self):
+        return sum(BookViewCount.objects.values_list('views', flat=True))
+
+    def test_a_full_buffer_is_written_straight_away(self):
+        counter = activity.ViewCounter(timer=False)
+        with mock.patch.object(activity.ViewCounter, 'FLUSH_VIEWS', 3):
+            for _ in range(3):
+                counter.add(self.book.pk)
+        self.assertEqual(self.written(), 3)
+
+    def test_an_idle_worker_writes_its_views_on_a_timer(self):
+        counter = activity.ViewCounter()
+        with mock.patch.object(activity.ViewCounter, 'FLUSH_SECONDS', 0.05):
+            counter.add(self.book.pk)
+            counter.add(self.book.pk)
+            timer = counter.timer
+        timer.join(5)
+        self.assertEqual(self.written(), 2)
+        self.assertIsNone(counter.timer)
+
+    def test_views_buffered_at_exit_are_written(self):
+        with mock.patch.object(activity, 'view_counter', activity.ViewCounter(timer=False)):
+            activity.view_counter.add(self.book.pk)
+            activity._flush_at_exit()
+        self.assertEqual(self.written(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.scratch)
+        User = get_user_model()
+        self.readers = [User.objects.create(username=f'reader{n}', email=f'r{n}@example.com', phone=str(n))
+                        for n in range(4)]
+        self.books = [Book.objects.create(isbn=str(n), title=f'Book {n}', author='X', total_copies=9,
+                                          available_copies=9) for n in range(5)]
+        patcher = mock.patch.object(activity, 'view_counter', activity.ViewCounter(timer=False))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def borrow(self, reader, *books):
+        for book in books:
+            IssueRecord.objects.create(user=self.readers[reader], book=self.books[book], issue_date='2025-01-01',
+                                       due_date='2025-01-15', status='returned')
+
+    def build(self, name='state.npz', full=False):
+        return recommendations.build(os.path.join(self.scratch, name), full=full)
+
+    def neighbours(self):
+        return {(row.book_id, row.rank): (row.neighbour_id, round(row.score, 4))
+                for row in BookNeighbour.objects.all()}
+
+    def test_neighbours_ranked_by_cosine_similarity(self):
+        self.borrow(0, 0, 1, 2)
+        self.borrow(1, 0, 1)
+        self.borrow(2, 0, 1, 0)  # borrowing a book again doesn't count twice
+        self.borrow(3, 2, 3)
+        self.build()
+
+        b = self.books
+        # Book 0: book 1 shares all three readers; book 2 shares one of its two
+        self.assertEqual(recommendations.also_borrowed(b[0].pk), [b[1], b[2]])
+        self.assertAlmostEqual(BookNeighbour.objects.get(book=b[0], rank=1).score, 1.0)
+        self.assertEqual(recommendations.also_borrowed(b[3].pk), [b[2]])
+        self.assertEqual(recommendations.also_borrowed(b[4].pk), [])
+
+    def test_incremental_runs_match_a_full_rebuild(self):
+        self.borrow(0, 0, 1)
+        self.borrow(1, 1, 2)
+        self.build()
+        self.borrow(2, 2, 3)
+        self.borrow(0, 3)
+        # Book 1's new reader shares nothing new, but lowers book 1's similarity in others' lists
+        self.borrow(3, 1)
+        self.assertEqual(self.build(), 4)
+        self.assertEqual(self.build(), 0)  # nothing new
+        incremental = self.neighbours()
+
+        self.build('fresh.npz', full=True)
+        self.assertEqual(self.neighbours(), incremental)
+
+    def test_pages_show_recommendations(self):
+        self.borrow(0, 0, 1, 2)
+        self.borrow(1, 0, 1)
+        self.borrow(2, 0)
+        self.build()
+        b = self.books
+
+        self.client.force_login(self.readers[2])
+        response = self.client.get(reverse('user_book_details', args=[b[0].pk]))
+        self.assertEqual(response.context['also_borrowed'], [b[1], b[2]])
+        # Only books reader 2 hasn't borrowed yet
+        self.assertEqual(self.client.get(reverse('user_dashboard')).context['recommended'], [b[1], b[2]])
+        self.client.force_login(self.readers[1])
+        self.assertEqual(self.client.get(reverse('user_dashboard')).context['recommended'], [b[2]])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class QueryPlanTests(TestCase):
+    """Every query the pages below run must be answered from an index, never a full table scan."""
+
+    PAGES = [
+        ('admin_dashboard', {}), ('admin_books', {}), ('admin_issue_receive', {}), ('issue_history', {}),
+        ('issue_history', {'status': 'issued'}), ('issue_history', {'search': 'dune', 'status': 'issued'}),
+        ('issue_history', {'cursor': encode_cursor(date(2025, 1, 1), 1)}), ('admin_users', {}), ('admin_requests', {}),
+        ('view_pending_requests', {}), ('user_dashboard', {}), ('user_my_books', {}),
+        ('user_my_requests', {}), ('user_browse', {}), ('filter_books', {}),
+        ('admin_requests_page', {'status': 'approved'}),
+        ('admin_requests_page', {'status': 'approved', 'cursor': encode_cursor(date(2025, 1, 1), 1)}),
+        ('admin_active_issues_page', {'cursor': encode_cursor(date(2025, 1, 1), 1)}),
+        ('browse_books_page', {'cursor': encode_cursor('Dune', 1)}),
+    ]
+    # "SCAN <table>" with no index after it; "SCAN CONSTANT ROW" and the like aren't tables
+    FULL_SCAN_RE = re.compile(r'\bSCAN (?!CONSTANT ROW)(\S+)$')
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_superuser(username='admin', email='admin@example.com',
+                                                              password='pw', phone='1')
+        language = Language.objects.create(language_name='English')
+        genre = Genre.objects.create(genre_name='Fiction')
+        self.book = Book.objects.create(isbn='1', title='Dune', author='Frank Herbert', language=language,
+                                        total_copies=2, available_copies=1)
+        self.book.genre.add(genre)
+        IssueRecord.objects.create(user=self.user, book=self.book, issue_date='2025-01-01',
+                                   due_date='2025-01-15', status='issued')
+        Request.objects.create(user=self.user, book=self.book, status='approved')
+        WaitingList.objects.enqueue(self.user, Book.objects.create(isbn='2', title='Emma', author='Jane Austen',
+                                                                    total_copies=1, available_copies=0))
+        self.client.force_login(self.user)
+        # Loading the search index reads every book once; that's not a page query
+        search_index.rebuild()
+
+    @contextmanager
+    def capture_selects(self):
+        # Record SQL and parameters separately: SQLite plans bound parameters
+        # differently from inlined literals (e.g. it can't use partial indexes)
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            if sql.startswith('SELECT'):
+                queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            yield queries
+
+    def full_scans(self, queries):
+        scans = []
+        with connection.cursor() as cursor:
+            for sql, params in queries:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                for row in cursor.fetchall():
+                    if self.FULL_SCAN_RE.search(row[-1]):
+                        scans.append(f'{row[-1]}  <-  {sql}')
+        return scans
+
+    def test_hot_queries_use_indexes(self):
+        for name, params in self.PAGES:
+            with self.subTest(page=name, params=params):
+                with self.capture_selects() as queries:
+                    self.client.get(reverse(name), params)
+                self.assertEqual(self.full_scans(queries), [])
+
+        with self.subTest(page='request_book'), self.capture_selects() as queries:
+            self.client.post(reverse('request_book', args=[self.book.pk]))
+        self.assertEqual(self.full_scans(queries), [])
+
+        with self.subTest(job='sweep_overdue'), self.capture_selects() as queries:
+            inventory.sweep_overdue(date(2025, 2, 1), pause=0)
+        self.assertEqual(self.full_scans(queries), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BenchSuiteTests(TestCase):
+    def setUp(self):
+        scratch = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scratch)
+        state = override_settings(RECOMMENDATIONS_STATE=os.path.join(scratch, 'state.npz'))
+        state.enable()
+        self.addCleanup(state.disable)
+
+    def test_seeded_library_serves_every_endpoint(self):
+        fixture = seed(books=100, readers=12, issues=80, requests=10, waiting=5, sessions=5)
+        # Bulk inserts send no signals; the seeder leaves the counters true all the same
+        self.assertEqual(stats.reconcile(fix=False), {})
+        self.assertGreater(WaitingList.objects.count(), 0)
+
+        results = measure_client(fixture, requests=3, warmup=0)
+        self.assertEqual(set(results), set(ENDPOINTS))
+        for name, numbers in results.items():
+            self.assertEqual(numbers['requests'], 3, name)
+            self.assertTrue(all(int(code) < 500 for code in numbers['statuses']), (name, numbers['statuses']))
+        self.assertEqual(stats.reconcile(fix=False), {})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class InventoryConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+
+    def run_concurrently(self, func, items):
+        """Runs func(item) for every item across THREADS threads released at the same moment."""
+        items = list(items)
+        barrier = threading.Barrier(self.THREADS)
+        results, errors = [], []
+
+        def worker(chunk):
+            barrier.wait()
+            try:
+                results.extend(func(item) for item in chunk)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(items[i::self.THREADS],)) for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_concurrent_approvals_and_returns_keep_counts_consistent(self):
+        book = Book.objects.create(isbn='1', title='Dune', author='Frank Herbert', total_copies=5, available_copies=5)
+        User = get_user_model()
+        users = [User.objects.create(username=f'reader{i}', email=f'reader{i}@example.com', phone=str(i))
+                 for i in range(24)]
+        requests = [Request.objects.create(user=user, book=book) for user in users]
+
+        # Every request is approved twice at once, as if two admins clicked together
+        outcomes = self.run_concurrently(inventory.approve_request, [r.pk for r in requests] * 2)
+        issued = [outcome for outcome in outcomes if isinstance(outcome, IssueRecord)]
+        self.assertEqual(len(issued), 5)
+        self.assertEqual(outcomes.count('rejected'), 19)
+        self.assertEqual(outcomes.count(None), 24)
+        book.refresh_from_db()
+        self.assertEqual(book.available_copies, 0)
+        self.assertEqual(IssueRecord.objects.filter(status='issued').count(), 5)
+        self.assertEqual(Request.objects.filter(status='approved').count(), 5)
+
+        # Every issue is returned twice at once; only one return per issue counts
+        returned = self.run_concurrently(inventory.return_issue, [issue.pk for issue in issued] * 2)
+        self.assertEqual(returned.count(None), 5)
+        book.refresh_from_db()
+        self.assertEqual(book.available_copies, 5)
+        self.assertEqual(IssueRecord.objects.filter(status='returned').count(), 5)
+
+    def test_counter_updates_never_oversell_or_overfill(self):
+        book = Book.objects.create(isbn='2', title='Emma', author='Jane Austen', total_copies=5, available_copies=5)
+
+        taken = self.run_concurrently(inventory.take_copy, [book.pk] * 40)
+        self.assertEqual(taken.count(True), 5)
+        book.refresh_from_db()
+        self.assertEqual(book.available_copies, 0)
+
+        put_back = self.run_concurrently(inventory.put_back_copy, [book.pk] * 40)
+        self.assertEqual(put_back.count(True), 5)
+        book.refresh_from_db()
+        self.assertEqual(book.available_copies, 5)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MigrationTests(TransactionTestCase):
+    """Data migrations, run against rows written under the schema before them."""
+
+    def migrate(self, target=None):
+        """Migrates library_db to ``target`` (the latest without one) and returns the models as of then."""
+        executor = MigrationExecutor(connection)
+        node = ('library_db', target) if target else executor.loader.graph.leaf_nodes('library_db')[0]
+        executor.migrate([node])
+        self.addCleanup(call_command, 'migrate', verbosity=0)
+        return MigrationExecutor(connection).loader.project_state([node]).apps
+
+    def test_hyphenated_isbns_are_normalized_so_imports_update_them(self):
+        OldBook = self.migrate('0011_book_neighbours').get_model('library_db', 'Book')
+        OldBook.objects.create(isbn='978-1939042955', title='Python Crash Course', author='Eric Matthes',
+                               total_copies=2, available_copies=2)
+        OldBook.objects.create(isbn='9780131103627', title='C Programming', author='Kernighan',
+                               total_copies=1, available_copies=1)
+        self.migrate()
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'books.csv')
+        with open(path, 'w') as f:
+            f.write(ImportCatalogueTests.HEADER + '978-1939042955,Python Crash Course (3rd),Eric Matthes,,,English,4,4\n')
+        call_command('import_catalogue', path, stdout=io.StringIO())
+
+        self.assertEqual(Book.objects.count(), 2)
+        book = Book.objects.get(title__startswith='Python')
+        self.assertEqual((book.isbn, book.title, book.total_copies), ('9781939042955', 'Python Crash Course (3rd)', 4))
+
+    def test_duplicate_active_issues_are_closed_before_the_constraint(self):
+        apps = self.migrate('0003_waitinglist_queue')
+        OldUser, OldBook, OldIssue = (apps.get_model('library_db', name) for name in ('CustomUser', 'Book', 'IssueRecord'))
+        reader = OldUser.objects.create(username='reader', email='reader@example.com', phone='1')
+        other = OldUser.objects.create(username='other', email='other@example.com', phone='2')
+        book = OldBook.objects.create(isbn='1', title='Dune', author='X', total_copies=3, available_copies=0)
+        # What approving one request twice left behind
+        kept = OldIssue.objects.create(user=reader, book=book, issue_date='2025-01-01', due_date='2025-01-15', status='overdue')
+        twice = OldIssue.objects.create(user=reader, book=book, issue_date='2025-01-01', due_date='2025-01-15', status='issued')
+        OldIssue.objects.create(user=other, book=book, issue_date='2025-01-02', due_date='2025-01-16', status='issued')
+        self.migrate()
+
+        self.assertEqual(
+            set(IssueRecord.objects.values_list('pk', 'status', 'return_date')),
+            {(kept.pk, 'overdue', None), (twice.pk, 'returned', date(2025, 1, 1)),
+             (twice.pk + 1, 'issued', None)},
+        )
+        self.assertEqual(Book.objects.get(pk=book.pk).available_copies, 1)